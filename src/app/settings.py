@@ -171,8 +171,22 @@ CELERY = {
     'task_reject_on_worker_lost': env('CELERY_TASK_REJECT_ON_WORKER_LOST', cast=bool, default=True),
     'timezone': TIME_ZONE,
     'enable_utc': False,
+
+    # Подготовка словарей, импорт версий и обслуживание дампов идут в разные очереди, чтобы у каждой был свой
+    # воркер со своими concurrency и prefetch (см. docker-compose.yaml)
+    'task_routes': {
+        'wdf.tasks.prepare_dump': {'queue': 'prepare'},
+        'wdf.tasks.import_single_pass': {'queue': 'prepare'},
+        'wdf.tasks.schedule_dump': {'queue': 'schedule'},
+        'wdf.tasks.import_ranges': {'queue': 'import'},
+        'wdf.tasks.import_dump': {'queue': 'import'},
+        'wdf.tasks.wrap_dump': {'queue': 'wrap'},
+        'wdf.tasks.prune_dump': {'queue': 'prune'},
+        'wdf.tasks.merge_duplicate': {'queue': 'merge'},
+    },
 }
 
 # Application-specific configs
 SH_APIKEY = env('SH_APIKEY')
 SH_PROJECT_ID = env('SH_PROJECT_ID')
+SH_ENDPOINT = env('SH_ENDPOINT', cast=str, default='')  # пусто – боевой storage.scrapinghub.com
@@ -4,4 +4,5 @@ app_name = 'api_v1'
 urlpatterns = [
     path('users/', include('users.urls')),
     path('healthchecks/', include('django_healthchecks.urls')),
+    path('metrics/', include('wdf.urls')),
 ]
@@ -1,10 +1,12 @@
 from django.contrib import admin
 
 from wdf.models import (
-    DictBrand, DictCatalog, DictMarketplace, DictParameter, DictSeller, Dump, Parameter, Position, Price, Rating,
-    Reviews, Sales, Seller, Sku, Version)
+    DictBrand, DictCatalog, DictMarketplace, DictParameter, DictSeller, Dump, DumpRange, Parameter, Position, Price,
+    Rating, RejectedItem, Reviews, Sales, Seller, Sku, Version)
 
 admin.site.register(Dump)
+admin.site.register(DumpRange)
+admin.site.register(RejectedItem)
 admin.site.register(Version)
 admin.site.register(Sku)
 admin.site.register(Price)
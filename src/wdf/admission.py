@@ -0,0 +1,131 @@
+"""
+Допуск чанков к записи в зависимости от состояния БД.
+
+Когда параллельно работает много задач импорта, Postgres упирается в ожидания блокировок, лавину чекпойнтов
+и лимит соединений, и общая скорость падает ниже, чем у меньшего числа воркеров. Перед каждым чанком подготовки и
+перед транзакцией каждого диапазона импорта индексатор спрашивает AdmissionGate, можно ли писать дальше, и если
+какой-то из сигналов выше порога, ждет. Внутри транзакции импорта не ждет: она держала бы блокировки и соединение.
+
+Сигналы берутся из источника с методом read(), который возвращает словарь с ключами HEALTH_FIELDS:
+
+* PostgresHealthSource – pg_stat_activity и pg_stat_replication текущей БД
+* FakeHealthSource – заранее заданная последовательность значений для тестов
+"""
+import environ
+import logging
+import time
+from django.db import connection
+
+from wdf.metrics import ADMISSION_DELAYS
+
+env = environ.Env(DEBUG=(bool, False))
+environ.Env.read_env()
+
+logger = logging.getLogger('wdf.indexer')
+logger.setLevel(logging.INFO)
+
+HEALTH_FIELDS = ('active_backends', 'lock_waits', 'replication_lag')
+
+
+class PostgresHealthSource(object):
+    """
+    Активные запросы и ожидания блокировок в текущей БД (кроме нашего соединения) и максимальное отставание реплик
+    в секундах
+    """
+
+    def read(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FILTER (WHERE state = 'active'), count(*) FILTER (WHERE wait_event_type = 'Lock') "
+                'FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid();')
+
+            active_backends, lock_waits = cursor.fetchone()
+
+            cursor.execute('SELECT COALESCE(EXTRACT(EPOCH FROM max(replay_lag)), 0) FROM pg_stat_replication;')
+
+            replication_lag = float(cursor.fetchone()[0])
+
+        return {'active_backends': active_backends, 'lock_waits': lock_waits, 'replication_lag': replication_lag}
+
+
+class FakeHealthSource(object):
+    """
+    Источник сигналов для тестов: отдает значения из списка по очереди, последнее повторяется
+    """
+
+    def __init__(self, readings):
+        self.readings = list(readings)
+        self.reads = 0
+
+    def read(self):
+        reading = self.readings[min(self.reads, len(self.readings) - 1)]
+        self.reads += 1
+
+        return {**dict.fromkeys(HEALTH_FIELDS, 0), **reading}
+
+
+class AdmissionGate(object):
+    """
+    Проверка сигналов перед чанком. Порог 0 отключает проверку сигнала. Если БД перегружена, gate ждет interval
+    секунд и проверяет снова, но не дольше max_wait – после этого чанк пропускается, чтобы импорт не встал совсем
+    """
+
+    def __init__(self, source, max_active_backends=0, max_lock_waits=0, max_replication_lag=0, interval=1.0, max_wait=300.0, sleep=time.sleep):
+        self.source = source
+        self.thresholds = {
+            'active_backends': max_active_backends,
+            'lock_waits': max_lock_waits,
+            'replication_lag': max_replication_lag,
+        }
+        self.interval = interval
+        self.max_wait = max_wait
+        self.sleep = sleep
+
+    def get_exceeded(self):
+        health = self.source.read()
+
+        return [name for name, threshold in self.thresholds.items() if threshold and health[name] > threshold], health
+
+    def wait(self, log_prefix=''):
+        """
+        Ждет, пока сигналы не вернутся под пороги. Возвращает время ожидания в секундах
+        """
+        waited = 0.0
+
+        while True:
+            exceeded, health = self.get_exceeded()
+
+            if len(exceeded) == 0:
+                return waited
+
+            if waited >= self.max_wait:
+                logger.warning(f'{log_prefix}Database is still overloaded after {round(waited, 2)}s ({", ".join(exceeded)}: {health}), proceeding')
+
+                return waited
+
+            for reason in exceeded:
+                ADMISSION_DELAYS.labels(reason=reason).inc()
+
+            logger.info(f'{log_prefix}Database is overloaded ({", ".join(exceeded)}: {health}), holding chunk for {self.interval}s')
+
+            self.sleep(self.interval)
+            waited += self.interval
+
+
+def get_admission_gate():
+    """
+    Gate с порогами из окружения. None, если все пороги нулевые или БД не Postgres
+    """
+    gate = AdmissionGate(
+        PostgresHealthSource(),
+        max_active_backends=env('INDEXER_ADMISSION_MAX_ACTIVE_BACKENDS', cast=int, default=0),
+        max_lock_waits=env('INDEXER_ADMISSION_MAX_LOCK_WAITS', cast=int, default=0),
+        max_replication_lag=env('INDEXER_ADMISSION_MAX_REPLICATION_LAG', cast=float, default=0),
+        interval=env('INDEXER_ADMISSION_INTERVAL', cast=float, default=1.0),
+        max_wait=env('INDEXER_ADMISSION_MAX_WAIT', cast=float, default=300.0),
+    )
+
+    if connection.vendor != 'postgresql' or not any(gate.thresholds.values()):
+        return None
+
+    return gate
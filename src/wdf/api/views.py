@@ -0,0 +1,15 @@
+from django.http import HttpResponse
+from django.views import View
+
+from wdf.metrics import export_metrics
+
+
+class MetricsView(View):
+    """
+    Метрики индексатора в формате Prometheus
+    """
+
+    def get(self, request):
+        payload, content_type = export_metrics()
+
+        return HttpResponse(payload, content_type=content_type)
@@ -0,0 +1,367 @@
+"""
+Асинхронный импорт диапазонов дампа в одном процессе.
+
+В Celery каждый диапазон импортирует отдельный воркер, и пока он ждет ответа Scrapinghub или COPY, процесс простаивает.
+Здесь несколько диапазонов импортируются одним процессом на asyncio: айтемы скачиваются через aiohttp (следующее окно
+запрашивается, пока обрабатывается текущее), а версии пишутся через COPY на соединениях asyncpg, у каждого диапазона
+свое соединение и своя транзакция. Сбор словарей, кеши и сборка строк – те же, что в Indexer.process_chunk: они
+работают с Django ORM и поэтому выполняются по очереди в отдельном потоке, а asyncio перекрывает только ввод-вывод.
+
+Диапазоны арендуются из той же очереди DumpRange, что и в import_ranges, и отмечаются импортированными в транзакции
+с их данными. Драйвер выбирается в команде import_dump (--driver asyncio), работает только на Postgres
+"""
+import aiohttp
+import asyncio
+import asyncpg
+import logging
+import msgpack
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections
+from django.utils import timezone
+
+from wdf.bulk_create_manager import BulkCreateManager
+from wdf.exceptions import DumpRangeLeaseLostError
+from wdf.metrics import ROWS_WRITTEN
+from wdf.models import Dump, DumpRange, Parameter, Position, Price, Rating, RejectedItem, Reviews, Sales, Version
+from wdf.rate_limiter import THROTTLING_STATUS_CODES, get_rate_limiter
+from wdf.tasks import RANGE_LEASE_SECONDS, RANGE_MAX_ATTEMPTS, RANGE_MIN_SPLIT, get_worker_name
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_SH_ENDPOINT = 'https://storage.scrapinghub.com/'
+
+# строки этих моделей пишутся через COPY в транзакции диапазона
+COPY_MODELS = (Version, Price, Rating, Sales, Reviews, Position, Parameter, RejectedItem)
+
+
+class CopyRowsCollector(object):
+    """
+    Замена BulkCreateManager для асинхронного драйвера: версии, их факты и отказы, которые индексатор отдает
+    на сохранение, не пишутся через соединение Django, а собираются в строки для COPY через asyncpg. Новые записи
+    словарей и SKU уходят в обычный bulk_manager и пишутся сразу: индексатор выбирает их из БД повторно сразу
+    после вставки
+    """
+
+    def __init__(self, bulk_manager=None):
+        self.bulk_manager = bulk_manager or BulkCreateManager()
+
+        self._queues = {}
+
+    def add(self, obj):
+        if not isinstance(obj, COPY_MODELS):
+            self.bulk_manager.add(obj)
+
+            return
+
+        self._queues.setdefault(type(obj), []).append(obj)
+
+    def done(self, log_prefix=''):
+        # собранные строки забирает драйвер (см. drain)
+        self.bulk_manager.done(log_prefix=log_prefix)
+
+    def drain(self):
+        """
+        Собранные строки [(модель, колонки, строки), ...] в порядке добавления моделей: версии раньше их цен,
+        рейтингов и т.п. Очереди при этом очищаются
+        """
+        tables = []
+
+        for model_class, objects in self._queues.items():
+            fields = model_class._meta.concrete_fields
+
+            # pre_save заполняет auto_now_add, как это сделал бы bulk_create
+            rows = [tuple(field.get_prep_value(field.pre_save(obj, True)) for field in fields) for obj in objects]
+
+            tables.append((model_class, [field.column for field in fields], rows))
+
+        self._queues = {}
+
+        return tables
+
+
+class ItemsFetcher(object):
+    """
+    Окна айтемов задачи из storage API Scrapinghub через aiohttp. Запросы проходят через общий лимит (см.
+    wdf.rate_limiter), ответы 429/503 и ошибки сети повторяются с паузой
+    """
+
+    def __init__(self, session, job_id, endpoint=None, apikey=None, rate_limiter=None, retries=5, backoff=1.0):
+        self.session = session
+        self.job_id = job_id
+        self.url = f'{(endpoint or DEFAULT_SH_ENDPOINT).rstrip("/")}/items/{job_id}'
+        self.auth = aiohttp.BasicAuth(apikey or settings.SH_APIKEY, '')
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+
+        self.requests_sent = 0
+
+    async def fetch(self, start, count):
+        for attempt in range(self.retries + 1):
+            pause = self.backoff * 2 ** attempt
+
+            await self.acquire()
+
+            try:
+                async with self.session.get(
+                        self.url,
+                        params={'start': f'{self.job_id}/{start}', 'count': str(count)},
+                        headers={'Accept': 'application/x-msgpack'},
+                        auth=self.auth) as response:
+                    self.requests_sent += 1
+
+                    if response.status in THROTTLING_STATUS_CODES:
+                        pause = max(pause, float(response.headers.get('Retry-After', 0) or 0))
+
+                        if self.rate_limiter is not None:
+                            self.rate_limiter.throttled(pause)
+
+                        logger.warning(f'Scrapinghub throttled items request for job {self.job_id} ({response.status}), retrying in {pause}s')
+                    else:
+                        response.raise_for_status()
+
+                        unpacker = msgpack.Unpacker(raw=False)
+                        unpacker.feed(await response.read())
+
+                        return list(unpacker)
+            except aiohttp.ClientError as e:
+                if attempt == self.retries:
+                    raise
+
+                logger.warning(f'Items request for job {self.job_id} failed ({e}), retrying in {pause}s')
+
+            await asyncio.sleep(pause)
+
+        raise aiohttp.ClientError(f'Items request for job {self.job_id} throttled {self.retries + 1} times')
+
+    async def acquire(self):
+        if self.rate_limiter is None:
+            return
+
+        while True:
+            wait, _factor = self.rate_limiter.try_acquire()
+
+            if wait <= 0:
+                return
+
+            await asyncio.sleep(wait)
+
+
+class AsyncImportDriver(object):
+    """
+    Импорт очереди диапазонов дампа concurrency корутинами одного процесса. Очередь должна быть уже заполнена
+    (см. wdf.tasks.schedule_ranges), последний импортированный диапазон запускает wrap_dump
+    """
+
+    def __init__(self, indexer, concurrency=4, lease_seconds=RANGE_LEASE_SECONDS):
+        self.indexer = indexer
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.worker = get_worker_name()
+
+        self.collector = CopyRowsCollector(self.indexer.bulk_manager)
+        self.indexer.bulk_manager = self.collector
+
+        self.items_imported = 0
+        self.ranges_imported = 0
+        self.dump_completed = False
+
+        self._orm_executor = None
+
+    def run(self):
+        dump = self.indexer.dump
+
+        if dump.state_code > Dump.PROCESSING:
+            logger.info(f'Dump already imported (state code {dump.state_code} – {dump.state}), skipping import step')
+
+            return self
+
+        if dump.state_code < Dump.PROCESSING:
+            dump.set_state(Dump.PROCESSING)
+            dump.save()
+
+        start_time = time.time()
+
+        asyncio.run(self.import_ranges())
+
+        time_spent = time.time() - start_time
+
+        logger.info(
+            f'Job {dump.job}: {self.ranges_imported} ranges ({self.items_imported} items) imported by {self.concurrency} coroutines in {time_spent}s, '
+            f'{round(self.items_imported / time_spent * 60)} items/min')
+
+        if self.dump_completed:
+            logger.info(f'Last range of job {dump.job} imported, wrapping dump')
+
+            self.indexer.wrap_dump()
+
+        return self
+
+    async def import_ranges(self):
+        # Django ORM и кеши индексатора не рассчитаны на параллельную работу: все обращения к ним идут через один поток
+        self._orm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='wdf-orm')
+
+        pool = await asyncpg.create_pool(**get_asyncpg_params(), min_size=1, max_size=self.concurrency)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                fetcher = ItemsFetcher(session, self.indexer.dump.job, endpoint=settings.SH_ENDPOINT, rate_limiter=get_rate_limiter())
+
+                await asyncio.gather(*(self.run_worker(worker_no, fetcher, pool) for worker_no in range(self.concurrency)))
+        finally:
+            await pool.close()
+            await self.orm(connections.close_all)
+
+            self._orm_executor.shutdown()
+
+    async def orm(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._orm_executor, lambda: func(*args, **kwargs))
+
+    async def run_worker(self, worker_no, fetcher, pool):
+        """
+        Аналог import_ranges: арендует диапазоны, пока очередь не опустеет
+        """
+        dump = self.indexer.dump
+        worker = f'{self.worker}:{worker_no}'
+
+        # раздел копии по артикулам импортирует один воркер, иначе SKU раздела снова могут создать двое
+        min_split = 0 if self.indexer.is_partitioned() else RANGE_MIN_SPLIT
+
+        while True:
+            dump_range = await self.orm(
+                DumpRange.claim, dump, worker, self.lease_seconds, workers=self.concurrency, min_split=min_split, max_attempts=RANGE_MAX_ATTEMPTS)
+
+            if dump_range is None:
+                break
+
+            try:
+                await self.import_range(dump_range, worker, fetcher, pool)
+            except DumpRangeLeaseLostError as e:
+                logger.error(f'Job {dump.job} import rolled back. {str(e)}')
+            except Exception:
+                await self.orm(dump.fail_range, dump_range.start, worker=worker, max_attempts=RANGE_MAX_ATTEMPTS)
+
+                raise
+
+    async def import_range(self, dump_range, worker, fetcher, pool):
+        dump = self.indexer.dump
+        items_count = 0
+        chunk_no = 1
+
+        logger.info(f'Importing dump for job {dump.job} from item {dump_range.start}, {dump_range.count} items max')
+
+        async with pool.acquire() as pg, pg.transaction():
+            async for chunk in self.iter_chunks(fetcher, dump_range.start, dump_range.count):
+                tables = await self.orm(self.process_chunk, chunk, dump_range.start, chunk_no)
+
+                for model_class, columns, rows in tables:
+                    start_time = time.time()
+
+                    await pg.copy_records_to_table(model_class._meta.db_table, records=rows, columns=columns)
+
+                    ROWS_WRITTEN.labels(model=model_class._meta.label, method='async_copy').inc(len(rows))
+
+                    logger.info(f'Job {dump.job}, range {dump_range.start}, chunk #{chunk_no}: {model_class._meta.label} saved via asyncpg COPY ({len(rows)} items) in {time.time() - start_time}s')
+
+                items_count += len(chunk)
+                chunk_no += 1
+
+            completed = await self.complete_range(pg, dump_range.start, items_count, worker)
+
+        logger.info(f'Dump for job {dump.job} imported from item {dump_range.start}')
+
+        self.items_imported += items_count
+        self.ranges_imported += 1
+        self.dump_completed = self.dump_completed or completed
+
+    def process_chunk(self, chunk, range_start, chunk_no):
+        """
+        Indexer.process_chunk в потоке ORM: словари и кеши обновляются через Django, строки версий забираются для COPY
+        """
+        self.indexer.log_prefix = f'Job {self.indexer.dump.job}, range {range_start}, chunk #{chunk_no}: '
+        self.indexer.process_chunk(chunk, chunk_no=chunk_no, save_versions=True)
+
+        return self.collector.drain()
+
+    async def iter_chunks(self, fetcher, start, count):
+        """
+        Чанки диапазона по get_chunk_size айтемов. Следующий чанк запрашивается, пока обрабатывается текущий
+        """
+        chunk_size = self.indexer.get_chunk_size
+        end = start + count
+        offset = start
+        pending = None
+
+        try:
+            while offset < end:
+                requested = min(chunk_size, end - offset)
+
+                if pending is None:
+                    pending = asyncio.ensure_future(self.fetch(fetcher, offset, requested))
+
+                chunk = await pending
+                offset += requested
+
+                if len(chunk) < requested:
+                    pending = None
+                    offset = end
+                else:
+                    pending = asyncio.ensure_future(self.fetch(fetcher, offset, min(chunk_size, end - offset))) if offset < end else None
+
+                if len(chunk) > 0:
+                    yield chunk
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def fetch(self, fetcher, start, count):
+        spool = self.indexer.get_spool()
+
+        if spool is not None:
+            return await asyncio.get_running_loop().run_in_executor(None, lambda: list(spool.iter_items(start=start, count=count)))
+
+        return await fetcher.fetch(start, count)
+
+    async def complete_range(self, pg, start, items_imported, worker):
+        """
+        Dump.complete_range в транзакции asyncpg, чтобы диапазон отмечался импортированным вместе с данными
+        """
+        dump = self.indexer.dump
+
+        # FOR NO KEY UPDATE, как в Dump.lock_for_range_completion
+        await pg.execute(f'SELECT id FROM {Dump._meta.db_table} WHERE id = $1 FOR NO KEY UPDATE', dump.pk)
+
+        updated = await pg.fetch(
+            f'UPDATE {DumpRange._meta.db_table} SET state_code = $1, items_imported = $2, finished_at = $3, lease_expires_at = NULL '
+            f'WHERE dump_id = $4 AND start = $5 AND state_code <> $1 AND leased_by = $6 RETURNING id',
+            DumpRange.PROCESSED, items_imported, timezone.now(), dump.pk, start, worker)
+
+        if len(updated) == 0:
+            raise DumpRangeLeaseLostError(f'Lease on range from item {start} was lost by {worker}')
+
+        pending = await pg.fetchval(
+            f'SELECT count(*) FROM {DumpRange._meta.db_table} WHERE dump_id = $1 AND state_code <> $2', dump.pk, DumpRange.PROCESSED)
+
+        return pending == 0
+
+
+def get_asyncpg_params():
+    """
+    Параметры подключения asyncpg к той же БД, что и у Django
+    """
+    if connection.vendor != 'postgresql':
+        raise ImproperlyConfigured(f'Async import driver works on Postgres only, not on {connection.vendor}')
+
+    db = connection.settings_dict
+
+    return {
+        'database': db['NAME'],
+        'user': db['USER'] or None,
+        'password': db['PASSWORD'] or None,
+        'host': db['HOST'] or None,
+        'port': int(db['PORT']) if db['PORT'] else None,
+    }
@@ -8,6 +8,9 @@ from django.apps import apps
 from django.db import connection, models, transaction
 from io import StringIO
 
+from wdf.metrics import COPY_RETRIES, ROWS_WRITTEN
+from wdf.stage_timer import StageTimer
+
 logger = logging.getLogger('wdf.indexer')
 logger.setLevel(logging.INFO)
 
@@ -22,10 +25,13 @@ class BulkCreateManager(object):
     Переделанная и доработанная версия из статьи https://www.caktusgroup.com/blog/2019/01/09/django-bulk-inserts/
     """
 
-    def __init__(self, max_chunk_size=None, copy_safe_models=()):
+    def __init__(self, max_chunk_size=None, copy_safe_models=(), timer=None):
         self._copy_safe_models = copy_safe_models
         self._max_chunk_size = max_chunk_size
 
+        # замер времени подготовки CSV, COPY и bulk_create, обычно общий с индексатором
+        self.timer = timer or StageTimer()
+
         self._pg_copy_create_queues = defaultdict(list)
         self._bulk_create_queues = defaultdict(list)
 
@@ -90,11 +96,15 @@ class BulkCreateManager(object):
             try:
                 start_time = time.time()
 
-                with transaction.atomic():
+                with self.timer.stage('copy'), transaction.atomic():
                     cursor.copy_from(export_file, model_class._meta.db_table, sep='\t', null='', columns=header)
 
                 time_spent = time.time() - start_time
 
+                self.timer.add_rows('copy', len(_slice))
+
+                ROWS_WRITTEN.labels(model=model_key, method='copy').inc(len(_slice))
+
                 logger.info(
                     f'{self.log_prefix}(chunk {chunk_no}/{len(slices)}) {model_key} dump saved via PG COPY ({len(_slice)} items) in {time_spent}s, {round(len(_slice) / time_spent * 60)} items/min')
             except psycopg2.DatabaseError as error:
@@ -110,6 +120,8 @@ class BulkCreateManager(object):
 
                 logger.error(str(error))
 
+                COPY_RETRIES.labels(model=model_key).inc()
+
                 self._bulk_create_queues[model_key].append(self._pg_copy_create_queues[model_key].pop(line_number - 1))
 
                 logger.info(f'{self.log_prefix}Retrying COPY to table {model_class._meta.db_table} without problem row')
@@ -133,10 +145,13 @@ class BulkCreateManager(object):
         for _slice in slices:
             start_time = time.time()
 
-            model_class.objects.bulk_create(_slice)
+            with self.timer.stage('bulk_create', rows=len(_slice)):
+                model_class.objects.bulk_create(_slice)
 
             time_spent = time.time() - start_time
 
+            ROWS_WRITTEN.labels(model=model_key, method='bulk_create').inc(len(_slice))
+
             logger.info(
                 f'{self.log_prefix}(slice {chunk_no}/{len(slices)}) {model_key} dump saved via bulk_create ({len(_slice)} items) in {time_spent}s, {round(len(_slice) / time_spent * 60)} items/min')
 
@@ -158,13 +173,14 @@ class BulkCreateManager(object):
 
         writer = DictWriter(csv_data, fieldnames=header, delimiter='\t')
 
-        for item in chunk:
-            item_data = item.__dict__.copy()
+        with self.timer.stage('csv_prepare', rows=items_count):
+            for item in chunk:
+                item_data = item.__dict__.copy()
 
-            if '_state' in item_data.keys():
-                del item_data['_state']
+                if '_state' in item_data.keys():
+                    del item_data['_state']
 
-            writer.writerow(item_data)
+                writer.writerow(item_data)
 
         csv_data.seek(0)
 
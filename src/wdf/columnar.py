@@ -0,0 +1,104 @@
+"""
+Колоночное представление чанка айтемов.
+
+Вместо того чтобы на каждом айтеме проверять item.keys() и приводить типы в collect_* и save_*, чанк один раз
+раскладывается по колонкам: числовые поля – массивы NumPy с маской заполненности, строковые – списки, параметры –
+плоские списки имен и значений со смещениями начала параметров каждого айтема. Индексатор в колоночном режиме
+(INDEXER_COLUMNAR, см. Indexer.collect_batch и Indexer.save_batch) работает уже с колонками
+"""
+import numpy as np
+
+from wdf.normalization import ARTICLE_RE
+from wdf.timestamps import parse_timestamp
+
+
+class ColumnarBatch(object):
+    """
+    Колонки чанка. Для числовых полей has_<поле> – маска айтемов, в которых поле есть, а <поле>_filled – маска
+    айтемов, в которых оно не None
+    """
+
+    def __init__(self, items, title_max_length=None):
+        self.size = len(items)
+
+        self.wb_ids = [item['wb_id'] for item in items]
+        self.product_urls = [item['product_url'] for item in items]
+        self.articles = guess_wb_articles(self.wb_ids, self.product_urls)
+        self.parse_dates = [item['parse_date'] for item in items]
+        self.crawled_at = [parse_timestamp(parse_date) for parse_date in self.parse_dates]
+
+        self.titles = [item['product_name'] for item in items]
+
+        if title_max_length is not None:
+            self.titles = [title if len(title) <= title_max_length else title[0:title_max_length - 1] for title in self.titles]
+
+        self.category_urls = [item.get('wb_category_url') for item in items]
+        self.category_names = [item['wb_category_name'] if 'wb_category_name' in item else item.get('wb_category_url') for item in items]
+        self.brand_urls = [item.get('wb_brand_url') for item in items]
+        self.brand_names = [item.get('wb_brand_name') for item in items]
+
+        # позиция бывает null, и тогда она так и сохраняется
+        self.category_positions = [item.get('wb_category_position') for item in items]
+        self.has_category_position = presence_mask(items, 'wb_category_position')
+        self.prices, self.has_price, self.price_filled = numeric_column(items, 'wb_price', np.float64)
+        self.ratings, self.has_rating, self.rating_filled = numeric_column(items, 'wb_rating', np.float64)
+        self.sales, self.has_sales, self.sales_filled = numeric_column(items, 'wb_purchases_count', np.int64)
+        self.reviews, self.has_reviews, self.reviews_filled = numeric_column(items, 'wb_reviews_count', np.int64)
+
+        self.feature_names = []
+        self.feature_values = []
+        self.feature_offsets = np.zeros(self.size + 1, dtype=np.int64)
+
+        for item_no, item in enumerate(items):
+            if 'features' in item:
+                self.feature_names.extend(item['features'][0].keys())
+                self.feature_values.extend(item['features'][0].values())
+
+            self.feature_offsets[item_no + 1] = len(self.feature_names)
+
+    def features(self, item_no):
+        """
+        Пары (имя, значение) параметров айтема
+        """
+        start, end = self.feature_offsets[item_no], self.feature_offsets[item_no + 1]
+
+        return zip(self.feature_names[start:end], self.feature_values[start:end])
+
+
+def numeric_column(items, key, dtype):
+    """
+    Массив значений поля, маска айтемов, в которых оно есть, и маска айтемов, в которых оно не None. Пустая строка
+    (так бывает в wb_reviews_count) и отсутствующее поле становятся нулем, а None – пропуском (NaN в вещественной
+    колонке): в БД он сохраняется как NULL, так же как при поштучном сохранении
+    """
+    values = [item.get(key) for item in items]
+    filled = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+    column = np.array([0 if value is None or value == '' else value for value in values], dtype=dtype)
+
+    if np.issubdtype(dtype, np.floating):
+        column[~filled] = np.nan
+
+    return column, presence_mask(items, key), filled
+
+
+def column_values(column, filled):
+    """
+    Значения колонки списком Python, пропуски – None
+    """
+    values = column.tolist()
+
+    for item_no in np.flatnonzero(~filled).tolist():
+        values[item_no] = None
+
+    return values
+
+
+def presence_mask(items, key):
+    return np.fromiter((key in item for item in items), dtype=bool, count=len(items))
+
+
+def guess_wb_articles(wb_ids, product_urls):
+    """
+    guess_wb_article для всего чанка: регулярное выражение запускается только для длинных wb_id
+    """
+    return [wb_id if len(str(wb_id)) <= 20 else ARTICLE_RE.findall(product_url)[0] for wb_id, product_url in zip(wb_ids, product_urls)]
@@ -16,3 +16,13 @@ class DumpStateTooLateError(DumpStateError):
 class DumpCorruptedError(DumpStateError):
     """Raised when dump is imported incoreclty, i.e. there is more versions than items"""
     pass
+
+
+class DumpRangeLeaseLostError(DumpStateError):
+    """Raised when range lease expired and the range was claimed by another worker before import was committed"""
+    pass
+
+
+class DumpSpoolMissingError(DumpStateError):
+    """Raised when dump items were spooled in partitions, but the spool is not available to the worker"""
+    pass
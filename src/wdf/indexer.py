@@ -1,22 +1,35 @@
+import copy
 import environ
+import itertools
 import logging
-import pytz
-import re
+import numpy as np
 import resource
 import sys
+import threading
 import time
-from datetime import datetime
-from dateutil.parser import parse as date_parse
-from django.conf import settings
-from django.db import transaction
+from contextlib import nullcontext
+from django.db import IntegrityError, connection, transaction
 from django.utils import timezone
-from scrapinghub import ScrapinghubClient
+from psycopg2 import errorcodes
 
 from wdf.bulk_create_manager import BulkCreateManager
-from wdf.exceptions import DumpCorruptedError
+from wdf.columnar import ColumnarBatch, column_values
+from wdf.exceptions import DumpCorruptedError, DumpSpoolMissingError
+from wdf.item_stream import MISSING, RecordChunk, iter_job_items, make_save_record
+from wdf.key_filter import get_key_filter
+from wdf.lookups import LOOKUP_ARRAY, lookup_ids
+from wdf.metrics import CACHE_LOOKUPS, ITEMS_PROCESSED, ITEMS_REJECTED, KEY_FILTER_LOOKUPS, STAGE_DURATION
 from wdf.models import (
-    DictBrand, DictCatalog, DictMarketplace, DictParameter, Dump, Parameter, Position, Price, Rating, Reviews, Sales,
-    Sku, Version)
+    DictBrand, DictCatalog, DictMarketplace, DictParameter, Dump, Parameter, Position, Price, Rating, RejectedItem,
+    Reviews, Sales, Sku, Version)
+from wdf.normalization import ARTICLE_RE, ItemRejectedError, normalize_item
+from wdf.pipeline import ChunkWork, Pipeline, PipelineStage, RowsBuffer
+from wdf.records import BrandRecord, CatalogRecord, SkuRecord
+from wdf.sh_client import get_sh_client
+from wdf.sku_index import get_sku_index, reset_sku_index
+from wdf.spool import get_dump_spool
+from wdf.stage_timer import StageTimer
+from wdf.timestamps import parse_job_time, parse_timestamp
 
 env = environ.Env(DEBUG=(bool, False))
 environ.Env.read_env()
@@ -88,25 +101,62 @@ class Indexer(object):
         self.spider_slug = 'wb'
         self.get_chunk_size = env('INDEXER_GET_CHUNK_SIZE', cast=int)
         self.save_chunk_size = env('INDEXER_SAVE_CHUNK_SIZE', cast=int)
+        self.columnar = env('INDEXER_COLUMNAR', cast=bool, default=False)
+        self.streaming = env('INDEXER_STREAMING', cast=bool, default=False)
+
+        # Как искать в БД записи словарей по ключам чанка: in, array или temp_table (см. wdf.lookups)
+        self.cache_lookup = env('INDEXER_CACHE_LOOKUP', default='array')
+
+        # Индекс артикул → id SKU в памяти процесса, только на Постгресе (см. wdf.sku_index)
+        self.sku_index = env('INDEXER_SKU_INDEX', cast=bool, default=False)
+        # Проверка найденных в индексе id по первичному ключу на каждом чанке. По умолчанию выключена: индекс, который
+        # отдал id удаленного merge_duplicate SKU, сбрасывается при нарушении внешнего ключа (см. drop_stale_sku_index)
+        self.sku_index_verify = env('INDEXER_SKU_INDEX_VERIFY', cast=bool, default=False)
+
+        # Конвейер в process_batch (см. process_batch_pipelined): потоки этапов и размер очередей между ними
+        self.pipelined = env('INDEXER_PIPELINE', cast=bool, default=False)
+        self.pipeline_queue_size = env('INDEXER_PIPELINE_QUEUE_SIZE', cast=int, default=2)
+        self.pipeline_threads = {
+            'normalize': env('INDEXER_PIPELINE_NORMALIZE_THREADS', cast=int, default=1),
+            'build': env('INDEXER_PIPELINE_BUILD_THREADS', cast=int, default=1),
+            # 0 – запись в вызывающем потоке и в его транзакции
+            'copy': env('INDEXER_PIPELINE_COPY_THREADS', cast=int, default=0),
+        }
 
         self.marketplace, new_marketplace = DictMarketplace.objects.get_or_create(name=self.spider_slug, slug=self.spider_slug)
         self.dump, new_dump = Dump.objects.get_or_create(job=job_id, crawler=self.spider_slug)
 
-        self.sh_client = ScrapinghubClient(settings.SH_APIKEY)
-        self.bulk_manager = BulkCreateManager(max_chunk_size=self.save_chunk_size)
+        self.sh_client = get_sh_client()
+        self.spool = get_dump_spool(job_id)
+        self.timer = StageTimer()
+        self.bulk_manager = BulkCreateManager(max_chunk_size=self.save_chunk_size, timer=self.timer)
 
         self.catalogs_cache = {}
         self.brands_cache = {}
         self.skus_cache = {}
         self.parameters_cache = {}
 
+        # пропущенные благодаря фильтру ключей поиски в БД и ложные срабатывания фильтра в текущем чанке
+        self.key_filter_stats = {}
+
         self.catalogs_retrieved = {}
         self.brands_retrieved = {}
         self.skus_retrieved = {}
         self.parameters_retrieved = {}
 
+        # айтемы текущего чанка, не прошедшие нормализацию
+        self.rejected = []
+
         self.log_prefix = ''
 
+        self.profiler = None
+        self.admission = None
+
+        self.items_processed = 0
+        self.dump_completed = False
+
+        self._flush_lock = threading.Lock()
+
         if new_dump or self.dump.items_crawled is None or self.dump.crawl_ended_at is None or self.dump.crawl_ended_at is None:
             self.load_dump_stats(self.dump)
 
@@ -120,42 +170,201 @@ class Indexer(object):
 
         return self
 
-    def prepare_dump(self, start=0, count=sys.maxsize):
-        generator = self.get_generator(start=start, count=count, chunk_size=self.get_chunk_size)
+    def set_columnar(self, columnar):
+        self.columnar = columnar
+
+        return self
+
+    def set_streaming(self, streaming):
+        self.streaming = streaming
+
+        return self
+
+    def set_cache_lookup(self, method):
+        self.cache_lookup = method
+
+        return self
+
+    def set_sku_index(self, sku_index, verify=False):
+        self.sku_index = sku_index
+        self.sku_index_verify = verify
 
+        return self
+
+    def set_pipeline(self, pipelined, queue_size=None, **threads):
+        self.pipelined = pipelined
+        self.pipeline_queue_size = queue_size or self.pipeline_queue_size
+        self.pipeline_threads = {**self.pipeline_threads, **threads}
+
+        return self
+
+    def set_profiler(self, profiler):
+        self.profiler = profiler
+
+        return self
+
+    def set_admission(self, admission):
+        self.admission = admission
+
+        return self
+
+    def profile_chunk(self, chunk_no, phase='import'):
+        if self.profiler is None or not self.profiler.wants(chunk_no):
+            return nullcontext()
+
+        return self.profiler.profile(chunk_no, phase=phase)
+
+    def prepare_dump(self, start=0, count=sys.maxsize, partitions=1):
         if self.dump.state_code > 0:
             logger.info(f'Dump already prepared (state code {self.dump.state_code} – {self.dump.state}), skipping prepare step')
 
             return self
 
+        generator = self.get_chunks(start=start, count=count)
+
+        # Подготовка все равно читает выгрузку целиком, заодно сохраняем ее для импорта диапазонов
+        if self.spool is not None and not self.spool.is_complete() and start == 0 and count == sys.maxsize:
+            generator = self.spool.write(
+                self.get_generator(start=start, count=count, chunk_size=self.get_chunk_size), partitions=partitions, partition_key=get_partition_key)
+        elif partitions > 1:
+            logger.warning(f'Job {self.dump.job}: dump can be partitioned by article only while spooled, see INDEXER_SPOOL_DIR')
+
         self.dump.set_state(Dump.PREPARING)
         self.dump.save()
 
         self.process_batch(generator=generator, save_versions=False)
 
+        spool = self.get_spool()
+
+        if spool is not None and spool.get_partitions() is not None:
+            self.dump.partitions = len(spool.get_partitions())
+
         self.dump.set_state(Dump.PREPARED)
         self.dump.save()
 
         return self
 
-    @transaction.atomic
-    def import_dump(self, start=0, count=sys.maxsize):
-        generator = self.get_generator(start=start, count=count, chunk_size=self.get_chunk_size)
-
+    def import_dump(self, start=0, count=sys.maxsize, worker=None, admit=True):
+        """
+        Импорт диапазона в одной транзакции. admit=False – допуск к записи (см. wdf.admission) уже получен
+        перед внешней транзакцией
+        """
         if self.dump.state_code > 25:
             logger.info(f'Dump already imported (state code {self.dump.state_code} – {self.dump.state}), skipping import step')
 
             return self
 
-        self.dump.set_state(Dump.PROCESSING)
-        self.dump.save()
+        # копии дампа, разложенного по разделам, может не быть на этом воркере: тогда диапазон падает здесь
+        generator = self.get_chunks(start=start, count=count)
+
+        # Статус меняется вне транзакции импорта: иначе строка дампа остается заблокированной до конца импорта
+        # диапазона, и параллельные импорты других диапазонов того же дампа ждут друг друга
+        if self.dump.state_code < Dump.PROCESSING:
+            self.dump.set_state(Dump.PROCESSING)
+            self.dump.save()
+
+        if admit:
+            self.wait_admission(self.timer, f'Job {self.dump.job}, range from item {start}: ')
+
+        def complete_range():
+            self.dump_completed = self.dump.complete_range(start, items_imported=self.items_processed, worker=worker)
+
+        # в той же транзакции, что и версии: диапазон считается импортированным только вместе с данными. Потоки
+        # записи конвейера коммитят свои транзакции только после этого (см. process_batch_pipelined)
+        try:
+            with transaction.atomic():
+                self.process_batch(generator=generator, save_versions=True, before_commit=complete_range)
+        except IntegrityError as e:
+            self.drop_stale_sku_index(e)
+
+            raise
+
+        return self
+
+    def drop_stale_sku_index(self, error):
+        """
+        Ленивая проверка индекса SKU (см. wdf.sku_index): если версии не сохранились из-за внешнего ключа, индекс мог
+        отдать id SKU, который merge_duplicate удалил в другом процессе. Индекс процесса сбрасывается и при следующем
+        обращении загружается заново, так что повтор диапазона устаревших id уже не получит
+        """
+        if not self.sku_index or connection.vendor != 'postgresql':
+            return
+
+        if getattr(error.__cause__, 'pgcode', None) != errorcodes.FOREIGN_KEY_VIOLATION:
+            return
+
+        logger.warning(f'Job {self.dump.job}: foreign key violation while saving versions, SKU index dropped: {error}')
+
+        reset_sku_index()
+
+    def wait_admission(self, timer, log_prefix):
+        """
+        Ожидание допуска к записи (см. wdf.admission). Только вне транзакции: ожидание в ней держало бы блокировки
+        и простаивающее соединение, то есть добавляло бы БД той самой нагрузки
+        """
+        if self.admission is None:
+            return
+
+        with timer.stage('admission'):
+            self.admission.wait(log_prefix=log_prefix)
+
+    def is_partitioned(self):
+        """
+        Айтемы в копии дампа разложены по разделам: диапазоны импорта совпадают с разделами, и делить их нельзя
+        """
+        return self.dump.partitions > 1
+
+    def get_spool(self):
+        """
+        Готовая копия дампа или None, если айтемы читаются из Scrapinghub. Диапазоны дампа, разложенного по разделам,
+        не совпадают со смещениями в выгрузке, поэтому без копии их импортировать нельзя
+        """
+        if self.spool is not None and self.spool.is_complete():
+            return self.spool
+
+        if self.dump.partitions > 1:
+            raise DumpSpoolMissingError(
+                f'Job {self.dump.job}: dump was spooled in {self.dump.partitions} partitions, but the spool is missing or incomplete'
+                ' on this worker, see INDEXER_SPOOL_DIR')
+
+        return None
+
+    def import_dump_single_pass(self):
+        """
+        Подготовка и импорт за один проход по выгрузке: словари и версии каждого чанка пишутся сразу, и дамп переходит
+        из CREATED в PROCESSED, минуя PREPARED и очередь диапазонов (в ней один диапазон на весь дамп). Словари при этом
+        пишутся в транзакции импорта, поэтому параллельно с другими подготовками так импортировать нельзя: задача
+        import_single_pass идет в очередь prepare с единственным процессом
+        """
+        if self.dump.state_code > Dump.CREATED:
+            logger.info(f'Dump already in progress (state code {self.dump.state_code} – {self.dump.state}), skipping single pass import')
+
+            return self
+
+        self.dump.create_ranges(max(1, self.dump.items_crawled))
 
-        self.process_batch(generator=generator, save_versions=True)
+        self.wait_admission(self.timer, f'Job {self.dump.job}, single pass: ')
+
+        # в отличие от импорта диапазонов, статус меняется в транзакции импорта: если выгрузка оборвется, дамп
+        # вернется в CREATED вместе с откатом версий, и повтор задачи начнет проход заново
+        try:
+            with transaction.atomic():
+                self.dump.set_state(Dump.PROCESSING)
+                self.dump.save()
+
+                self.import_dump(admit=False)
+        except IntegrityError as e:
+            self.drop_stale_sku_index(e)
+
+            raise
+
+        self.wrap_dump()
 
         return self
 
     def wrap_dump(self):
-        versions_num = self.dump.get_versions_num()
+        # отклоненные айтемы тоже считаются обработанными: они лежат в RejectedItem вместо версий
+        versions_num = self.dump.get_versions_num() + self.dump.get_rejected_num()
 
         if versions_num > self.dump.items_crawled:
             raise DumpCorruptedError('Dump has more versions than job')
@@ -166,79 +375,443 @@ class Indexer(object):
         self.dump.set_state(Dump.PROCESSED)
         self.dump.save()
 
-    def process_batch(self, generator, save_versions=False):
+        if self.spool is not None:
+            self.spool.remove()
+
+    def process_batch(self, generator, save_versions=False, before_commit=None):
+        """
+        Обработка всех чанков. before_commit вызывается, когда все чанки записаны, но еще не закоммичены
+        (см. process_batch_pipelined)
+        """
+        if self.pipelined:
+            return self.process_batch_pipelined(generator, save_versions=save_versions, before_commit=before_commit)
+
         overall_start_time = time.time()
 
         chunk_no = 1
         items_count = 0
 
-        for chunk in generator:
+        for chunk in self.timer.iterate(generator, 'fetch'):
             self.log_prefix = f'Job {self.dump.job}, chunk #{chunk_no}: '
 
+            # импорт пишет чанки в транзакции диапазона и ждет один раз перед ней (см. import_dump)
+            if not save_versions:
+                self.wait_admission(self.timer, self.log_prefix)
+
             try:
-                log_action = 'Prepared'
+                with self.profile_chunk(chunk_no, phase='import' if save_versions else 'prepare'):
+                    self.process_chunk(chunk, chunk_no=chunk_no, save_versions=save_versions)
+
+                items_count += chunk.items_read if isinstance(chunk, RecordChunk) else len(chunk)
+                chunk_no += 1
+            except KeyboardInterrupt:
+                # В основном для отладки через систему команд Django
+                overall_time_spent = time.time() - overall_start_time
+
+                logger.info(f'{self.dump} ({self.dump.job}) processed in {overall_time_spent}s, {round(items_count / overall_time_spent * 60)} items/min')
+
+                raise SystemExit(0)
+
+        overall_time_spent = time.time() - overall_start_time
+
+        self.items_processed = items_count
 
+        logger.info(f'{self.log_prefix}Processed in {overall_time_spent}s, {round(items_count / overall_time_spent * 60)} items/min')
+
+        if before_commit is not None:
+            before_commit()
+
+        return self
+
+    def process_batch_pipelined(self, generator, save_versions=False, before_commit=None):
+        """
+        process_batch на конвейере (см. wdf.pipeline): пока один чанк пишется в БД, следующие собираются в строки,
+        разбираются по словарям и нормализуются. Словари разбирает один поток – кеши и создание новых записей
+        не рассчитаны на параллельную работу, а новые записи словарей коммитятся сразу, чтобы их видели потоки записи.
+
+        Запись по умолчанию идет в вызывающем потоке и в его транзакции. Если задать потоки записи
+        (INDEXER_PIPELINE_COPY_THREADS), у каждого свое соединение и своя транзакция. Дописав свою часть чанков, поток
+        держит ее открытой, пока в вызывающем потоке не пройдет before_commit (в импорте – отметка диапазона
+        импортированным), и только потом коммитит, а если before_commit или любой этап упадет, откатывает: иначе
+        повтор упавшего диапазона записал бы его версии второй раз. Профилировщик чанков в конвейере не работает
+        """
+        overall_start_time = time.time()
+        items_count = 0
+
+        def chunks():
+            nonlocal items_count
+
+            iterator = iter(generator)
+
+            for chunk_no in itertools.count(1):
                 start_time = time.time()
-                mem_usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 / 1024  # в мегабайтах
+                chunk = next(iterator, None)
 
-                self.clear_retrieved()
-                self.clear_caches()
+                if chunk is None:
+                    return
 
-                for item in chunk:
-                    self.collect_all(item)
+                work = ChunkWork(self.fork(chunk_no), chunk, chunk_no)
+                work.indexer.timer.add('fetch', time.time() - start_time)
 
-                    items_count += 1
+                if not save_versions:
+                    self.wait_admission(work.indexer.timer, work.indexer.log_prefix)
 
-                self.update_all_caches(self.catalogs_retrieved, self.brands_retrieved, self.parameters_retrieved, self.skus_retrieved)
+                items_count += len(chunk)
 
-                if save_versions:
-                    log_action = 'Saved'
+                yield work
 
-                    self.save_all(chunk)
+        def normalize(work):
+            work.rows = work.indexer.normalize_chunk(work.chunk)
 
-                    self.bulk_manager.done(log_prefix=self.log_prefix)
+            return work
 
-                time_spent = time.time() - start_time
+        def resolve(work):
+            work.rows = work.indexer.resolve_chunk(work.rows)
 
-                logger.info(f'{self.log_prefix}{log_action} in {time_spent}s, {round(len(chunk) / time_spent * 60)} items/min, used {round(mem_usage, 2)}MB')
+            if not save_versions:
+                work.indexer.flush_rejected(save=False)
 
-                chunk_no += 1
-            except KeyboardInterrupt:
-                # В основном для отладки через систему команд Django
-                overall_time_spent = time.time() - overall_start_time
+                finish(work)
 
-                logger.info(f'{self.dump} ({self.dump.job}) processed in {overall_time_spent}s, {round(items_count / overall_time_spent * 60)} items/min')
+            return work
 
-                raise SystemExit(0)
+        def build(work):
+            # строки версий копятся до этапа записи, а новые записи словарей на этапе resolve пишутся сразу
+            work.indexer.bulk_manager = RowsBuffer()
+            work.indexer.build_rows(work.rows)
+            work.indexer.flush_rejected(save=True)
+
+            return work
+
+        def save(work):
+            bulk_manager = BulkCreateManager(max_chunk_size=self.save_chunk_size, timer=work.indexer.timer)
+
+            for obj in work.indexer.bulk_manager.objects:
+                bulk_manager.add(obj)
+
+            bulk_manager.done(log_prefix=work.indexer.log_prefix)
+
+            finish(work)
+
+        def finish(work):
+            with self._flush_lock:
+                work.indexer.log_chunk(work.chunk, work.chunk_no, work.start_time, save_versions=save_versions)
+
+            pipeline.log_stats()
+
+        if save_versions:
+            copy_threads = self.pipeline_threads['copy']
+
+            stages = [
+                PipelineStage('normalize', normalize, threads=self.pipeline_threads['normalize']),
+                PipelineStage('resolve', resolve, threads=1),
+                PipelineStage('build', build, threads=self.pipeline_threads['build']),
+                PipelineStage('copy', save, threads=copy_threads, deferred_commit=True),
+            ]
+        else:
+            stages = [
+                PipelineStage('normalize', normalize, threads=self.pipeline_threads['normalize']),
+                PipelineStage('resolve', resolve, threads=0),
+            ]
+
+        def commit():
+            self.items_processed = items_count
+
+            if before_commit is not None:
+                before_commit()
+
+        pipeline = Pipeline(chunks(), stages, queue_size=self.pipeline_queue_size, log_prefix=f'Job {self.dump.job}: ')
+        pipeline.run(before_commit=commit)
 
         overall_time_spent = time.time() - overall_start_time
 
-        logger.info(f'{self.log_prefix}Processed in {overall_time_spent}s, {round(items_count / overall_time_spent * 60)} items/min')
+        self.items_processed = items_count
+
+        logger.info(f'Job {self.dump.job}: processed by pipeline in {overall_time_spent}s, {round(items_count / overall_time_spent * 60)} items/min')
+
+        return self
+
+    def fork(self, chunk_no):
+        """
+        Копия индексатора для одного чанка в конвейере: словари, кеши, замеры и строки на запись у нее свои,
+        а дамп, маркетплейс и настройки общие. Менеджер записи настоящий: им на этапе resolve создаются
+        недостающие записи словарей, а строки версий этап build копит в RowsBuffer
+        """
+        forked = copy.copy(self)
+
+        forked.timer = StageTimer()
+        forked.bulk_manager = BulkCreateManager(max_chunk_size=self.save_chunk_size, timer=forked.timer)
+        forked.rejected = []
+        forked.log_prefix = f'Job {self.dump.job}, chunk #{chunk_no}: '
+
+        forked.clear_caches()
+        forked.clear_retrieved()
+
+        return forked
+
+    def process_chunk(self, chunk, chunk_no=1, save_versions=False):
+        start_time = time.time()
+
+        rows = self.resolve_chunk(self.normalize_chunk(chunk))
+
+        if save_versions:
+            self.build_rows(rows)
+            self.bulk_manager.done(log_prefix=self.log_prefix)
+
+        self.flush_rejected(save=save_versions)
+
+        self.log_chunk(chunk, chunk_no, start_time, save_versions=save_versions)
 
         return self
 
+    def normalize_chunk(self, chunk):
+        # в потоковом режиме айтемы нормализованы еще при чтении чанка (см. get_record_generator)
+        if isinstance(chunk, RecordChunk):
+            return chunk
+
+        with self.timer.stage('normalize', rows=len(chunk)):
+            return self.normalize_items(chunk)
+
+    def resolve_chunk(self, items):
+        """
+        Словари чанка: сбор из айтемов и поиск или создание в БД. Возвращает то, из чего собираются строки версий:
+        айтемы, колоночный чанк или чанк компактных записей
+        """
+        rows = items
+
+        self.clear_caches()
+
+        # в потоковом режиме словари собраны еще при чтении чанка (см. get_record_generator)
+        if not isinstance(items, RecordChunk):
+            self.clear_retrieved()
+
+            with self.timer.stage('collect', rows=len(items)):
+                if self.columnar:
+                    rows = ColumnarBatch(items, title_max_length=Sku._meta.get_field('title').max_length)
+
+                    self.collect_batch(rows)
+                else:
+                    for item in items:
+                        self.collect_all(item)
+
+        self.update_all_caches(self.catalogs_retrieved, self.brands_retrieved, self.parameters_retrieved, self.skus_retrieved)
+
+        return rows
+
+    def build_rows(self, rows):
+        if isinstance(rows, RecordChunk):
+            self.save_records(rows)
+        elif isinstance(rows, ColumnarBatch):
+            self.save_batch(rows)
+        else:
+            self.save_all(rows)
+
+    def log_chunk(self, chunk, chunk_no, start_time, save_versions=False):
+        log_action = 'Saved' if save_versions else 'Prepared'
+        mem_usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 / 1024  # в мегабайтах
+
+        time_spent = time.time() - start_time
+
+        ITEMS_PROCESSED.labels(action=log_action.lower()).inc(len(chunk))
+        STAGE_DURATION.labels(stage='chunk').observe(time_spent)
+
+        logger.info(f'{self.log_prefix}{log_action} in {time_spent}s, {round(len(chunk) / time_spent * 60)} items/min, used {round(mem_usage, 2)}MB')
+
+        if len(self.key_filter_stats) > 0:
+            logger.info(f'{self.log_prefix}Key filters: {self.format_key_filter_stats()}', extra={'key_filter_stats': self.key_filter_stats})
+
+        self.timer.flush(log_prefix=self.log_prefix, job=self.dump.job, chunk=chunk_no, action=log_action.lower(), items=len(chunk))
+
+    def format_key_filter_stats(self):
+        """
+        Доля ложных срабатываний – среди ключей, которых нет в БД: пропущенных фильтром и прошедших его зря
+        """
+        parts = []
+
+        for object_name, stats in self.key_filter_stats.items():
+            absent = stats['skipped'] + stats['false_positives']
+            false_positive_rate = stats['false_positives'] / absent if absent > 0 else 0
+
+            parts.append(f'{object_name} skipped {stats["skipped"]}, false positives {stats["false_positives"]} ({false_positive_rate:.2%})')
+
+        return '; '.join(parts)
+
+    def get_chunks(self, start=0, count=sys.maxsize):
+        # в конвейере словари собираются на своем этапе, поэтому потоковое чтение с их сбором не подходит
+        if self.streaming and not self.pipelined:
+            return self.get_record_generator(chunk_size=self.get_chunk_size, start=start, count=count)
+
+        return self.get_generator(chunk_size=self.get_chunk_size, start=start, count=count)
+
+    def get_record_generator(self, chunk_size=500, start=0, count=sys.maxsize):
+        """
+        Потоковый вариант get_generator: айтемы читаются по одному, сразу разбираются в словари (*_retrieved),
+        а в чанк попадают только компактные записи для сохранения версий (см. wdf.item_stream)
+        """
+        items = self.iter_items(start=start, count=count, window=chunk_size)
+
+        chunk = RecordChunk()
+
+        self.clear_retrieved()
+
+        for item in items:
+            # нормализация идет в стадии collect: отдельная стадия на каждый айтем стоит дороже самой проверки
+            with self.timer.stage('collect', rows=1):
+                try:
+                    item = normalize_item(item)
+                except ItemRejectedError as e:
+                    self.reject_item(item, e)
+
+                    chunk.rejected += 1
+                else:
+                    self.collect_all(item)
+
+                    chunk.append(make_save_record(item))
+
+            if chunk.items_read == chunk_size:
+                yield chunk
+
+                chunk = RecordChunk()
+
+                # словари следующего чанка собираются уже после его обработки
+                self.clear_retrieved()
+
+        if chunk.items_read > 0:
+            yield chunk
+
+    def iter_items(self, start=0, count=sys.maxsize, window=1000):
+        """
+        Айтемы выгрузки по одному: из копии дампа, если она есть, иначе из Scrapinghub окнами по window айтемов
+        """
+        spool = self.get_spool()
+
+        if spool is not None:
+            return spool.iter_items(start=start, count=count)
+
+        return iter_job_items(self.sh_client, self.dump.job, start=start, count=count, window=window)
+
     def get_generator(self, chunk_size=500, start=0, count=sys.maxsize):
+        spool = self.get_spool()
+
+        if spool is not None:
+            return spool.iter_chunks(chunk_size=chunk_size, start=start, count=count)
+
         return self.sh_client.get_job(self.dump.job).items.list_iter(chunksize=chunk_size, start=start, count=count)
 
     def load_dump_stats(self, dump_model):
-        job_metadata = self.sh_client.get_job(dump_model.job).metadata
-
-        dump_model.crawl_started_at = pytz.utc.localize(datetime.fromtimestamp(job_metadata.get('running_time') / 1000))
-        dump_model.crawl_ended_at = pytz.utc.localize(datetime.fromtimestamp(job_metadata.get('finished_time') / 1000))
-        dump_model.items_crawled = job_metadata.get('scrapystats')['item_scraped_count']
+        for field, value in fetch_job_stats(self.sh_client, dump_model.job).items():
+            setattr(dump_model, field, value)
 
         dump_model.save()
 
     def save_all(self, chunk):
-        for item in chunk:
-            version = self.save_version(item=item)
+        with self.timer.stage('build', rows=len(chunk)):
+            for item in chunk:
+                version = self.save_version(item=item)
+
+                self.save_price(version, item)
+                self.save_rating(version, item)
+                self.save_sales(version, item)
+                self.save_reviews(version, item)
+                self.save_parameters(version, item)
+                self.save_position(version, item)
 
-            self.save_price(version, item)
-            self.save_rating(version, item)
-            self.save_sales(version, item)
-            self.save_reviews(version, item)
-            self.save_parameters(version, item)
-            self.save_position(version, item)
+        self.bulk_manager.done(log_prefix=self.log_prefix)
+
+    def save_records(self, records):
+        """
+        save_all для чанка компактных записей из потокового режима (см. wdf.item_stream)
+        """
+        with self.timer.stage('build', rows=len(records)):
+            for record in records:
+                sku_id = self.skus_cache[record.wb_id]
+                version = Version(dump=self.dump, sku_id=sku_id, crawled_at=record.crawled_at, created_at=timezone.now())
+
+                self.bulk_manager.add(version)
+
+                if record.price is not MISSING:
+                    self.bulk_manager.add(Price(sku_id=sku_id, version=version, price=record.price, created_at=timezone.now()))
+
+                if record.rating is not MISSING:
+                    self.bulk_manager.add(Rating(sku_id=sku_id, version=version, rating=record.rating, created_at=timezone.now()))
+
+                if record.sales is not MISSING:
+                    self.bulk_manager.add(Sales(sku_id=sku_id, version=version, sales=record.sales, created_at=timezone.now()))
+
+                if record.reviews is not MISSING:
+                    self.bulk_manager.add(Reviews(sku_id=sku_id, version=version, reviews=record.reviews, created_at=timezone.now()))
+
+                for feature_name, feature_value in record.features:
+                    self.bulk_manager.add(Parameter(
+                        sku_id=sku_id,
+                        version=version,
+                        parameter_id=self.parameters_cache[feature_name],
+                        value=feature_value,
+                        created_at=timezone.now(),
+                    ))
+
+                if record.position is not MISSING:
+                    self.bulk_manager.add(Position(
+                        sku_id=sku_id,
+                        version=version,
+                        catalog_id=self.catalogs_cache[record.category_url],
+                        absolute=record.position,
+                        created_at=timezone.now(),
+                    ))
+
+        self.bulk_manager.done(log_prefix=self.log_prefix)
+
+    def save_batch(self, batch):
+        """
+        save_all для колоночного чанка (см. ColumnarBatch): типы уже приведены, поэтому здесь только сборка объектов
+        """
+        with self.timer.stage('build', rows=batch.size):
+            created_at = timezone.now()
+
+            sku_ids = [self.skus_cache[wb_id] for wb_id in batch.wb_ids]
+            versions = [
+                Version(dump=self.dump, sku_id=sku_id, crawled_at=crawled_at, created_at=created_at)
+                for sku_id, crawled_at in zip(sku_ids, batch.crawled_at)
+            ]
+
+            for version in versions:
+                self.bulk_manager.add(version)
+
+            prices = column_values(batch.prices, batch.price_filled)
+            ratings = column_values(batch.ratings, batch.rating_filled)
+            sales = column_values(batch.sales, batch.sales_filled)
+            reviews = column_values(batch.reviews, batch.reviews_filled)
+
+            for item_no in np.flatnonzero(batch.has_price).tolist():
+                self.bulk_manager.add(Price(sku_id=sku_ids[item_no], version=versions[item_no], price=prices[item_no], created_at=created_at))
+
+            for item_no in np.flatnonzero(batch.has_rating).tolist():
+                self.bulk_manager.add(Rating(sku_id=sku_ids[item_no], version=versions[item_no], rating=ratings[item_no], created_at=created_at))
+
+            for item_no in np.flatnonzero(batch.has_sales).tolist():
+                self.bulk_manager.add(Sales(sku_id=sku_ids[item_no], version=versions[item_no], sales=sales[item_no], created_at=created_at))
+
+            for item_no in np.flatnonzero(batch.has_reviews).tolist():
+                self.bulk_manager.add(Reviews(sku_id=sku_ids[item_no], version=versions[item_no], reviews=reviews[item_no], created_at=created_at))
+
+            for item_no in range(batch.size):
+                for feature_name, feature_value in batch.features(item_no):
+                    self.bulk_manager.add(Parameter(
+                        sku_id=sku_ids[item_no],
+                        version=versions[item_no],
+                        parameter_id=self.parameters_cache[feature_name],
+                        value=feature_value,
+                        created_at=created_at,
+                    ))
+
+            for item_no in np.flatnonzero(batch.has_category_position).tolist():
+                self.bulk_manager.add(Position(
+                    sku_id=sku_ids[item_no],
+                    version=versions[item_no],
+                    catalog_id=self.catalogs_cache[batch.category_urls[item_no]],
+                    absolute=batch.category_positions[item_no],
+                    created_at=created_at,
+                ))
 
         self.bulk_manager.done(log_prefix=self.log_prefix)
 
@@ -246,7 +819,7 @@ class Indexer(object):
         version = Version(
             dump=self.dump,
             sku_id=self.skus_cache[item['wb_id']],
-            crawled_at=pytz.utc.localize(date_parse(item['parse_date'])),
+            crawled_at=parse_timestamp(item['parse_date']),
             created_at=timezone.now(),
         )
 
@@ -311,6 +884,48 @@ class Indexer(object):
                     created_at=timezone.now(),
                 ))
 
+    def normalize_items(self, items):
+        """
+        Нормализованные айтемы чанка (см. wdf.normalization). Отклоненные айтемы откладываются в self.rejected
+        """
+        normalized = []
+
+        for item in items:
+            try:
+                normalized.append(normalize_item(item))
+            except ItemRejectedError as e:
+                self.reject_item(item, e)
+
+        return normalized
+
+    def reject_item(self, item, error):
+        self.rejected.append(RejectedItem(
+            dump=self.dump,
+            wb_id=str(item.get('wb_id') or '')[:RejectedItem._meta.get_field('wb_id').max_length],
+            field=error.field,
+            reason=error.reason,
+            item=item,
+        ))
+
+    def flush_rejected(self, save=False):
+        """
+        Отклоненные айтемы чанка пишутся в RejectedItem только при импорте, при подготовке они просто пропускаются
+        """
+        if len(self.rejected) == 0:
+            return
+
+        logger.warning(f'{self.log_prefix}{len(self.rejected)} items rejected by normalization')
+
+        if save:
+            for rejected in self.rejected:
+                self.bulk_manager.add(rejected)
+
+                ITEMS_REJECTED.labels(field=rejected.field).inc()
+
+            self.bulk_manager.done(log_prefix=self.log_prefix)
+
+        self.rejected = []
+
     def clear_retrieved(self):
         self.catalogs_retrieved = {}
         self.brands_retrieved = {}
@@ -318,6 +933,7 @@ class Indexer(object):
         self.skus_retrieved = {}
 
     def clear_caches(self):
+        self.key_filter_stats = {}
         self.catalogs_cache = {}
         self.brands_cache = {}
         self.parameters_cache = {}
@@ -329,31 +945,42 @@ class Indexer(object):
         self.collect_wb_parameters(item)
         self.collect_wb_skus(item)
 
+    def collect_batch(self, batch):
+        """
+        collect_all для колоночного чанка (см. ColumnarBatch)
+        """
+        for url, name in zip(batch.category_urls, batch.category_names):
+            if url is not None:
+                self.catalogs_retrieved[url] = CatalogRecord(name, url)
+
+        for url, name in zip(batch.brand_urls, batch.brand_names):
+            if url is not None:
+                self.brands_retrieved[url] = BrandRecord(name, url)
+
+        self.parameters_retrieved.update(dict.fromkeys(batch.feature_names))
+
+        for item_no, wb_id in enumerate(batch.wb_ids):
+            self.skus_retrieved[wb_id] = SkuRecord(
+                batch.parse_dates[item_no], batch.brand_urls[item_no], batch.articles[item_no], batch.product_urls[item_no], batch.titles[item_no])
+
     def collect_wb_catalogs(self, item):
         if 'wb_category_url' in item.keys():
-            self.catalogs_retrieved[item['wb_category_url']] = {
-                'marketplace': self.marketplace.id,
-                'parent': '',
-                'name': item['wb_category_name'] if 'wb_category_name' in item.keys() else item['wb_category_url'],
-                'url': item['wb_category_url'] if 'wb_category_url' in item.keys() else None,
-                'level': 1,
-            }
+            self.catalogs_retrieved[item['wb_category_url']] = CatalogRecord(
+                name=item['wb_category_name'] if 'wb_category_name' in item.keys() else item['wb_category_url'],
+                url=item['wb_category_url'],
+            )
 
     def collect_wb_brands(self, item):
         if 'wb_brand_url' in item.keys():
-            self.brands_retrieved[item['wb_brand_url']] = {
-                'marketplace': self.marketplace.id,
-                'name': item['wb_brand_name'] if 'wb_brand_name' in item.keys() else None,
-                'url': item['wb_brand_url'] if 'wb_brand_url' in item.keys() else None,
-            }
+            self.brands_retrieved[item['wb_brand_url']] = BrandRecord(
+                name=item['wb_brand_name'] if 'wb_brand_name' in item.keys() else None,
+                url=item['wb_brand_url'],
+            )
 
     def collect_wb_parameters(self, item):
+        # у параметра достаточно имени, поэтому значения в parameters_retrieved пустые
         if 'features' in item.keys():
-            for feature_name, _feature_value in item['features'][0].items():
-                self.parameters_retrieved[feature_name] = {
-                    'marketplace': self.marketplace.id,
-                    'name': feature_name,
-                }
+            self.parameters_retrieved.update(dict.fromkeys(item['features'][0]))
 
     def collect_wb_skus(self, item):
         sku_title = item['product_name']
@@ -362,14 +989,13 @@ class Indexer(object):
         if len(sku_title) > max_length:
             sku_title = sku_title[0:max_length - 1]
 
-        self.skus_retrieved[item['wb_id']] = {
-            'parse_date': item['parse_date'],
-            'marketplace': self.marketplace.id,
-            'brand': item['wb_brand_url'] if 'wb_brand_url' in item.keys() else None,
-            'article': guess_wb_article(item),
-            'url': item['product_url'],
-            'title': sku_title,
-        }
+        self.skus_retrieved[item['wb_id']] = SkuRecord(
+            parse_date=item['parse_date'],
+            brand=item['wb_brand_url'] if 'wb_brand_url' in item.keys() else None,
+            article=guess_wb_article(item),
+            url=item['product_url'],
+            title=sku_title,
+        )
 
     def update_all_caches(self, catalogs, brands, parameters, skus):
         self.update_catalogs_cache(catalogs)
@@ -378,8 +1004,13 @@ class Indexer(object):
         self.update_sku_cache(skus)
 
     # Обновление горячего кеша объектов в памяти данными, которые есть в БД
-    def update_caches_from_db(self, object_name, model, cache_key):
+    def update_caches_from_db(self, object_name, model, cache_key, reselect=False):
+        """
+        reselect – повторный поиск после создания недостающих записей: фильтр ключей (см. wdf.key_filter) их еще
+        не знает, поэтому он не применяется, а найденные ключи добавляются в него сразу, до коммита
+        """
         model_key = model._meta.label
+        stage = f'{object_name}_reselect' if reselect else f'{object_name}_select'
 
         start_time = time.time()
 
@@ -389,26 +1020,106 @@ class Indexer(object):
         retrieved = getattr(self, retrieved_attr_name)
         cached = getattr(self, cached_attr_name)
 
-        # по этому фильтру будем искать в бд
-        filter_key = cache_key + '__in'
-
         # смотрим каких записей нет в горячем кеше в памяти
         items_to_retrieve = set(retrieved.keys()).difference(set(cached.keys()))
 
-        # пытаемся найти их в бд
-        items_retrieved = model.objects.filter(**{filter_key: items_to_retrieve})
+        key_index = self.get_key_index(object_name)
+
+        if key_index is not None:
+            with self.timer.stage(f'{object_name}_index', rows=len(items_to_retrieve)):
+                items_indexed = key_index.lookup(items_to_retrieve)
+
+            if self.sku_index_verify and len(items_indexed) > 0:
+                with self.timer.stage(f'{object_name}_index_verify', rows=len(items_indexed)):
+                    items_indexed = self.verify_indexed(model, key_index, items_indexed)
+
+            cached.update(items_indexed)
+            items_to_retrieve.difference_update(items_indexed)
+
+        key_filter = get_key_filter(object_name, model, cache_key)
+        items_absent = set()
+
+        # ключи, которых точно нет в БД, не ищем: записи для них сразу создаются
+        if key_filter is not None and not reselect:
+            with self.timer.stage(f'{object_name}_filter', rows=len(items_to_retrieve)):
+                items_absent = key_filter.absent(items_to_retrieve)
 
-        # сохраняем найденное в память
-        setattr(self, cached_attr_name, {**getattr(self, cached_attr_name),
-                                         **dict([(getattr(item, cache_key), item.id) for item in items_retrieved])})
+                items_to_retrieve.difference_update(items_absent)
+
+        with self.timer.stage(stage):
+            # пытаемся найти их в бд: из бд читаются только пары (ключ, id)
+            items_retrieved = lookup_ids(model, cache_key, items_to_retrieve, method=self.cache_lookup)
+
+            # сохраняем найденное в память: кеш дополняется на месте, без копии на каждый чанк
+            cached.update(items_retrieved)
+
+        if key_filter is not None and not reselect:
+            self.observe_key_filter(object_name, items_absent, items_to_retrieve, items_retrieved)
+
+        # созданные в этой транзакции записи попадают в индекс процесса только после ее коммита
+        if key_index is not None and len(items_retrieved) > 0:
+            transaction.on_commit(lambda: key_index.add(items_retrieved))
+
+        # а в общий фильтр – сразу: пока транзакция не закоммичена, другие воркеры не должны считать ключи новыми.
+        # Ключи откатившейся транзакции остаются в фильтре ложными срабатываниями
+        if key_filter is not None and reselect and len(items_retrieved) > 0:
+            key_filter.add([key for key, _ in items_retrieved])
 
         items_count = len(items_retrieved)
 
+        self.timer.add_rows(stage, items_count)
+
         time_spent = time.time() - start_time
 
         logger.info(
             f'{self.log_prefix}{model_key} objects retrieved from DB ({items_count} items) in {time_spent}s, {round(items_count / time_spent * 60)} items/min')
 
+    def get_key_index(self, object_name):
+        """
+        Индекс ключей в памяти процесса, в котором записи ищутся до запроса в БД
+        """
+        if object_name == 'skus' and self.sku_index and connection.vendor == 'postgresql':
+            return get_sku_index()
+
+        return None
+
+    def verify_indexed(self, model, key_index, items_indexed):
+        """
+        Найденные в индексе записи, которые еще есть в БД. Sku.merge_duplicates удаляет дубли в другом процессе,
+        и индекс может отдать id удаленной записи – версии с ним не сохранятся (внешний ключ). Такие ключи
+        убираются из индекса и ищутся в БД как обычно
+        """
+        # временная таблица хранит ключи текстом и с uuid не сравнивается, поэтому поиск всегда массивом
+        existing = {pk for pk, _ in lookup_ids(model, model._meta.pk.name, set(items_indexed.values()), method=LOOKUP_ARRAY)}
+        stale = [key for key, pk in items_indexed.items() if pk not in existing]
+
+        if len(stale) == 0:
+            return items_indexed
+
+        logger.info(f'{self.log_prefix}{len(stale)} {model._meta.label} keys removed from index: records were deleted')
+
+        key_index.discard(stale)
+
+        return {key: pk for key, pk in items_indexed.items() if pk in existing}
+
+    def observe_key_filter(self, object_name, items_absent, items_checked, items_retrieved):
+        """
+        Статистика фильтра ключей за чанк: сколько поисков пропущено и сколько ключей прошли фильтр, но в БД их нет
+        """
+        # ключи None фильтр не проверяет (и в БД они не ищутся)
+        false_positives = len(items_checked.difference(key for key, _ in items_retrieved).difference([None]))
+
+        stats = self.key_filter_stats.setdefault(object_name, {'skipped': 0, 'false_positives': 0})
+        stats['skipped'] += len(items_absent)
+        stats['false_positives'] += false_positives
+
+        KEY_FILTER_LOOKUPS.labels(object=object_name, result='skipped').inc(len(items_absent))
+        KEY_FILTER_LOOKUPS.labels(object=object_name, result='false_positive').inc(false_positives)
+
+    def observe_cache_lookups(self, object_name, retrieved, not_found):
+        CACHE_LOOKUPS.labels(object=object_name, result='hit').inc(len(retrieved) - len(not_found))
+        CACHE_LOOKUPS.labels(object=object_name, result='miss').inc(len(not_found))
+
     # Поиск несуществующих в кеше объектов
     def filter_items_not_found(self, object_name, model, cache_key):
         retrieved = getattr(self, object_name + '_retrieved')
@@ -420,75 +1131,119 @@ class Indexer(object):
     def update_catalogs_cache(self, retrieved):
         self.update_caches_from_db('catalogs', DictCatalog, 'url')
 
-        for catalog_url in self.filter_items_not_found('catalogs', DictCatalog, 'url'):
-            self.bulk_manager.add(DictCatalog(
-                marketplace_id=retrieved[catalog_url]['marketplace'],
-                parent_id=retrieved[catalog_url]['parent'] or None,
-                name=retrieved[catalog_url]['name'],
-                url=retrieved[catalog_url]['url'],
-                level=retrieved[catalog_url]['level'],
-                created_at=timezone.now(),
-            ))
+        not_found = self.filter_items_not_found('catalogs', DictCatalog, 'url')
 
-        self.bulk_manager.done(log_prefix=self.log_prefix)
+        self.observe_cache_lookups('catalogs', retrieved, not_found)
 
-        self.update_caches_from_db('catalogs', DictCatalog, 'url')
+        with self.timer.stage('catalogs_insert', rows=len(not_found)):
+            for catalog_url in not_found:
+                self.bulk_manager.add(DictCatalog(
+                    marketplace_id=self.marketplace.id,
+                    parent_id=retrieved[catalog_url].parent or None,
+                    name=retrieved[catalog_url].name,
+                    url=retrieved[catalog_url].url,
+                    level=retrieved[catalog_url].level,
+                    created_at=timezone.now(),
+                ))
+
+            self.bulk_manager.done(log_prefix=self.log_prefix)
+
+        self.update_caches_from_db('catalogs', DictCatalog, 'url', reselect=True)
 
     def update_brands_cache(self, retrieved):
         self.update_caches_from_db('brands', DictBrand, 'url')
 
-        for brand_url in self.filter_items_not_found('brands', DictBrand, 'url'):
-            self.bulk_manager.add(DictBrand(
-                marketplace_id=retrieved[brand_url]['marketplace'],
-                name=retrieved[brand_url]['name'],
-                url=retrieved[brand_url]['url'],
-                created_at=timezone.now(),
-            ))
+        not_found = self.filter_items_not_found('brands', DictBrand, 'url')
 
-        self.bulk_manager.done(log_prefix=self.log_prefix)
+        self.observe_cache_lookups('brands', retrieved, not_found)
 
-        self.update_caches_from_db('brands', DictBrand, 'url')
+        with self.timer.stage('brands_insert', rows=len(not_found)):
+            for brand_url in not_found:
+                self.bulk_manager.add(DictBrand(
+                    marketplace_id=self.marketplace.id,
+                    name=retrieved[brand_url].name,
+                    url=retrieved[brand_url].url,
+                    created_at=timezone.now(),
+                ))
+
+            self.bulk_manager.done(log_prefix=self.log_prefix)
+
+        self.update_caches_from_db('brands', DictBrand, 'url', reselect=True)
 
     def update_parameters_cache(self, retrieved):
         self.update_caches_from_db('parameters', DictParameter, 'name')
 
-        for parameter_name in self.filter_items_not_found('parameters', DictParameter, 'name'):
-            self.bulk_manager.add(DictParameter(
-                marketplace_id=retrieved[parameter_name]['marketplace'],
-                name=parameter_name,
-                created_at=timezone.now(),
-            ))
+        not_found = self.filter_items_not_found('parameters', DictParameter, 'name')
 
-        self.bulk_manager.done(log_prefix=self.log_prefix)
+        self.observe_cache_lookups('parameters', retrieved, not_found)
 
-        self.update_caches_from_db('parameters', DictParameter, 'name')
+        with self.timer.stage('parameters_insert', rows=len(not_found)):
+            for parameter_name in not_found:
+                self.bulk_manager.add(DictParameter(
+                    marketplace_id=self.marketplace.id,
+                    name=parameter_name,
+                    created_at=timezone.now(),
+                ))
+
+            self.bulk_manager.done(log_prefix=self.log_prefix)
+
+        self.update_caches_from_db('parameters', DictParameter, 'name', reselect=True)
 
     def update_sku_cache(self, retrieved):
         self.update_caches_from_db('skus', Sku, 'article')
 
-        for sku_article in self.filter_items_not_found('skus', Sku, 'article'):
-            if len(self.brands_cache.keys()) > 0 and retrieved[sku_article]['brand'] is not None:
-                brand_id = self.brands_cache[retrieved[sku_article]['brand']]
-            else:
-                brand_id = None
-
-            self.bulk_manager.add(Sku(
-                marketplace_id=retrieved[sku_article]['marketplace'],
-                article=retrieved[sku_article]['article'],
-                url=retrieved[sku_article]['url'],
-                title=retrieved[sku_article]['title'],
-                brand_id=brand_id,
-                created_at=timezone.now(),
-                updated_at=timezone.now(),
-            ))
+        not_found = self.filter_items_not_found('skus', Sku, 'article')
 
-        self.bulk_manager.done(log_prefix=self.log_prefix)
+        self.observe_cache_lookups('skus', retrieved, not_found)
 
-        self.update_caches_from_db('skus', Sku, 'article')
+        with self.timer.stage('skus_insert', rows=len(not_found)):
+            for sku_article in not_found:
+                if len(self.brands_cache.keys()) > 0 and retrieved[sku_article].brand is not None:
+                    brand_id = self.brands_cache[retrieved[sku_article].brand]
+                else:
+                    brand_id = None
+
+                self.bulk_manager.add(Sku(
+                    marketplace_id=self.marketplace.id,
+                    article=retrieved[sku_article].article,
+                    url=retrieved[sku_article].url,
+                    title=retrieved[sku_article].title,
+                    brand_id=brand_id,
+                    created_at=timezone.now(),
+                    updated_at=timezone.now(),
+                ))
+
+            self.bulk_manager.done(log_prefix=self.log_prefix)
+
+        self.update_caches_from_db('skus', Sku, 'article', reselect=True)
+
+
+def fetch_job_stats(sh_client, job_id):
+    """
+    Статистика задачи Scrapinghub в виде значений полей модели Dump
+    """
+    job_metadata = sh_client.get_job(job_id).metadata
+
+    return {
+        'crawl_started_at': parse_job_time(job_metadata.get('running_time')),
+        'crawl_ended_at': parse_job_time(job_metadata.get('finished_time')),
+        'items_crawled': job_metadata.get('scrapystats')['item_scraped_count'],
+    }
 
 
 def guess_wb_article(item):
     if len(str(item['wb_id'])) > 20:
-        return re.findall(r'\/catalog\/(\d{1,20})\/detail\.aspx', item['product_url'])[0]
+        return ARTICLE_RE.findall(item['product_url'])[0]
     else:
         return item['wb_id']
+
+
+def get_partition_key(item):
+    """
+    Ключ раздела копии дампа – артикул нормализованного айтема. Айтемы, которые нормализация отклонит, раскладываются
+    по wb_id как есть: из копии они не выпадают и при импорте попадают в RejectedItem
+    """
+    try:
+        return guess_wb_article(normalize_item(item))
+    except ItemRejectedError:
+        return item.get('wb_id')
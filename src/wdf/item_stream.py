@@ -0,0 +1,71 @@
+"""
+Потоковое чтение айтемов дампа.
+
+list_iter клиента Scrapinghub собирает каждый чанк в список айтемов, и индексатор держит весь чанк в памяти
+от сбора словарей до сохранения версий, поэтому пик памяти растет вместе с INDEXER_GET_CHUNK_SIZE. В потоковом
+режиме (INDEXER_STREAMING) айтемы декодируются из ответа Scrapinghub или из копии дампа по одному, сразу
+разбираются в словари индексатора, а для сохранения версий от айтема остается только компактная запись SaveRecord
+"""
+import sys
+from collections import namedtuple
+
+from wdf.timestamps import parse_timestamp
+
+# Поле в айтеме отсутствует (None – это значение, которое тоже сохраняется)
+MISSING = object()
+
+SaveRecord = namedtuple('SaveRecord', ['wb_id', 'crawled_at', 'price', 'rating', 'sales', 'reviews', 'category_url', 'position', 'features'])
+
+
+class RecordChunk(list):
+    """
+    Чанк записей SaveRecord, словари по айтемам которого уже собраны. Айтемы, не прошедшие нормализацию, в чанк
+    не попадают, но учитываются в rejected
+    """
+    rejected = 0
+
+    @property
+    def items_read(self):
+        return len(self) + self.rejected
+
+
+def make_save_record(item):
+    """
+    Все, что нужно из айтема для сохранения версии (см. Indexer.save_all), с уже приведенными типами
+    """
+    reviews = item.get('wb_reviews_count', MISSING)
+
+    return SaveRecord(
+        wb_id=item['wb_id'],
+        crawled_at=parse_timestamp(item['parse_date']),
+        price=float(item['wb_price']) if 'wb_price' in item else MISSING,
+        rating=item.get('wb_rating', MISSING),
+        sales=item.get('wb_purchases_count', MISSING),
+        reviews=0 if reviews == '' else reviews,
+        category_url=item.get('wb_category_url'),
+        position=item.get('wb_category_position', MISSING),
+        features=tuple(item['features'][0].items()) if 'features' in item else (),
+    )
+
+
+def iter_job_items(sh_client, job_id, start=0, count=sys.maxsize, window=1000):
+    """
+    Айтемы задачи по одному. Запрашиваются окнами по window айтемов, как в list_iter, но каждый ответ
+    декодируется из msgpack по мере получения, а не собирается в список
+    """
+    items = sh_client.get_job(job_id).items
+    processed = 0
+
+    while processed < count:
+        window_count = min(window, count - processed)
+        received = 0
+
+        for item in items.iter(count=window_count, start=f'{job_id}/{start + processed}'):
+            received += 1
+
+            yield item
+
+        processed += received
+
+        if received < window_count:
+            break
@@ -0,0 +1,251 @@
+"""
+Фильтры Блума ключей, которые уже есть в БД: артикулов SKU, ссылок каталогов и брендов, имен параметров.
+
+В чанках свежих обходов категорий почти все SKU новые, но каждый из них сначала ищется в БД (update_caches_from_db)
+и только потом создается. Если фильтр говорит, что ключа точно нет, запрос в БД для него пропускается и запись сразу
+создается; ключи, которые в фильтре могут быть, ищутся в БД как обычно. Ложные срабатывания (ключ прошел фильтр,
+но в БД его нет) стоят только лишнего поиска, а доля таких ключей среди отсутствующих пишется в лог чанка.
+
+Фильтр хранится в файле (по одному на словарь) в каталоге INDEXER_BLOOM_DIR на общем для воркеров диске и
+отображается в память каждого процесса, поэтому все воркеры видят одни и те же биты. Новые ключи добавляются сразу
+после создания записей, еще до коммита их транзакции, под блокировкой файла: иначе другой воркер успеет увидеть ключ
+отсутствующим и создать дубль. Если транзакция откатится, лишние биты дадут только ложные срабатывания. Биты только
+устанавливаются, поэтому читать фильтр можно без блокировки. Если файла нет, он строится по всем ключам из БД (или
+командой build_key_filters).
+
+Ключи незакоммиченных транзакций перестройка в БД не видит, поэтому биты старого файла переносятся в новый. Это возможно,
+только если размер фильтра не меняется: перестраивать фильтр с другими INDEXER_BLOOM_CAPACITY или
+INDEXER_BLOOM_ERROR_RATE нужно, когда импорт остановлен.
+
+Ключи, созданные в обход индексатора, в фильтр не попадают: после таких загрузок фильтры нужно перестроить.
+Настройки: INDEXER_BLOOM_DIR (пусто – фильтры не используются), INDEXER_BLOOM_CAPACITY и INDEXER_BLOOM_ERROR_RATE
+"""
+import environ
+import fcntl
+import hashlib
+import logging
+import math
+import numpy as np
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+env = environ.Env(DEBUG=(bool, False))
+environ.Env.read_env()
+
+logger = logging.getLogger('wdf.indexer')
+logger.setLevel(logging.INFO)
+
+# Заголовок файла фильтра: сигнатура, количество бит и хеш-функций, на сколько ключей рассчитан фильтр
+HEADER = struct.Struct('>8sQQQ')
+SIGNATURE = b'WDFBLOOM'
+
+BUILD_BATCH_SIZE = 100000
+
+
+def get_filter_size(capacity, error_rate):
+    """
+    Количество бит и хеш-функций фильтра на capacity ключей с долей ложных срабатываний error_rate
+    """
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+
+    return bits, hashes
+
+
+@contextmanager
+def locked(path):
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class BloomFilter(object):
+    """
+    Фильтр Блума в файле path. Позиции бит ключа – двойное хеширование по двум половинам blake2b
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            signature, self.bits, self.hashes, self.capacity = HEADER.unpack(f.read(HEADER.size))
+
+        if signature != SIGNATURE:
+            raise ValueError(f'{path} is not a key filter file')
+
+        self.bitmap = np.memmap(path, dtype=np.uint8, mode='r+', offset=HEADER.size, shape=(math.ceil(self.bits / 8),))
+        self.inode = os.stat(path).st_ino
+
+    def is_replaced(self):
+        """
+        Файл фильтра перестроен (например, командой build_key_filters), и процесс держит в памяти старый
+        """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    @classmethod
+    def create(cls, path, capacity, error_rate, keys=(), previous=None):
+        """
+        Новый фильтр по ключам keys (итератор пачек ключей) и битам фильтра previous того же размера. Файл
+        подменяется целиком, когда фильтр уже заполнен
+        """
+        bits, hashes = get_filter_size(capacity, error_rate)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(SIGNATURE, bits, hashes, capacity))
+            f.truncate(HEADER.size + math.ceil(bits / 8))
+
+        key_filter = cls(temp_path)
+
+        for batch in keys:
+            key_filter.set_bits(batch)
+
+        if previous is not None:
+            np.bitwise_or(key_filter.bitmap, previous.bitmap, out=key_filter.bitmap)
+
+        key_filter.bitmap.flush()
+        key_filter.path = path
+
+        os.replace(temp_path, path)
+
+        return key_filter
+
+    def get_positions(self, keys):
+        digests = b''.join(hashlib.blake2b(key.encode(), digest_size=16).digest() for key in keys)
+        halves = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+
+        # переполнение uint64 здесь ожидаемо: позиции считаются по модулю 2^64, а потом по модулю размера фильтра
+        with np.errstate(over='ignore'):
+            positions = halves[:, :1] + np.arange(self.hashes, dtype=np.uint64) * halves[:, 1:]
+
+        return positions % np.uint64(self.bits)
+
+    def set_bits(self, keys):
+        keys = [key for key in keys if key is not None]
+
+        if len(keys) == 0:
+            return
+
+        positions = self.get_positions(keys).ravel()
+
+        np.bitwise_or.at(self.bitmap, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+
+    def add(self, keys):
+        """
+        Добавление ключей созданных записей (до коммита их транзакции). Блокировка нужна, чтобы процессы не затирали
+        биты одного байта друг друга и не добавляли ключи в файл, который в это время перестраивается
+        """
+        with locked(self.path):
+            # пока ключи ждали блокировки, фильтр могли перестроить: тогда они нужны уже в новом файле
+            key_filter = BloomFilter(self.path) if self.is_replaced() else self
+
+            key_filter.set_bits(keys)
+            key_filter.bitmap.flush()
+
+    def absent(self, keys):
+        """
+        Ключи, которых в фильтре точно нет
+        """
+        keys = [key for key in keys if key is not None]
+
+        if len(keys) == 0:
+            return set()
+
+        positions = self.get_positions(keys)
+        is_set = (self.bitmap[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+
+        return {key for key, present in zip(keys, is_set.all(axis=1)) if not present}
+
+
+def build_key_filter(path, model, key_field, capacity, error_rate):
+    """
+    Фильтр по всем ключам key_field записей model. Вызывается под блокировкой файла фильтра (locked).
+
+    Биты прежнего фильтра того же размера переносятся в новый: в нем есть ключи транзакций, которые еще
+    не закоммичены и поэтому не попадут в выборку из БД
+    """
+    start_time = time.time()
+
+    previous = get_previous_filter(path, capacity, error_rate)
+
+    keys = model.objects.values_list(key_field, flat=True).iterator(chunk_size=BUILD_BATCH_SIZE)
+    batches = iter(lambda: [key for _, key in zip(range(BUILD_BATCH_SIZE), keys)], [])
+
+    key_filter = BloomFilter.create(path, capacity, error_rate, batches, previous=previous)
+
+    logger.info(
+        f'Key filter {path} for {model._meta.label}.{key_field} built in {time.time() - start_time}s: '
+        f'{key_filter.bits} bits, {key_filter.hashes} hashes, capacity {capacity}')
+
+    return key_filter
+
+
+def get_previous_filter(path, capacity, error_rate):
+    """
+    Прежний фильтр в path, если его биты можно перенести в новый фильтр на capacity ключей
+    """
+    if not os.path.exists(path):
+        return None
+
+    previous = BloomFilter(path)
+
+    if (previous.bits, previous.hashes) != get_filter_size(capacity, error_rate):
+        logger.warning(
+            f'Key filter {path} is rebuilt with another size, keys of uncommitted transactions are lost: '
+            'rebuild it while imports are stopped')
+
+        return None
+
+    return previous
+
+
+# Открытые в процессе фильтры: имя словаря → фильтр
+_key_filters = {}
+_key_filters_lock = threading.Lock()
+
+
+def get_key_filter_path(directory, name):
+    return os.path.join(directory, f'{name}.bloom')
+
+
+def get_key_filter(name, model, key_field):
+    """
+    Фильтр ключей словаря name по настройкам из окружения. None, если каталог для фильтров не задан
+    """
+    directory = env('INDEXER_BLOOM_DIR', default='')
+
+    if directory == '':
+        return None
+
+    path = get_key_filter_path(directory, name)
+
+    with _key_filters_lock:
+        key_filter = _key_filters.get(name)
+
+        if key_filter is None or key_filter.path != path or key_filter.is_replaced():
+            with locked(path):
+                if os.path.exists(path):
+                    _key_filters[name] = BloomFilter(path)
+                else:
+                    _key_filters[name] = build_key_filter(
+                        path, model, key_field,
+                        capacity=env('INDEXER_BLOOM_CAPACITY', cast=int, default=10000000),
+                        error_rate=env('INDEXER_BLOOM_ERROR_RATE', cast=float, default=0.01),
+                    )
+
+        return _key_filters[name]
+
+
+def reset_key_filters():
+    with _key_filters_lock:
+        _key_filters.clear()
@@ -0,0 +1,78 @@
+"""
+Поиск id записей словарей по ключам чанка (Indexer.update_caches_from_db).
+
+Фильтр key__in на несколько тысяч ключей – это запрос с тысячами параметров, который каждый раз заново разбирается и
+планируется, а ORM еще и собирает полные объекты моделей, хотя нужны только ключ и id. Поэтому на Постгресе ключи
+передаются одним массивом (array) или загружаются через COPY во временную таблицу, с которой делается join
+(temp_table), а из БД читаются только пары (ключ, id). На остальных БД – фильтр __in с values_list
+"""
+import csv
+import io
+from django.db import connection
+
+LOOKUP_IN = 'in'
+LOOKUP_ARRAY = 'array'
+LOOKUP_TEMP_TABLE = 'temp_table'
+
+LOOKUP_METHODS = (LOOKUP_IN, LOOKUP_ARRAY, LOOKUP_TEMP_TABLE)
+
+# Временная таблица живет до конца сессии, у каждого соединения (и потока конвейера) она своя
+TEMP_TABLE = 'wdf_lookup_keys'
+
+
+def lookup_ids(model, key_field, keys, method=LOOKUP_ARRAY):
+    """
+    Пары (ключ, id) записей model, у которых значение key_field есть в keys
+    """
+    if method not in LOOKUP_METHODS:
+        raise ValueError(f'Unknown lookup method {method}, expected one of {", ".join(LOOKUP_METHODS)}')
+
+    # NULL ни с чем не совпадает и в фильтре __in
+    keys = [key for key in keys if key is not None]
+
+    if len(keys) == 0:
+        return []
+
+    if method == LOOKUP_IN or connection.vendor != 'postgresql':
+        return list(model.objects.filter(**{key_field + '__in': keys}).values_list(key_field, 'pk'))
+
+    if method == LOOKUP_ARRAY:
+        return lookup_ids_array(model, key_field, keys)
+
+    return lookup_ids_temp_table(model, key_field, keys)
+
+
+def get_columns(model, key_field):
+    quote_name = connection.ops.quote_name
+
+    return quote_name(model._meta.db_table), quote_name(model._meta.get_field(key_field).column), quote_name(model._meta.pk.column)
+
+
+def lookup_ids_array(model, key_field, keys):
+    table, key_column, id_column = get_columns(model, key_field)
+
+    with connection.cursor() as cursor:
+        # список psycopg2 передает как один массив: запрос и план не зависят от количества ключей
+        cursor.execute(f'SELECT {key_column}, {id_column} FROM {table} WHERE {key_column} = ANY(%s)', [keys])
+
+        return cursor.fetchall()
+
+
+def lookup_ids_temp_table(model, key_field, keys):
+    table, key_column, id_column = get_columns(model, key_field)
+
+    keys_file = io.StringIO()
+    csv.writer(keys_file, quoting=csv.QUOTE_ALL).writerows([key] for key in keys)
+    keys_file.seek(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {TEMP_TABLE} (key text)')
+        cursor.execute(f'TRUNCATE {TEMP_TABLE}')
+        cursor.copy_expert(f'COPY {TEMP_TABLE} (key) FROM STDIN WITH (FORMAT csv)', keys_file)
+        cursor.execute(f'ANALYZE {TEMP_TABLE}')
+
+        cursor.execute(
+            f'SELECT {table}.{key_column}, {table}.{id_column} FROM {table} '
+            f'JOIN {TEMP_TABLE} ON {table}.{key_column} = {TEMP_TABLE}.key')
+
+        return cursor.fetchall()
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import resource
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from wdf.models import (
+    DictBrand, DictCatalog, DictParameter, Dump, Parameter, Position, Price, Rating, Reviews, Sales, Sku, Version)
+from wdf.stage_timer import overall_stats
+from wdf.synthetic import SyntheticIndexer, generate_items
+
+BENCHMARK_MODELS = (DictCatalog, DictBrand, DictParameter, Sku, Version, Price, Rating, Sales, Reviews, Position, Parameter)
+
+
+class QueryCounter(object):
+    """
+    Счетчик запросов к БД через execute_wrapper – в отличие от connection.queries не хранит сами запросы
+    и не ограничен по количеству
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Measures end-to-end ingestion speed on synthetic Wildberries items'  # noqa: VNE003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--catalogs', type=int, default=10)
+        parser.add_argument('--brands', type=int, default=100)
+        parser.add_argument('--features', type=int, default=10)
+        parser.add_argument('--chunk_size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', choices=['yes', 'no'], default='no')
+
+    def handle(self, *args, **options):
+        console = logging.StreamHandler()
+        console.setLevel(logging.INFO)
+        console.setFormatter(logging.Formatter('[%(levelname)s] %(name)s: %(message)s'))
+
+        logger = logging.getLogger('')
+        logger.addHandler(console)
+
+        if connection.vendor != 'postgresql':
+            self.stderr.write(self.style.WARNING(f'Running on {connection.vendor}, PG COPY path will not be measured'))
+
+        items = list(generate_items(
+            options['items'],
+            catalogs=options['catalogs'],
+            brands=options['brands'],
+            features=options['features'],
+            seed=options['seed'],
+        ))
+
+        job_id = self.get_job_id(options['seed'])
+
+        Dump.objects.create(
+            job=job_id,
+            crawler='wb',
+            items_crawled=len(items),
+            crawl_started_at=datetime.now(timezone.utc),
+            crawl_ended_at=datetime.now(timezone.utc),
+        )
+
+        indexer = SyntheticIndexer(job_id=job_id, items=items)
+        indexer.set_chunk_size_get(options['chunk_size'])
+        indexer.set_chunk_size_save(options['chunk_size'])
+
+        overall_stats.reset()
+
+        report = {
+            'items': len(items),
+            'chunk_size': options['chunk_size'],
+            'catalogs': options['catalogs'],
+            'brands': options['brands'],
+            'features': options['features'],
+            'database': connection.vendor,
+        }
+
+        with self.measure(report, 'prepare', len(items)):
+            indexer.prepare_dump()
+
+        with self.measure(report, 'import', len(items)):
+            indexer.import_dump()
+
+        indexer.wrap_dump()
+
+        report['stages'] = overall_stats.as_dict()
+        report['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+
+        if options['keep'] == 'no':
+            # prune() работает через сырой SQL только на постгресе
+            if connection.vendor == 'postgresql':
+                indexer.dump.prune()
+            else:
+                indexer.dump.delete()
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def get_job_id(self, seed):
+        """
+        Свободный идентификатор дампа для прогона: сид генератора, pid (одновременные прогоны) и счетчик прогонов.
+        Идентификатор должен уместиться в Dump.job
+        """
+        prefix = f'bench/{seed}/{os.getpid()}.'
+        run_no = Dump.objects.filter(job__startswith=prefix).count() + 1
+
+        while Dump.objects.filter(job=f'{prefix}{run_no}').exists():
+            run_no += 1
+
+        job_id = f'{prefix}{run_no}'
+
+        if len(job_id) > Dump._meta.get_field('job').max_length:
+            raise CommandError(f'Benchmark job id {job_id} does not fit Dump.job, use a shorter seed')
+
+        return job_id
+
+    @contextmanager
+    def measure(self, report, phase, items_count):
+        counter = QueryCounter()
+        rows_before = self.count_rows()
+
+        start_time = time.time()
+
+        with connection.execute_wrapper(counter):
+            yield
+
+        time_spent = time.time() - start_time
+
+        rows_after = self.count_rows()
+
+        report[phase] = {
+            'seconds': round(time_spent, 3),
+            'items_per_sec': round(items_count / time_spent, 2),
+            'queries': counter.count,
+            'rows_per_sec': {
+                table: round((rows_after[table] - rows_before[table]) / time_spent, 2) for table in rows_after.keys()
+            },
+        }
+
+    def count_rows(self):
+        return {model._meta.db_table: model.objects.count() for model in BENCHMARK_MODELS}
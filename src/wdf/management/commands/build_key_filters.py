@@ -0,0 +1,53 @@
+import environ
+import logging
+import os
+from django.core.management.base import BaseCommand, CommandError
+
+from wdf.key_filter import build_key_filter, get_key_filter_path, locked
+from wdf.models import DictBrand, DictCatalog, DictParameter, Sku
+
+env = environ.Env(DEBUG=(bool, False))
+environ.Env.read_env()
+
+# Словари индексатора и их ключи (см. Indexer.update_*_cache)
+KEY_FILTERS = {
+    'catalogs': (DictCatalog, 'url'),
+    'brands': (DictBrand, 'url'),
+    'parameters': (DictParameter, 'name'),
+    'skus': (Sku, 'article'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Bloom filters of existing dictionary keys and SKU articles in INDEXER_BLOOM_DIR'  # noqa: VNE003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capacity', type=int, default=env('INDEXER_BLOOM_CAPACITY', cast=int, default=10000000))
+        parser.add_argument('--error_rate', type=float, default=env('INDEXER_BLOOM_ERROR_RATE', cast=float, default=0.01))
+        parser.add_argument('--only', choices=KEY_FILTERS.keys(), nargs='+', default=list(KEY_FILTERS.keys()))
+
+    def handle(self, *args, **options):
+        console = logging.StreamHandler()
+        console.setLevel(logging.INFO)
+        console.setFormatter(logging.Formatter('[%(levelname)s] %(name)s: %(message)s'))
+
+        logger = logging.getLogger('')
+        logger.addHandler(console)
+
+        directory = env('INDEXER_BLOOM_DIR', default='')
+
+        if directory == '':
+            raise CommandError('INDEXER_BLOOM_DIR is not set')
+
+        os.makedirs(directory, exist_ok=True)
+
+        for name in options['only']:
+            model, key_field = KEY_FILTERS[name]
+            path = get_key_filter_path(directory, name)
+
+            # воркеры ждут перестройки, добавляя новые ключи, и потом пишут их уже в новый файл
+            with locked(path):
+                key_filter = build_key_filter(path, model, key_field, options['capacity'], options['error_rate'])
+
+            self.stdout.write(self.style.SUCCESS(
+                f'{name}: {key_filter.bits} bits ({round(key_filter.bitmap.nbytes / 1024 / 1024, 2)}MB), {key_filter.hashes} hashes'))
@@ -0,0 +1,32 @@
+import json
+from celery import group
+from django.core.management.base import BaseCommand
+
+from wdf.models import Dump, DumpRange
+from wdf.tasks import import_ranges
+
+
+class Command(BaseCommand):
+    help = 'Shows import progress of dumps by their range ledger'  # noqa: VNE003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job_id', type=str, required=False)
+        parser.add_argument('--requeue', choices=['yes', 'no'], default='no', help='start workers for failed, expired and unstarted ranges')
+        parser.add_argument('--workers', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options['job_id']:
+            dumps = Dump.objects.filter(job=options['job_id'])
+        else:
+            dumps = Dump.objects.filter(state_code__lt=Dump.PROCESSED, ranges__isnull=False).distinct()
+
+        for dump in dumps:
+            self.stdout.write(json.dumps(dump.get_progress()))
+
+            if options['requeue'] == 'yes':
+                pending_ranges = dump.ranges.exclude(state_code=DumpRange.PROCESSED).count()
+                workers = min(options['workers'], pending_ranges)
+
+                group([import_ranges.s(None, job_id=dump.job, workers=workers) for _ in range(workers)]).apply_async(expires=24 * 60 * 60)
+
+                self.stdout.write(self.style.SUCCESS(f'Job #{dump.job}: {workers} workers started for {pending_ranges} pending ranges'))
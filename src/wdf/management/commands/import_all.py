@@ -1,17 +1,22 @@
 import environ
 import logging
-from celery import chain, chord
+from celery import current_app
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from math import ceil
-from scrapinghub import ScrapinghubClient
+from functools import partial
 
-from wdf.indexer import Indexer
-from wdf.tasks import import_dump, prepare_dump, wrap_dump
+from wdf.indexer import fetch_job_stats
+from wdf.models import Dump
+from wdf.sh_client import get_sh_client
+from wdf.stage_timer import StageTimer, overall_stats
+from wdf.tasks import build_import_chain
 
 env = environ.Env(DEBUG=(bool, False))
 environ.Env.read_env()
 
+STATS_FIELDS = ('crawl_started_at', 'crawl_ended_at', 'items_crawled')
+
 
 class Command(BaseCommand):
     help = 'Adds all selected by tag jobs to data facility'  # noqa: VNE003
@@ -19,8 +24,13 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--tags', type=str, default='')
         parser.add_argument('--state', type=str, default='finished', required=False)
-        parser.add_argument('--chunk_size', type=int, default=env('INDEXER_GET_CHUNK_SIZE'), required=False)
         parser.add_argument('--group_size', type=int, default=env('INDEXER_GET_CHUNK_SIZE'), required=False)
+        parser.add_argument('--concurrency', type=int, default=env('INDEXER_DISCOVERY_CONCURRENCY', cast=int, default=16), required=False)
+        parser.add_argument('--workers', type=int, default=env('INDEXER_IMPORT_WORKERS', cast=int, default=8), required=False)
+        parser.add_argument('--partitions', type=int, default=env('INDEXER_RANGE_PARTITIONS', cast=int, default=1), required=False,
+                            help='split spooled dump into ranges by article hash')
+        parser.add_argument('--single_pass', choices=['auto', 'yes', 'no'], default='auto', help='prepare and import in one pass (auto – for small dumps)')
+        parser.add_argument('--timings', choices=['yes', 'no'], default='no')
 
     def handle(self, *args, **options):
         console = logging.StreamHandler()
@@ -30,32 +40,74 @@ class Command(BaseCommand):
         logger = logging.getLogger('')
         logger.addHandler(console)
 
-        client = ScrapinghubClient(settings.SH_APIKEY)
+        client = get_sh_client()
+        timer = StageTimer()
+        group_size = options['group_size']
 
-        for job in client.get_project(settings.SH_PROJECT_ID).jobs.iter(has_tag=options['tags'].split(','), state=options['state']):
-            job_id = job['key']
+        with timer.stage('job_list'):
+            job_ids = [job['key'] for job in client.get_project(settings.SH_PROJECT_ID).jobs.iter(has_tag=options['tags'].split(','), state=options['state'])]
 
-            indexer = Indexer(job_id=job_id)
+        # Все известные дампы одним запросом вместо get_or_create на каждую задачу
+        with timer.stage('dump_lookup', rows=len(job_ids)):
+            dumps = {dump.job: dump for dump in Dump.objects.filter(job__in=job_ids, crawler='wb')}
 
-            if indexer.dump.state_code > 25:
-                self.stdout.write(self.style.SUCCESS(f'Job #{job_id} already imported'))
-                continue
+        pending_job_ids = []
 
-            group_size = options['group_size']
+        for job_id in job_ids:
+            if job_id in dumps and dumps[job_id].state_code > Dump.PROCESSING:
+                self.stdout.write(self.style.SUCCESS(f'Job #{job_id} already imported'))
+            else:
+                pending_job_ids.append(job_id)
 
-            if options['chunk_size']:
-                indexer.set_chunk_size_get(options['chunk_size'])
-                indexer.set_chunk_size_save(options['chunk_size'])
+        self.load_stats(client, timer, dumps, pending_job_ids, options['concurrency'])
 
-            tasks_num = ceil(indexer.dump.items_crawled / group_size)
+        signatures = [
+            build_import_chain(dumps[job_id], group_size, workers=options['workers'], single_pass=options['single_pass'], partitions=options['partitions'])
+            for job_id in pending_job_ids
+        ]
 
-            chain(
-                prepare_dump.s(job_id=job_id),
-                chord(
-                    [import_dump.s(job_id=job_id, start=group_size * i, count=group_size) for i in range(tasks_num)],
-                    wrap_dump.s(job_id=job_id),
-                ),
-            ).apply_async(expires=24 * 60 * 60)
+        # Все цепочки отправляются через одно соединение с брокером
+        with timer.stage('dispatch', rows=len(signatures)):
+            with current_app.connection_for_write() as connection:
+                for signature in signatures:
+                    signature.apply_async(expires=24 * 60 * 60, connection=connection)
 
+        for job_id in pending_job_ids:
             self.stdout.write(self.style.SUCCESS(
-                f'Job #{job_id} added to process queue for import ({tasks_num} tasks with up to {group_size} items each)'))
+                f'Job #{job_id} added to process queue for import (ranges with up to {group_size} items each, {options["workers"]} workers)'))
+
+        timer.flush(log_prefix='Import all: ', jobs=len(job_ids), scheduled=len(signatures))
+
+        if options['timings'] == 'yes':
+            if len(overall_stats.stages) > 0:
+                self.stdout.write(overall_stats.table())
+
+            # этапы импорта замеряют воркеры, в этом процессе они есть, только если задачи выполнялись на месте
+            if not current_app.conf.task_always_eager:
+                self.stdout.write(
+                    'Import stages are timed by the workers: see their "Stages: ..." log records '
+                    'and wdf_indexer_stage_duration_seconds')
+
+    def load_stats(self, client, timer, dumps, job_ids, concurrency):
+        """
+        Параллельная загрузка метаданных задач, для которых еще нет дампа или его статистики. Новые дампы создаются,
+        а существующие обновляются пачкой
+        """
+        job_ids = [job_id for job_id in job_ids if job_id not in dumps or any(getattr(dumps[job_id], field) is None for field in STATS_FIELDS)]
+
+        with timer.stage('metadata_fetch', rows=len(job_ids)):
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                stats = dict(zip(job_ids, executor.map(partial(fetch_job_stats, client), job_ids)))
+
+        with timer.stage('dump_save', rows=len(job_ids)):
+            new_dumps = [Dump(job=job_id, crawler='wb', **stats[job_id]) for job_id in job_ids if job_id not in dumps]
+            updated_dumps = [dumps[job_id] for job_id in job_ids if job_id in dumps]
+
+            for dump in updated_dumps:
+                for field, value in stats[dump.job].items():
+                    setattr(dump, field, value)
+
+            Dump.objects.bulk_create(new_dumps)
+            Dump.objects.bulk_update(updated_dumps, fields=STATS_FIELDS)
+
+        dumps.update({dump.job: dump for dump in new_dumps})
@@ -1,10 +1,17 @@
+import environ
 import logging
-from celery import chain, chord
-from django.core.management.base import BaseCommand
-from math import ceil
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
 
+from wdf.async_driver import AsyncImportDriver
+from wdf.exceptions import DumpStateError
 from wdf.indexer import Indexer
-from wdf.tasks import import_dump, prepare_dump, wrap_dump
+from wdf.profiler import ChunkProfiler
+from wdf.stage_timer import overall_stats
+from wdf.tasks import build_import_chain, schedule_ranges, use_single_pass
+
+env = environ.Env(DEBUG=(bool, False))
+environ.Env.read_env()
 
 
 class Command(BaseCommand):
@@ -14,6 +21,16 @@ class Command(BaseCommand):
         parser.add_argument('job_id', type=str)
         parser.add_argument('--chunk_size', type=int, default=5000, required=False)
         parser.add_argument('--group_size', type=int, default=5000, required=False)
+        parser.add_argument('--workers', type=int, default=env('INDEXER_IMPORT_WORKERS', cast=int, default=8), required=False)
+        parser.add_argument('--partitions', type=int, default=env('INDEXER_RANGE_PARTITIONS', cast=int, default=1), required=False,
+                            help='split spooled dump into ranges by article hash')
+        parser.add_argument('--single_pass', choices=['auto', 'yes', 'no'], default='auto', help='prepare and import in one pass (auto – for small dumps)')
+        parser.add_argument('--background', choices=['yes', 'no'], default='yes')
+        parser.add_argument('--driver', choices=['celery', 'asyncio'], default='celery',
+                            help='asyncio – import ranges concurrently in this process (Postgres only, implies --background no)')
+        parser.add_argument('--timings', choices=['yes', 'no'], default='no')
+        parser.add_argument('--profile_chunks', type=int, default=0, required=False)
+        parser.add_argument('--profile_dir', type=str, default=None, required=False)
 
     def handle(self, *args, **options):
         console = logging.StreamHandler()
@@ -25,6 +42,7 @@ class Command(BaseCommand):
 
         job_id = options['job_id']
         group_size = options['group_size']
+        profile = {'profile_chunks': options['profile_chunks'], 'profile_dir': options['profile_dir']}
 
         indexer = Indexer(job_id=job_id)
 
@@ -32,14 +50,43 @@ class Command(BaseCommand):
             indexer.set_chunk_size_get(options['chunk_size'])
             indexer.set_chunk_size_save(options['chunk_size'])
 
-        tasks_num = ceil(indexer.dump.items_crawled / group_size)
+        if options['driver'] == 'asyncio':
+            if connection.vendor != 'postgresql':
+                raise CommandError(f'asyncio driver works on Postgres only, not on {connection.vendor}')
+
+            try:
+                indexer.prepare_dump(partitions=options['partitions'])
+
+                schedule_ranges(indexer.dump, group_size)
+
+                AsyncImportDriver(indexer, concurrency=options['workers']).run()
+            except DumpStateError as error:
+                self.stdout.write(self.style.ERROR(f'Job #{job_id} processing failed: {error}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Job #{job_id} imported by asyncio driver ({options["workers"]} concurrent ranges)'))
+        elif options['background'] == 'yes':
+            signature = build_import_chain(
+                indexer.dump, group_size, workers=options['workers'], single_pass=options['single_pass'], partitions=options['partitions'], **profile)
+
+            signature.apply_async(expires=24 * 60 * 60)
+
+            self.stdout.write(self.style.SUCCESS(
+                f'Job #{job_id} added to process queue for import (ranges with up to {group_size} items each, {options["workers"]} workers)'))
+        else:
+            if options['profile_chunks'] > 0:
+                indexer.set_profiler(ChunkProfiler(job_id, chunks=options['profile_chunks'], directory=options['profile_dir']))
 
-        chain(
-            prepare_dump.s(job_id=job_id),
-            chord(
-                [import_dump.s(job_id=job_id, start=group_size * i, count=group_size) for i in range(tasks_num)],
-                wrap_dump.s(job_id=job_id),
-            ),
-        ).apply_async(expires=24 * 60 * 60)
+            try:
+                if use_single_pass(indexer.dump, options['single_pass']):
+                    indexer.import_dump_single_pass()
+                else:
+                    indexer.prepare_dump()
+                    indexer.import_dump()
+                    indexer.wrap_dump()
+            except DumpStateError as error:
+                self.stdout.write(self.style.ERROR(f'Job #{job_id} processing failed: {error}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Job #{job_id} imported'))
 
-        self.stdout.write(self.style.SUCCESS(f'Job #{job_id} added to process queue for import ({tasks_num * 2} tasks with up to {group_size} items each)'))
+        if options['timings'] == 'yes' and len(overall_stats.stages) > 0:
+            self.stdout.write(overall_stats.table())
@@ -3,6 +3,7 @@ from django.core.management.base import BaseCommand
 
 from wdf.exceptions import DumpStateError
 from wdf.indexer import Indexer
+from wdf.stage_timer import overall_stats
 from wdf.tasks import prepare_dump
 
 
@@ -13,6 +14,7 @@ class Command(BaseCommand):
         parser.add_argument('job_id', type=str)
         parser.add_argument('--chunk_size', type=int, default=5000, required=False)
         parser.add_argument('--background', choices=['yes', 'no'], default='yes')
+        parser.add_argument('--timings', choices=['yes', 'no'], default='no')
 
     def handle(self, *args, **options):
         console = logging.StreamHandler()
@@ -29,7 +31,11 @@ class Command(BaseCommand):
             self.stdout.write(self.style.SUCCESS(f'Job #{job_id} added to process queue for preparing'))
         else:
             try:
-                indexer = Indexer(get_chunk_size=options['chunk_size'])
-                indexer.prepare_dump(job_id=options['job_id'])
+                indexer = Indexer(job_id=job_id)
+                indexer.set_chunk_size_get(options['chunk_size'])
+                indexer.prepare_dump()
             except DumpStateError as error:
                 self.stdout.write(self.style.ERROR(f'Job #{job_id} processing failed: {error}'))
+
+        if options['timings'] == 'yes' and len(overall_stats.stages) > 0:
+            self.stdout.write(overall_stats.table())
@@ -0,0 +1,54 @@
+import logging
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from wdf.sh_stub import ScrapinghubStub, load_recorded_items
+
+
+class Command(BaseCommand):
+    help = 'Runs local Scrapinghub stand-in serving synthetic or recorded dumps'  # noqa: VNE003
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--jobs', type=int, default=3)
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--tags', type=str, default='stub')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--recorded', type=str, action='append', default=[], help='job_id=path/to/items.msgpack')
+        parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+        parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second, 0 – unlimited')
+        parser.add_argument('--max_rps', type=int, default=0, help='requests per second before 429, 0 – unlimited')
+
+    def handle(self, *args, **options):
+        console = logging.StreamHandler()
+        console.setLevel(logging.INFO)
+        console.setFormatter(logging.Formatter('[%(levelname)s] %(name)s: %(message)s'))
+
+        logger = logging.getLogger('')
+        logger.addHandler(console)
+
+        stub = ScrapinghubStub(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            bandwidth=options['bandwidth'],
+            max_rps=options['max_rps'],
+        )
+
+        tags = [tag for tag in options['tags'].split(',') if tag]
+
+        stub.add_synthetic_jobs(settings.SH_PROJECT_ID, options['jobs'], options['items'], tags=tags, seed=options['seed'])
+
+        for recorded in options['recorded']:
+            job_id, path = recorded.split('=', 1)
+
+            stub.add_job(job_id, load_recorded_items(path), tags=tags)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Serving {len(stub.jobs)} jobs tagged "{options["tags"]}" at {stub.endpoint}, set SH_ENDPOINT={stub.endpoint} to use it'))
+
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
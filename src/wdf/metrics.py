@@ -0,0 +1,165 @@
+"""
+Метрики индексатора в формате Prometheus.
+
+Воркеры Celery либо отправляют метрики в локальный агрегатор (Pushgateway, переменная METRICS_PUSHGATEWAY_URL),
+либо пишут их в общую папку мультипроцессного реестра (переменная prometheus_multiproc_dir), откуда их забирает
+Django-приложение по адресу /api/v1/metrics/
+"""
+import environ
+import logging
+import os
+import socket
+from billiard.process import current_process
+from celery._state import get_current_task
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    pushadd_to_gateway)
+
+env = environ.Env(DEBUG=(bool, False))
+environ.Env.read_env()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STAGE_DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf'))
+
+ITEMS_PROCESSED = Counter(
+    'wdf_indexer_items_processed_total',
+    'Items processed by indexer',
+    ['action'],
+)
+
+ROWS_WRITTEN = Counter(
+    'wdf_indexer_rows_written_total',
+    'Rows written to database',
+    ['model', 'method'],
+)
+
+STAGE_DURATION = Histogram(
+    'wdf_indexer_stage_duration_seconds',
+    'Duration of indexer processing stages',
+    ['stage'],
+    buckets=STAGE_DURATION_BUCKETS,
+)
+
+CACHE_LOOKUPS = Counter(
+    'wdf_indexer_cache_lookups_total',
+    'Dictionary and SKU cache lookups (hit – already known, miss – had to be created)',
+    ['object', 'result'],
+)
+
+COPY_RETRIES = Counter(
+    'wdf_indexer_copy_retries_total',
+    'PG COPY retries caused by problem rows',
+    ['model'],
+)
+
+PIPELINE_QUEUE_DEPTH = Gauge(
+    'wdf_indexer_pipeline_queue_depth',
+    'Chunks waiting in pipeline stage input queue',
+    ['stage'],
+    multiprocess_mode='livesum',
+)
+
+PIPELINE_STALL_SECONDS = Counter(
+    'wdf_indexer_pipeline_stall_seconds_total',
+    'Time pipeline stage threads spent waiting for input (in) or for room in the next queue (out)',
+    ['stage', 'direction'],
+)
+
+KEY_FILTER_LOOKUPS = Counter(
+    'wdf_indexer_key_filter_lookups_total',
+    'Keys certainly absent by Bloom filter and not looked up in DB (skipped), or passed it and not found (false_positive)',
+    ['object', 'result'],
+)
+
+SKU_INDEX_BYTES = Gauge(
+    'wdf_indexer_sku_index_bytes',
+    'Memory used by in-process article to SKU id indexes',
+    multiprocess_mode='livesum',
+)
+
+ITEMS_REJECTED = Counter(
+    'wdf_indexer_items_rejected_total',
+    'Items rejected by normalization and sent to dead-letter table, by field',
+    ['field'],
+)
+
+DUMP_STATE_TRANSITIONS = Counter(
+    'wdf_dump_state_transitions_total',
+    'Dump state transitions',
+    ['state'],
+)
+
+ADMISSION_DELAYS = Counter(
+    'wdf_indexer_admission_delays_total',
+    'Chunks held back by database admission control, by exceeded threshold',
+    ['reason'],
+)
+
+SH_RATE_LIMIT_WAIT = Histogram(
+    'wdf_sh_rate_limit_wait_seconds',
+    'Time spent waiting for Scrapinghub rate limiter tokens',
+    buckets=STAGE_DURATION_BUCKETS,
+)
+
+SH_THROTTLED_RESPONSES = Counter(
+    'wdf_sh_throttled_responses_total',
+    'Scrapinghub responses telling us to slow down',
+    ['status'],
+)
+
+
+def get_registry():
+    """
+    Реестр для отдачи метрик. Если воркеры пишут метрики в мультипроцессном режиме, собираем их из общей папки
+    """
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+        return registry
+
+    return REGISTRY
+
+
+def export_metrics():
+    """
+    Метрики в текстовом формате Prometheus и их content type
+    """
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+def get_metrics_instance():
+    """
+    Имя группы метрик процесса в Pushgateway: узел воркера Celery (или хост) и номер процесса в его пуле. Номера
+    переиспользуются при перезапуске процессов пула, поэтому после перезапусков не остается брошенных групп
+    """
+    task = get_current_task()
+    node = getattr(task.request, 'hostname', None) if task is not None else None
+    index = getattr(current_process(), 'index', None)
+
+    instance = node or socket.gethostname()
+
+    return instance if index is None else f'{instance}:{index}'
+
+
+def push_metrics(job='wdf_indexer'):
+    """
+    Отправка метрик процесса в Pushgateway. Счетчики накапливаются в каждом процессе воркера отдельно, поэтому
+    у каждого процесса своя группа (см. get_metrics_instance). Если агрегатор не настроен, ничего не делаем. Ошибки
+    отправки не должны ронять импорт, поэтому только логируем их
+    """
+    gateway = env('METRICS_PUSHGATEWAY_URL', default='')
+
+    if not gateway:
+        return False
+
+    try:
+        pushadd_to_gateway(gateway, job=job, registry=REGISTRY, grouping_key={'instance': get_metrics_instance()})
+    except OSError as error:
+        logger.warning(f'Metrics push to {gateway} failed: {error}')
+
+        return False
+
+    return True
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.2 on 2026-10-19 13:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wdf', '0013_crawl_info_fields_in_dump_nullable'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dump',
+            name='state',
+            field=models.CharField(blank=True, default='created', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='DumpRange',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('start', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('state_code', models.IntegerField(choices=[(-1, 'Error'), (0, 'Created'), (25, 'Processing'), (30, 'Processed')], default=0)),
+                ('items_imported', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('dump', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranges', to='wdf.dump')),
+            ],
+            options={
+                'db_table': 'wdf_dump_range',
+                'ordering': ['start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dumprange',
+            constraint=models.UniqueConstraint(fields=('dump', 'start'), name='unique_dump_range_start'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.2 on 2026-10-19 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wdf', '0014_added_dump_ranges'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dumprange',
+            name='lease_expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dumprange',
+            name='leased_by',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.2 on 2026-10-19 14:34
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wdf', '0015_added_dump_range_leases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RejectedItem',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('wb_id', models.CharField(blank=True, default='', max_length=64)),
+                ('field', models.CharField(max_length=64)),
+                ('reason', models.TextField()),
+                ('item', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('dump', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rejected_items', to='wdf.dump')),
+            ],
+            options={
+                'db_table': 'wdf_rejected_item',
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
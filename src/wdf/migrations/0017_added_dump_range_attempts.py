@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-19 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wdf', '0016_added_rejected_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dumprange',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-19 16:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wdf', '0017_added_dump_range_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dump',
+            name='partitions',
+            field=models.IntegerField(default=1),
+        ),
+    ]
@@ -1,5 +1,12 @@
 import uuid
-from django.db import connection, models
+from datetime import timedelta
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from wdf.exceptions import DumpRangeLeaseLostError
+from wdf.metrics import DUMP_STATE_TRANSITIONS
 
 
 class Dump(models.Model):
@@ -30,6 +37,9 @@ class Dump(models.Model):
     state = models.CharField(max_length=20, blank=True, default='created')
     state_code = models.IntegerField(choices=State_codes, default=CREATED)
     items_crawled = models.IntegerField(null=True)
+    # на сколько разделов по артикулам разложена копия айтемов (см. DumpSpool): диапазоны такого дампа читаются
+    # только из копии
+    partitions = models.IntegerField(default=1)
     crawl_started_at = models.DateTimeField(null=True)
     crawl_ended_at = models.DateTimeField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -38,6 +48,18 @@ class Dump(models.Model):
         self.state_code = state_code
         self.state = [item[1] for item in self.State_codes if item[0] == state_code][0].lower()
 
+        # переход считается в метриках, только когда он сохранен в БД (см. save)
+        self._unsaved_transition = self.state
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+
+        transition = getattr(self, '_unsaved_transition', None)
+        self._unsaved_transition = None
+
+        if transition is not None:
+            transaction.on_commit(lambda: DUMP_STATE_TRANSITIONS.labels(state=transition).inc())
+
     def prune(self):
         with connection.cursor() as cursor:
             cursor.execute(
@@ -71,6 +93,104 @@ class Dump(models.Model):
     def get_versions_num(self):
         return Version.objects.filter(dump_id=self.id).count()
 
+    def get_rejected_num(self):
+        return self.rejected_items.count()
+
+    def create_ranges(self, group_size, partitions=None):
+        """
+        Очередь диапазонов по group_size айтемов. Если переданы границы разделов копии дампа (см. DumpSpool),
+        на каждый раздел создается один диапазон
+        """
+        if partitions is None:
+            return DumpRange.create_for([self], group_size)[self.pk]
+
+        if not self.ranges.exists():
+            DumpRange.objects.bulk_create([
+                DumpRange(dump=self, start=partition['start'], count=partition['count']) for partition in partitions if partition['count'] > 0])
+
+        return list(self.ranges.order_by('start'))
+
+    def fail_range(self, start, worker=None, max_attempts=None):
+        """
+        Отмечает диапазон упавшим: его заберет следующий воркер. Если диапазон падал уже max_attempts раз, дамп
+        переводится в ERROR – иначе диапазон, на котором падает любой воркер, арендовался бы по кругу.
+        Возвращает True, если дамп переведен в ERROR
+        """
+        ranges = self.ranges.filter(start=start).exclude(state_code=DumpRange.PROCESSED)
+
+        if worker is not None:
+            ranges = ranges.filter(leased_by=worker)
+
+        ranges.update(state_code=DumpRange.ERROR, lease_expires_at=None)
+
+        if max_attempts is not None and self.ranges.filter(start=start, state_code=DumpRange.ERROR, attempts__gte=max_attempts).exists():
+            self.set_state(Dump.ERROR)
+            self.save()
+
+            return True
+
+        return False
+
+    def complete_range(self, start, items_imported=0, worker=None):
+        """
+        Отмечает диапазон импортированным. Возвращает True, если это был последний неимпортированный диапазон дампа –
+        тогда вызывающий должен запустить wrap_dump. Повторное завершение уже импортированного диапазона ничего
+        не возвращает, поэтому wrap_dump запускается ровно один раз.
+
+        Если передан worker, диапазон завершается только при действующей аренде этого воркера, иначе поднимается
+        DumpRangeLeaseLostError, и транзакция импорта откатывается – диапазон уже забрал другой воркер
+        """
+        with transaction.atomic():
+            # блокировка дампа упорядочивает завершение диапазонов: каждый следующий видит, что закоммитили предыдущие
+            self.lock_for_range_completion()
+
+            ranges = self.ranges.filter(start=start).exclude(state_code=DumpRange.PROCESSED)
+
+            if worker is not None:
+                ranges = ranges.filter(leased_by=worker)
+
+            updated = ranges.update(
+                state_code=DumpRange.PROCESSED, items_imported=items_imported, finished_at=timezone.now(), lease_expires_at=None)
+
+            if worker is not None and updated == 0:
+                raise DumpRangeLeaseLostError(f'Lease on range from item {start} was lost by {worker}')
+
+            return updated > 0 and not self.ranges.exclude(state_code=DumpRange.PROCESSED).exists()
+
+    def lock_for_range_completion(self):
+        """
+        Блокировка строки дампа до конца транзакции. На Постгресе – FOR NO KEY UPDATE: в отличие от FOR UPDATE, она
+        не ждет транзакций, которые вставляют версии дампа (внешний ключ держит на его строке FOR KEY SHARE), – ни
+        других диапазонов, ни потоков записи конвейера, которые коммитятся только после завершения диапазона
+        """
+        if connection.vendor != 'postgresql':
+            Dump.objects.select_for_update().filter(pk=self.pk).first()
+
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {Dump._meta.db_table} WHERE id = %s FOR NO KEY UPDATE', [self.pk])
+
+    def get_progress(self):
+        ranges = {code: {'count': 0, 'items': 0} for code, _name in DumpRange.State_codes}
+
+        for row in self.ranges.values('state_code').annotate(count=Count('id'), items=Sum('items_imported')).order_by():
+            ranges[row['state_code']] = {'count': row['count'], 'items': row['items'] or 0}
+
+        ranges_total = sum(row['count'] for row in ranges.values())
+        items_imported = ranges[DumpRange.PROCESSED]['items']
+
+        return {
+            'job': self.job,
+            'state': self.state,
+            'items_crawled': self.items_crawled,
+            'items_imported': items_imported,
+            'items_rejected': self.get_rejected_num(),
+            'ranges_total': ranges_total,
+            **{f'ranges_{name.lower()}': ranges[code]['count'] for code, name in DumpRange.State_codes},
+            'progress': round(items_imported / self.items_crawled, 4) if self.items_crawled else None,
+        }
+
     class Meta:
         db_table = 'wdf_dump'
         ordering = ['created_at']
@@ -79,6 +199,150 @@ class Dump(models.Model):
         return f'Dump #{self.pk}'
 
 
+class DumpRange(models.Model):
+    """
+    Диапазон айтемов дампа, который импортирует одна задача import_dump. По этим записям видно, как продвигается
+    импорт, а завершение последнего диапазона запускает wrap_dump (вместо chord в Celery)
+    """
+    ERROR = -1
+    CREATED = 0
+    PROCESSING = 25
+    PROCESSED = 30
+
+    State_codes = (
+        (ERROR, 'Error'),
+        (CREATED, 'Created'),
+        (PROCESSING, 'Processing'),
+        (PROCESSED, 'Processed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # noqa: VNE003
+    dump = models.ForeignKey('Dump', on_delete=models.CASCADE, related_name='ranges')
+    start = models.IntegerField()
+    count = models.IntegerField()
+    state_code = models.IntegerField(choices=State_codes, default=CREATED)
+    items_imported = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    leased_by = models.CharField(max_length=64, blank=True, default='')
+    lease_expires_at = models.DateTimeField(null=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def claim(dump, worker, lease_seconds, start=None, workers=1, min_split=0, max_attempts=None):
+        """
+        Аренда следующего свободного диапазона дампа: новый, упавший или с истекшей арендой. Диапазоны, которые
+        в этот момент берут другие воркеры, пропускаются (FOR UPDATE SKIP LOCKED), поэтому воркеры не ждут друг друга.
+
+        Каждая аренда – попытка импорта. Если свободный диапазон арендовали уже max_attempts раз (воркеры падали на нем,
+        в том числе вместе с процессом, не успев отметить ошибку), дамп переводится в ERROR, и его диапазоны больше
+        не выдаются.
+
+        Если свободных диапазонов меньше, чем простаивающих воркеров, большой диапазон делится пополам: воркер берет
+        первую половину, а вторая остается в очереди. Так хвост дампа не упирается в один медленный диапазон.
+
+        Возвращает арендованный диапазон или None, если забирать нечего
+        """
+        now = timezone.now()
+
+        with transaction.atomic():
+            if Dump.objects.filter(pk=dump.pk, state_code=Dump.ERROR).exists():
+                return None
+
+            ranges = DumpRange.objects.select_for_update(skip_locked=True).filter(dump=dump).filter(
+                Q(state_code__in=[DumpRange.CREATED, DumpRange.ERROR]) | Q(state_code=DumpRange.PROCESSING, lease_expires_at__lt=now))
+
+            if start is not None:
+                ranges = ranges.filter(start=start)
+
+            if max_attempts is not None and ranges.filter(attempts__gte=max_attempts).exists():
+                dump.set_state(Dump.ERROR)
+                dump.save()
+
+                return None
+
+            dump_range = ranges.order_by('start').first()
+
+            if dump_range is None:
+                return None
+
+            if workers > 1 and min_split > 0 and dump_range.count >= min_split * 2:
+                unstarted = DumpRange.objects.filter(dump=dump, state_code=DumpRange.CREATED).count()
+                leased = DumpRange.objects.filter(dump=dump, state_code=DumpRange.PROCESSING, lease_expires_at__gte=now).count()
+
+                if unstarted < workers - leased:
+                    half = dump_range.count // 2
+
+                    DumpRange.objects.create(dump=dump, start=dump_range.start + half, count=dump_range.count - half)
+
+                    dump_range.count = half
+
+            dump_range.state_code = DumpRange.PROCESSING
+            dump_range.attempts += 1
+            dump_range.leased_by = worker
+            dump_range.lease_expires_at = now + timedelta(seconds=lease_seconds)
+            dump_range.started_at = now
+            dump_range.save()
+
+            return dump_range
+
+    @staticmethod
+    def create_for(dumps, group_size):
+        """
+        Диапазоны для нескольких дампов за два запроса. Если у дампа диапазоны уже есть (повторный запуск импорта),
+        они не пересоздаются. Возвращает словарь {id дампа: список диапазонов}
+        """
+        ranges = {dump.pk: [] for dump in dumps}
+
+        for dump_range in DumpRange.objects.filter(dump__in=dumps):
+            ranges[dump_range.dump_id].append(dump_range)
+
+        new_ranges = []
+
+        for dump in dumps:
+            if len(ranges[dump.pk]) == 0:
+                ranges[dump.pk] = [
+                    DumpRange(dump=dump, start=start, count=group_size) for start in range(0, dump.items_crawled, group_size)]
+
+                new_ranges += ranges[dump.pk]
+
+        DumpRange.objects.bulk_create(new_ranges)
+
+        return {dump_id: sorted(dump_ranges, key=lambda x: x.start) for dump_id, dump_ranges in ranges.items()}
+
+    class Meta:
+        db_table = 'wdf_dump_range'
+        ordering = ['start']
+
+        constraints = [
+            models.UniqueConstraint(fields=['dump', 'start'], name='unique_dump_range_start'),
+        ]
+
+    def __str__(self):
+        return f'Dump range #{self.pk}'
+
+
+class RejectedItem(models.Model):
+    """
+    Айтем дампа, который не прошел нормализацию (см. wdf.normalization) и не был импортирован
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # noqa: VNE003
+    dump = models.ForeignKey('Dump', on_delete=models.CASCADE, related_name='rejected_items')
+    wb_id = models.CharField(max_length=64, blank=True, default='')
+    field = models.CharField(max_length=64)
+    reason = models.TextField()
+    item = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'wdf_rejected_item'
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f'Rejected item #{self.pk}'
+
+
 class Version(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)  # noqa: VNE003
     dump = models.ForeignKey('Dump', on_delete=models.CASCADE, null=True)
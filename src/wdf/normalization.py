@@ -0,0 +1,152 @@
+"""
+Проверка и приведение полей айтема до сбора словарей и сохранения.
+
+Все поля айтема проверяются за один проход по заранее собранной таблице правил FIELD_RULES. Айтем, который
+нельзя сохранить (нет названия, цена не число, артикул не находится в ссылке и т.п.), не доходит до COPY,
+а попадает в таблицу отказов RejectedItem с причиной. Остальные айтемы после нормализации содержат значения
+нужных типов: цены и рейтинги – float, счетчики и позиции – int, параметры – строки
+"""
+import re
+
+from wdf.models import Sku
+from wdf.timestamps import parse_timestamp
+
+ARTICLE_RE = re.compile(r'\/catalog\/(\d{1,20})\/detail\.aspx')
+NUMBER_SPACES_RE = re.compile(r'[\s ]')
+PRODUCT_URL_MAX_LENGTH = Sku._meta.get_field('url').max_length
+
+
+class ItemRejectedError(ValueError):
+    """Raised when item can't be imported, field and reason are stored in dead-letter table"""
+
+    def __init__(self, field, reason):
+        super().__init__(f'{field}: {reason}')
+
+        self.field = field
+        self.reason = reason
+
+
+def to_text(value):
+    if value is None:
+        raise ValueError('empty value')
+
+    value = str(value)
+
+    if value.strip() == '':
+        raise ValueError('empty value')
+
+    return value
+
+
+def to_product_url(value):
+    value = to_text(value)
+
+    # иначе айтем упадет уже при сохранении SKU, вместе со всем чанком
+    if len(value) > PRODUCT_URL_MAX_LENGTH:
+        raise ValueError(f'longer than {PRODUCT_URL_MAX_LENGTH} characters')
+
+    return value
+
+
+def to_optional_text(value):
+    # ссылки на каталог и бренд бывают null, так они и сохраняются
+    return None if value is None else str(value)
+
+
+def to_float(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+
+    # цены бывают с пробелами между разрядами и десятичной запятой: 1 299,00
+    return float(NUMBER_SPACES_RE.sub('', str(value)).replace(',', '.'))
+
+
+def to_optional_float(value):
+    if value is None or value == '':
+        return None
+
+    return to_float(value)
+
+
+def to_count(value):
+    """
+    Неотрицательный счетчик, пустое значение – ноль
+    """
+    if value is None or value == '':
+        return 0
+
+    count = int(to_float(value))
+
+    if count < 0:
+        raise ValueError(f'negative count {count}')
+
+    return count
+
+
+def to_optional_count(value):
+    if value is None or value == '':
+        return None
+
+    return to_count(value)
+
+
+def to_timestamp(value):
+    # проверяем, что дата разбирается, но оставляем строку: она же пишется в словарь SKU
+    value = to_text(value)
+
+    parse_timestamp(value)
+
+    return value
+
+
+def to_features(value):
+    if not isinstance(value, list) or len(value) == 0 or not isinstance(value[0], dict):
+        raise ValueError('features should be a list with a dict of parameters')
+
+    return [{to_text(name): '' if feature_value is None else str(feature_value) for name, feature_value in value[0].items()}]
+
+
+# Правила по полям: имя поля, обязательно ли оно, функция приведения значения
+FIELD_RULES = (
+    ('wb_id', True, to_text),
+    ('product_name', True, to_text),
+    ('product_url', True, to_product_url),
+    ('parse_date', True, to_timestamp),
+    ('wb_price', False, to_float),
+    ('wb_rating', False, to_optional_float),
+    ('wb_purchases_count', False, to_count),
+    ('wb_reviews_count', False, to_count),
+    ('wb_category_position', False, to_optional_count),
+    ('wb_category_url', False, to_optional_text),
+    ('wb_brand_url', False, to_optional_text),
+    ('features', False, to_features),
+)
+
+
+def normalize_item(item):
+    """
+    Копия айтема с приведенными значениями. Поднимает ItemRejectedError, если айтем сохранить нельзя
+    """
+    normalized = dict(item)
+
+    for field, required, coerce in FIELD_RULES:
+        if field not in item:
+            if required:
+                raise ItemRejectedError(field, 'missing')
+
+            continue
+
+        try:
+            normalized[field] = coerce(item[field])
+        except (ValueError, TypeError, OverflowError) as e:
+            raise ItemRejectedError(field, f'invalid value {item[field]!r}: {e}')
+
+    # позиция сохраняется в каталоге, поэтому без ссылки на каталог ее не сохранить
+    if 'wb_category_position' in normalized and normalized.get('wb_category_url') is None:
+        raise ItemRejectedError('wb_category_url', 'position without category url')
+
+    # артикул из длинного wb_id ищется в ссылке (см. guess_wb_article)
+    if len(normalized['wb_id']) > 20 and ARTICLE_RE.search(normalized['product_url']) is None:
+        raise ItemRejectedError('product_url', 'no article in product url')
+
+    return normalized
@@ -0,0 +1,360 @@
+"""
+Конвейер обработки чанков в несколько потоков.
+
+Чанки проходят этапы друг за другом, между этапами – очереди ограниченного размера: если следующий этап не успевает,
+предыдущий ждет (и не держит в памяти лишние чанки). У каждого этапа свое количество потоков, у потока – свое
+соединение с БД. Для каждого этапа считается, сколько он работал, сколько ждал входных чанков (простаивал из-за
+предыдущих этапов) и сколько ждал места в очереди дальше (его тормозят следующие этапы), – по этим цифрам в логе видно,
+где упирается импорт дампа.
+
+Последний этап можно выполнять в вызывающем потоке (threads=0): тогда он работает в его транзакции. Если у этапа
+свои потоки, их транзакции могут коммититься не сразу, а вместе с транзакцией вызывающего потока (deferred_commit=True,
+см. DeferredCommit)
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from django.db import connection, connections, transaction
+
+from wdf.metrics import PIPELINE_QUEUE_DEPTH, PIPELINE_STALL_SECONDS
+
+logger = logging.getLogger('wdf.indexer')
+logger.setLevel(logging.INFO)
+
+# Конец потока чанков: каждый поток этапа, получив его, завершается
+END = object()
+
+# Как часто ожидающие потоки проверяют, не остановлен ли конвейер из-за ошибки, в секундах
+POLL_INTERVAL = 0.1
+
+
+class PipelineAbortedError(Exception):
+    """Raised in pipeline threads when another stage failed and the pipeline is stopping"""
+    pass
+
+
+class PipelineStage(object):
+    """
+    Этап конвейера: func(work) обрабатывает чанк и возвращает то, что уходит следующему этапу. context – фабрика
+    контекста, в котором работает каждый поток этапа (например, транзакция)
+    """
+
+    def __init__(self, name, func, threads=1, context=None, deferred_commit=False):
+        self.name = name
+        self.func = func
+        self.threads = threads
+        self.context = context or nullcontext
+        self.deferred_commit = DeferredCommit(threads) if deferred_commit and threads > 0 else None
+
+        if self.deferred_commit is not None:
+            self.context = self.deferred_commit.transaction
+
+        self.processed = 0
+        self.busy = 0.0
+        self.stall_in = 0.0
+        self.stall_out = 0.0
+
+        self.input = None
+        self._lock = threading.Lock()
+
+    def account(self, busy=0.0, stall_in=0.0, stall_out=0.0, processed=0):
+        with self._lock:
+            self.busy += busy
+            self.stall_in += stall_in
+            self.stall_out += stall_out
+            self.processed += processed
+
+    def stats(self):
+        return {
+            'threads': self.threads,
+            'queue': self.input.qsize() if self.input is not None else 0,
+            'processed': self.processed,
+            'busy': round(self.busy, 3),
+            'stall_in': round(self.stall_in, 3),
+            'stall_out': round(self.stall_out, 3),
+        }
+
+
+class Pipeline(object):
+    """
+    Источник чанков (итератор, читается в отдельном потоке) и этапы, связанные очередями по queue_size элементов
+    """
+
+    def __init__(self, source, stages, queue_size=2, log_prefix=''):
+        if any(stage.threads < 1 for stage in stages[:-1]):
+            raise ValueError('Only the last pipeline stage can run in the calling thread')
+
+        self.source = PipelineStage('fetch', None)
+        self.source_iterable = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.log_prefix = log_prefix
+
+        self.aborted = threading.Event()
+        self.errors = []
+
+        for stage in self.stages:
+            stage.input = queue.Queue(maxsize=queue_size)
+
+        self._finished_threads = {stage.name: 0 for stage in self.stages}
+        self._lock = threading.Lock()
+
+    def run(self, before_commit=None):
+        """
+        Прогон всех чанков. before_commit вызывается в вызывающем потоке, когда все чанки обработаны, но транзакции
+        этапов с deferred_commit еще не закоммичены: если он упадет, они откатятся
+        """
+        threads = [threading.Thread(target=self.run_source, name='pipeline-fetch', daemon=True)]
+
+        for stage_no, stage in enumerate(self.stages):
+            for thread_no in range(stage.threads):
+                threads.append(threading.Thread(
+                    target=self.run_stage, args=(stage_no,), name=f'pipeline-{stage.name}-{thread_no}', daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        if self.stages[-1].threads == 0:
+            self.run_stage(len(self.stages) - 1, inline=True)
+
+        self.commit(before_commit)
+
+        for thread in threads:
+            thread.join()
+
+        self.log_stats('Pipeline finished')
+
+        if len(self.errors) > 0:
+            raise self.errors[0]
+
+        return self
+
+    def commit(self, before_commit=None):
+        """
+        Ждет, пока потоки этапов с deferred_commit закончат работу, и коммитит их транзакции, если конвейер не остановлен
+        ошибкой и before_commit прошел успешно, иначе откатывает
+        """
+        deferred = [stage.deferred_commit for stage in self.stages if stage.deferred_commit is not None]
+        commit = False
+
+        try:
+            for deferred_commit in deferred:
+                deferred_commit.wait_ready()
+
+            if not self.aborted.is_set() and not any(deferred_commit.failed for deferred_commit in deferred):
+                if before_commit is not None:
+                    before_commit()
+
+                commit = True
+        except BaseException as e:  # noqa: B902, PIE786
+            self.abort(e)
+        finally:
+            for deferred_commit in deferred:
+                deferred_commit.release(commit)
+
+    def run_source(self):
+        stage = self.source
+        iterator = iter(self.source_iterable)
+
+        try:
+            while not self.aborted.is_set():
+                start_time = time.time()
+
+                try:
+                    work = next(iterator)
+                except StopIteration:
+                    break
+
+                stage.account(busy=time.time() - start_time, processed=1)
+
+                self.put(stage, self.stages[0], work)
+
+            self.finish(stage, 0)
+        except PipelineAbortedError:
+            pass
+        except BaseException as e:  # noqa: B902, PIE786
+            self.abort(e)
+        finally:
+            connections.close_all()
+
+    def run_stage(self, stage_no, inline=False):
+        stage = self.stages[stage_no]
+        next_stage = self.stages[stage_no + 1] if stage_no + 1 < len(self.stages) else None
+
+        try:
+            with stage.context():
+                while True:
+                    work = self.get(stage)
+
+                    if work is END:
+                        break
+
+                    start_time = time.time()
+                    result = stage.func(work)
+                    stage.account(busy=time.time() - start_time, processed=1)
+
+                    if next_stage is not None:
+                        self.put(stage, next_stage, result)
+
+                # контекст потока (например, его транзакция) закрывается, только если конвейер не остановлен
+                if self.aborted.is_set():
+                    raise PipelineAbortedError()
+
+            self.finish(stage, stage_no + 1)
+        except PipelineAbortedError:
+            pass
+        except BaseException as e:  # noqa: B902, PIE786
+            self.abort(e)
+        finally:
+            if not inline:
+                connections.close_all()
+
+    def get(self, stage):
+        start_time = time.time()
+
+        try:
+            while True:
+                if self.aborted.is_set():
+                    raise PipelineAbortedError()
+
+                try:
+                    return stage.input.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+        finally:
+            waited = time.time() - start_time
+
+            stage.account(stall_in=waited)
+
+            PIPELINE_STALL_SECONDS.labels(stage=stage.name, direction='in').inc(waited)
+
+    def put(self, stage, next_stage, work):
+        start_time = time.time()
+
+        try:
+            while True:
+                if self.aborted.is_set():
+                    raise PipelineAbortedError()
+
+                try:
+                    return next_stage.input.put(work, timeout=POLL_INTERVAL)
+                except queue.Full:
+                    continue
+        finally:
+            waited = time.time() - start_time
+
+            stage.account(stall_out=waited)
+
+            PIPELINE_STALL_SECONDS.labels(stage=stage.name, direction='out').inc(waited)
+            PIPELINE_QUEUE_DEPTH.labels(stage=next_stage.name).set(next_stage.input.qsize())
+
+    def finish(self, stage, next_stage_no):
+        """
+        Последний завершившийся поток этапа передает конец потока каждому потоку следующего этапа
+        """
+        with self._lock:
+            if stage is not self.source:
+                self._finished_threads[stage.name] += 1
+
+                if self._finished_threads[stage.name] < max(1, stage.threads):
+                    return
+
+        if next_stage_no < len(self.stages):
+            next_stage = self.stages[next_stage_no]
+
+            for _ in range(max(1, next_stage.threads)):
+                self.put(stage, next_stage, END)
+
+    def abort(self, error):
+        with self._lock:
+            self.errors.append(error)
+
+        self.aborted.set()
+
+        logger.error(f'{self.log_prefix}Pipeline stopped: {error!r}')
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in [self.source, *self.stages]}
+
+    def log_stats(self, message='Pipeline'):
+        stats = self.stats()
+
+        logger.info(f'{self.log_prefix}{message}: {json.dumps(stats)}', extra={'pipeline_stats': stats})
+
+        return stats
+
+
+class DeferredCommit(object):
+    """
+    Транзакции потоков этапа, которые коммитятся не по окончании работы потока, а по решению вызывающего потока
+    (см. Pipeline.commit). Поток, дописав свою часть чанков, держит транзакцию открытой, пока не получит решение
+    """
+
+    def __init__(self, threads):
+        self.threads = threads
+        self.failed = False
+
+        self._ready = threading.Semaphore(0)
+        self._released = threading.Event()
+        self._commit = False
+
+    @contextmanager
+    def transaction(self):
+        with transaction.atomic():
+            try:
+                yield
+
+                # внешние ключи Постгрес проверяет при коммите: нарушение должно всплыть до решения о коммите, а не
+                # после того, как транзакции других потоков уже закоммичены
+                connection.check_constraints()
+            except BaseException:  # noqa: B902, PIE786
+                self.failed = True
+
+                raise
+            finally:
+                # поток, упавший с ошибкой, тоже отчитывается: иначе вызывающий поток ждал бы его вечно
+                self._ready.release()
+
+            self._released.wait()
+
+            if not self._commit:
+                transaction.set_rollback(True)
+
+    def wait_ready(self):
+        for _ in range(self.threads):
+            self._ready.acquire()
+
+    def release(self, commit):
+        self._commit = commit
+        self._released.set()
+
+
+class ChunkWork(object):
+    """
+    Чанк в конвейере индексатора: копия индексатора для этого чанка (см. Indexer.fork) и результат последнего этапа
+    """
+
+    def __init__(self, indexer, chunk, chunk_no):
+        self.indexer = indexer
+        self.chunk = chunk
+        self.chunk_no = chunk_no
+        self.rows = chunk
+        self.start_time = time.time()
+
+
+class RowsBuffer(object):
+    """
+    Замена BulkCreateManager на этапе сборки строк: объекты копятся и записываются уже на этапе записи
+    """
+
+    def __init__(self):
+        self.objects = []
+
+    def add(self, obj):
+        self.objects.append(obj)
+
+    def done(self, log_prefix=''):
+        pass
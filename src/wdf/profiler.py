@@ -0,0 +1,63 @@
+import cProfile
+import environ
+import logging
+import os
+import tracemalloc
+from contextlib import contextmanager
+
+env = environ.Env(DEBUG=(bool, False))
+environ.Env.read_env()
+
+logger = logging.getLogger('wdf.indexer')
+logger.setLevel(logging.INFO)
+
+
+class ChunkProfiler(object):
+    """
+    Профилирование первых N чанков выгрузки через cProfile и tracemalloc. Для каждого чанка в папку directory
+    пишутся два файла с идентификатором задачи, этапом (prepare или import – один профайлер может сначала
+    подготовить дамп, а потом импортировать его), началом диапазона и номером чанка в имени:
+
+    * <tag>.pstats – статистика cProfile, открывается через pstats или snakeviz
+    * <tag>.alloc.txt – топ мест в коде по выделенной памяти из снимка tracemalloc
+    """
+
+    def __init__(self, job_id, chunks, directory=None, start=0, top_allocations=50):
+        self.job_id = job_id
+        self.chunks = chunks
+        self.directory = directory or env('INDEXER_PROFILE_DIR', default='/tmp/wdf-profiles')
+        self.start = start
+        self.top_allocations = top_allocations
+
+    def wants(self, chunk_no):
+        return chunk_no <= self.chunks
+
+    def get_path(self, chunk_no, extension, phase='import'):
+        job_tag = self.job_id.replace('/', '-')
+
+        return os.path.join(self.directory, f'{job_tag}_{phase}_from{self.start}_chunk{chunk_no}.{extension}')
+
+    @contextmanager
+    def profile(self, chunk_no, phase='import'):
+        os.makedirs(self.directory, exist_ok=True)
+
+        profile = cProfile.Profile()
+
+        tracemalloc.start()
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+            profile.dump_stats(self.get_path(chunk_no, 'pstats', phase))
+
+            with open(self.get_path(chunk_no, 'alloc.txt', phase), 'w') as f:
+                for stat in snapshot.statistics('lineno')[:self.top_allocations]:
+                    f.write(f'{stat}\n')
+
+            logger.info(f'Job {self.job_id}, chunk #{chunk_no}: {phase} profile saved to {self.get_path(chunk_no, "pstats", phase)}')
@@ -0,0 +1,272 @@
+"""
+Общий для всех воркеров лимит запросов к Scrapinghub.
+
+Запросы ограничиваются корзиной токенов: в секунду добавляется rate токенов, но не больше burst, каждый запрос
+забирает один. Корзина хранится в Redis, поэтому лимит общий для всех процессов. Если Scrapinghub все равно отвечает
+429/503, скорость пополнения корзины для всех уменьшается вдвое (и выдерживается пауза из Retry-After), а после
+успешных ответов постепенно возвращается к rate.
+
+Если REDIS_URL не задан, корзина хранится в памяти процесса. Если Redis настроен, но не отвечает, процесс тоже
+переходит на свою корзину с тем же rate (общий лимит на это время умножается на число процессов) и возвращается
+к общей, как только Redis снова доступен.
+
+Лимит подключается к клиенту в wdf.sh_client и действует на все запросы индексатора и команд импорта.
+Настройки: SH_RATE_LIMIT (запросов в секунду, 0 – без лимита) и SH_RATE_BURST
+"""
+import environ
+import logging
+import redis
+import threading
+import time
+from functools import partial
+from requests.adapters import HTTPAdapter
+
+from wdf.metrics import SH_RATE_LIMIT_WAIT, SH_THROTTLED_RESPONSES
+
+env = environ.Env(DEBUG=(bool, False))
+environ.Env.read_env()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+THROTTLING_STATUS_CODES = (429, 503)
+
+# Все скрипты работают со временем сервера Redis, чтобы не зависеть от расхождения часов на воркерах
+ACQUIRE_SCRIPT = """
+redis.replicate_commands()
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate, burst, ttl = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at', 'factor', 'blocked_until')
+local factor = tonumber(state[3]) or 1
+local blocked_until = tonumber(state[4]) or 0
+
+if blocked_until > now then
+    return {tostring(blocked_until - now), tostring(factor)}
+end
+
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+local wait = 0
+
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate * factor)
+
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / (rate * factor)
+end
+
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], ttl)
+
+return {tostring(wait), tostring(factor)}
+"""
+
+THROTTLED_SCRIPT = """
+redis.replicate_commands()
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local min_factor, pause, ttl = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'factor', 'blocked_until')
+local factor = math.max(min_factor, (tonumber(state[1]) or 1) / 2)
+local blocked_until = math.max(tonumber(state[2]) or 0, now + pause)
+
+redis.call('HMSET', KEYS[1], 'factor', factor, 'blocked_until', blocked_until)
+redis.call('EXPIRE', KEYS[1], ttl)
+
+return tostring(factor)
+"""
+
+RECOVERED_SCRIPT = """
+local factor = math.min(1, (tonumber(redis.call('HGET', KEYS[1], 'factor')) or 1) + tonumber(ARGV[1]))
+
+redis.call('HSET', KEYS[1], 'factor', factor)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+
+return tostring(factor)
+"""
+
+
+class TokenBucket(object):
+    """
+    Корзина токенов в памяти процесса. Используется, если Redis не настроен или не отвечает, и в тестах. factor –
+    текущая доля rate с учетом ответов о превышении лимита
+    """
+
+    def __init__(self, rate, burst=None, min_factor=0.05, recovery_step=0.05, clock=time.time, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.min_factor = min_factor
+        self.recovery_step = recovery_step
+        self.clock = clock
+        self.sleep = sleep
+
+        self.tokens = self.burst
+        self.updated_at = clock()
+        self.factor = 1.0
+        self.blocked_until = 0.0
+
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Забирает токен, если он есть. Возвращает (сколько ждать до следующей попытки, текущая доля скорости)
+        """
+        with self._lock:
+            now = self.clock()
+
+            if self.blocked_until > now:
+                return self.blocked_until - now, self.factor
+
+            self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated_at) * self.rate * self.factor)
+            self.updated_at = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+
+                return 0.0, self.factor
+
+            return (1 - self.tokens) / (self.rate * self.factor), self.factor
+
+    def throttled(self, pause=0.0):
+        with self._lock:
+            self.factor = max(self.min_factor, self.factor / 2)
+            self.blocked_until = max(self.blocked_until, self.clock() + pause)
+
+            return self.factor
+
+    def recovered(self):
+        with self._lock:
+            self.factor = min(1.0, self.factor + self.recovery_step)
+
+            return self.factor
+
+    def acquire(self):
+        """
+        Ждет токен. Возвращает (время ожидания в секундах, текущая доля скорости)
+        """
+        waited = 0.0
+
+        while True:
+            wait, factor = self.try_acquire()
+
+            if wait <= 0:
+                if waited > 0:
+                    SH_RATE_LIMIT_WAIT.observe(waited)
+
+                return waited, factor
+
+            self.sleep(wait)
+            waited += wait
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    Корзина токенов в Redis, общая для всех процессов с одинаковым key. Пока Redis не отвечает, работает как
+    TokenBucket в памяти процесса
+    """
+
+    def __init__(self, redis_client, rate, burst=None, key='wdf:sh_rate_limit', ttl=3600, **kwargs):
+        super().__init__(rate, burst=burst, **kwargs)
+
+        self.key = key
+        self.ttl = ttl
+        self.redis_available = True
+
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._throttled = redis_client.register_script(THROTTLED_SCRIPT)
+        self._recovered = redis_client.register_script(RECOVERED_SCRIPT)
+
+    def call_script(self, script, args, fallback):
+        try:
+            result = script(keys=[self.key], args=args)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            if self.redis_available:
+                logger.warning(f'Redis is unavailable ({e}), Scrapinghub rate limit is kept in process memory')
+
+            self.redis_available = False
+
+            return fallback()
+
+        if not self.redis_available:
+            logger.info('Redis is available again, Scrapinghub rate limit is shared')
+
+        self.redis_available = True
+
+        return result
+
+    def try_acquire(self):
+        result = self.call_script(self._acquire, [self.rate, self.burst, self.ttl], super().try_acquire)
+
+        return float(result[0]), float(result[1])
+
+    def throttled(self, pause=0.0):
+        return float(self.call_script(self._throttled, [self.min_factor, pause, self.ttl], partial(super().throttled, pause)))
+
+    def recovered(self):
+        return float(self.call_script(self._recovered, [self.recovery_step, self.ttl], super().recovered))
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Транспорт requests, который перед каждым запросом берет токен из корзины и сообщает ей об ответах 429/503
+    """
+
+    def __init__(self, bucket, *args, **kwargs):
+        self.bucket = bucket
+
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        waited, factor = self.bucket.acquire()
+
+        response = super().send(request, *args, **kwargs)
+
+        if response.status_code in THROTTLING_STATUS_CODES:
+            pause = get_retry_after(response)
+            factor = self.bucket.throttled(pause)
+
+            SH_THROTTLED_RESPONSES.labels(status=response.status_code).inc()
+
+            logger.warning(f'Scrapinghub throttled request to {request.url} ({response.status_code}), rate lowered to {round(factor * self.bucket.rate, 2)} rps')
+        elif factor < 1:
+            self.bucket.recovered()
+
+        return response
+
+
+def get_retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After', 0))
+    except ValueError:
+        return 0.0
+
+
+def get_rate_limiter():
+    """
+    Корзина по настройкам из окружения: общая в Redis, а если он не настроен – в памяти процесса. None, если лимит
+    не задан
+    """
+    rate = env('SH_RATE_LIMIT', cast=float, default=0)
+
+    if rate <= 0:
+        return None
+
+    burst = env('SH_RATE_BURST', cast=float, default=rate)
+    redis_url = env('REDIS_URL', default='')
+
+    if redis_url == '':
+        return TokenBucket(rate, burst=burst)
+
+    return RedisTokenBucket(redis.Redis.from_url(redis_url), rate, burst=burst)
+
+
+def install_rate_limiter(sh_client, bucket):
+    # ScrapinghubClient не дает настроить транспорт, поэтому подменяем его в сессии внутреннего клиента storage API
+    adapter = RateLimitedAdapter(bucket)
+
+    sh_client._hsclient.session.mount('http://', adapter)
+    sh_client._hsclient.session.mount('https://', adapter)
+
+    return sh_client
@@ -0,0 +1,57 @@
+"""
+Записи словарей, собранные из айтемов чанка (Indexer.*_retrieved).
+
+Раньше на каждый ключ собирался отдельный словарь, в котором повторялись одни и те же строковые ключи ('marketplace',
+'parse_date' и т.п.) и ссылка на маркетплейс. Записи с __slots__ хранят только значения: без словаря атрибутов
+объект занимает в несколько раз меньше памяти, а маркетплейс у всех записей индексатора один и берется при вставке.
+Параметрам достаточно имени, которое и так служит ключом, поэтому для них запись не создается
+"""
+
+
+class Record(object):
+    """
+    Сравнение и вывод записей по значениям полей
+    """
+    __slots__ = ()
+
+    def values(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)
+
+        return f'{type(self).__name__}({fields})'
+
+
+class CatalogRecord(Record):
+    __slots__ = ('name', 'url')
+
+    # каталоги пока собираются только первого уровня и без родителя
+    parent = ''
+    level = 1
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+
+
+class BrandRecord(Record):
+    __slots__ = ('name', 'url')
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+
+
+class SkuRecord(Record):
+    __slots__ = ('parse_date', 'brand', 'article', 'url', 'title')
+
+    def __init__(self, parse_date, brand, article, url, title):
+        self.parse_date = parse_date
+        self.brand = brand
+        self.article = article
+        self.url = url
+        self.title = title
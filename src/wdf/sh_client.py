@@ -0,0 +1,19 @@
+from django.conf import settings
+from scrapinghub import ScrapinghubClient
+
+from wdf.rate_limiter import get_rate_limiter, install_rate_limiter
+
+
+def get_sh_client():
+    """
+    Клиент Scrapinghub для индексатора и команд импорта. Если задан SH_ENDPOINT, клиент ходит не в боевой storage,
+    а по указанному адресу (например, в локальную заглушку из wdf.sh_stub). Если задан SH_RATE_LIMIT, запросы
+    клиента проходят через общий лимит (см. wdf.rate_limiter)
+    """
+    client = ScrapinghubClient(settings.SH_APIKEY, endpoint=settings.SH_ENDPOINT or None)
+    rate_limiter = get_rate_limiter()
+
+    if rate_limiter is not None:
+        install_rate_limiter(client, rate_limiter)
+
+    return client
@@ -0,0 +1,260 @@
+import json
+import logging
+import msgpack
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from wdf.synthetic import generate_items
+
+logger = logging.getLogger(__name__)
+
+# Время запуска и окончания задачи для заглушки не важны, но индексатор без них не создаст дамп
+DEFAULT_RUNNING_TIME = 1597854066275
+DEFAULT_FINISHED_TIME = 1597854164856
+
+
+def load_recorded_items(path):
+    """
+    Айтемы из записанной выгрузки Scrapinghub в формате msgpack (как tests/mocks/scrapinghub_items_wb_raw.msgpack)
+    """
+    with open(path, 'rb') as f:
+        return list(msgpack.Unpacker(f, raw=False))
+
+
+class ScrapinghubStub(object):
+    """
+    Локальная замена Scrapinghub для тестов и бенчмарков. Поднимает HTTP-сервер, который отвечает как storage API:
+
+    * GET /items/<job>?start=<job>/<offset>&count=<n> – айтемы задачи в msgpack (или JSON lines без Accept: msgpack)
+    * GET /jobs/<job>/<key> и GET /jobs/<job> – метаданные задачи (running_time, finished_time, scrapystats и т.п.)
+    * GET /jobq/<project>/list – список задач с фильтрами state, has_tag, count и start
+
+    Поведение сети настраивается:
+
+    * latency – задержка перед каждым ответом, в секундах
+    * bandwidth – ограничение скорости отдачи тела ответа, в байтах в секунду (0 – без ограничения)
+    * max_rps – сколько запросов в секунду сервер обслуживает, остальные получают 429 Too Many Requests
+
+    Клиент направляется в заглушку через настройку SH_ENDPOINT (см. wdf.sh_client)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, bandwidth=0, max_rps=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_rps = max_rps
+
+        self.jobs = {}
+        self.requests_served = 0
+        self.requests_throttled = 0
+
+        self._recent_requests = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.server = ThreadingHTTPServer((host, port), ScrapinghubStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+
+        return f'http://{host}:{port}/'
+
+    def add_job(self, job_id, items, state='finished', tags=(), running_time=DEFAULT_RUNNING_TIME, finished_time=DEFAULT_FINISHED_TIME):
+        self.jobs[job_id] = {
+            'items': items,
+            'state': state,
+            'tags': list(tags),
+            'metadata': {
+                'running_time': running_time,
+                'finished_time': finished_time,
+                'scrapystats': {'item_scraped_count': len(items)},
+                'state': state,
+                'tags': list(tags),
+            },
+        }
+
+        return self
+
+    def add_synthetic_jobs(self, project_id, jobs, items, tags=(), seed=0, spider_id=1):
+        """
+        Задачи со сгенерированными айтемами (см. wdf.synthetic). Артикулы в разных задачах пересекаются, как
+        в реальных выгрузках одного и того же каталога. Возвращает идентификаторы добавленных задач
+        """
+        job_ids = []
+
+        for job_no in range(1, jobs + 1):
+            job_id = f'{project_id}/{spider_id}/{job_no}'
+
+            self.add_job(job_id, list(generate_items(items, seed=seed + job_no)), tags=tags)
+
+            job_ids.append(job_id)
+
+        return job_ids
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def admit(self):
+        """
+        Учет запроса в окне последней секунды. False – лимит max_rps исчерпан и запрос надо отклонить
+        """
+        with self._lock:
+            now = time.time()
+
+            while len(self._recent_requests) > 0 and self._recent_requests[0] <= now - 1:
+                self._recent_requests.popleft()
+
+            if self.max_rps and len(self._recent_requests) >= self.max_rps:
+                self.requests_throttled += 1
+
+                return False
+
+            self._recent_requests.append(now)
+            self.requests_served += 1
+
+            return True
+
+    def get_items(self, job_id, start=None, count=None, with_key=False):
+        job = self.jobs.get(job_id)
+
+        if job is None:
+            return []
+
+        offset = 0
+
+        # start приходит в виде ключа айтема: <job>/<номер айтема>
+        if start:
+            offset = int(start.rsplit('/', 1)[-1])
+
+        end = len(job['items']) if count is None else min(len(job['items']), offset + int(count))
+
+        for item_no in range(offset, end):
+            item = job['items'][item_no]
+
+            yield {**item, '_key': f'{job_id}/{item_no}'} if with_key else item
+
+    def list_jobs(self, state=None, has_tag=None, count=None, start=None):
+        # как и настоящий jobq, отдаем сначала самые свежие задачи
+        jobs = sorted(self.jobs.items(), key=lambda job: int(job[0].rsplit('/', 1)[-1]), reverse=True)
+
+        jobs = [
+            {'key': job_id, 'state': job['state'], 'tags': job['tags'], 'items': len(job['items'])}
+            for job_id, job in jobs
+            if (not state or job['state'] in state) and (not has_tag or set(has_tag) & set(job['tags']))
+        ]
+
+        jobs = jobs[int(start or 0):]
+
+        return jobs if count is None else jobs[:int(count)]
+
+
+class ScrapinghubStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    chunk_size = 64 * 1024
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def do_GET(self):  # noqa: N802
+        if not self.stub.admit():
+            return self.respond(429, b'Too Many Requests', 'text/plain', headers={'Retry-After': '1'})
+
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+
+        url = urlparse(self.path)
+        path = url.path.strip('/').split('/')
+        params = parse_qs(url.query)
+
+        if path[0] == 'items' and len(path) == 4:
+            return self.respond_items('/'.join(path[1:]), params)
+
+        if path[0] == 'jobs' and len(path) in (4, 5):
+            return self.respond_metadata('/'.join(path[1:4]), path[4] if len(path) == 5 else None)
+
+        if path[0] == 'jobq' and len(path) == 3 and path[2] == 'list':
+            return self.respond_job_list(params)
+
+        return self.respond(404, b'Not Found', 'text/plain')
+
+    def respond_items(self, job_id, params):
+        items = self.stub.get_items(
+            job_id,
+            start=params.get('start', [None])[0],
+            count=params.get('count', [None])[0],
+            with_key='_key' in params.get('meta', []),
+        )
+
+        if 'application/x-msgpack' in self.headers.get('Accept', ''):
+            return self.respond(200, b''.join(msgpack.packb(item) for item in items), 'application/x-msgpack; charset=UTF-8')
+
+        return self.respond(200, ''.join(json.dumps(item) + '\n' for item in items).encode(), 'application/x-jsonlines; charset=UTF-8')
+
+    def respond_metadata(self, job_id, key):
+        job = self.stub.jobs.get(job_id)
+
+        if job is None:
+            return self.respond(404, b'Not Found', 'text/plain')
+
+        value = job['metadata'] if key is None else job['metadata'].get(key)
+
+        return self.respond(200, json.dumps(value).encode() + b'\n', 'application/json; charset=UTF-8')
+
+    def respond_job_list(self, params):
+        jobs = self.stub.list_jobs(
+            state=params.get('state'),
+            has_tag=params.get('has_tag'),
+            count=params.get('count', [None])[0],
+            start=params.get('start', [None])[0],
+        )
+
+        return self.respond(200, ''.join(json.dumps(job) + '\n' for job in jobs).encode(), 'application/x-jsonlines; charset=UTF-8')
+
+    def respond(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+
+        for chunk_start in range(0, len(body), self.chunk_size):
+            chunk = body[chunk_start:chunk_start + self.chunk_size]
+
+            self.wfile.write(chunk)
+
+            if self.stub.bandwidth:
+                time.sleep(len(chunk) / self.stub.bandwidth)
+
+    def log_message(self, message_format, *args):
+        logger.debug(f'{self.address_string()} {message_format % args}')
@@ -0,0 +1,271 @@
+"""
+Индекс артикул → id SKU в памяти процесса воркера.
+
+В таблице SKU миллионы строк, а update_sku_cache ищет в ней артикулы каждого чанка. Индекс один раз загружается
+в процесс через COPY TO (бинарный формат разбирается numpy без построчного разбора) и хранит артикулы отсортированным
+массивом int64, а id – упакованными 16-байтными UUID того же порядка: на SKU уходит 24 байта, поиск – бинарный.
+
+Индекс не авторитетен: SKU создают и другие воркеры, поэтому артикулы, которых в нем нет, все равно ищутся в БД,
+а найденные там и только что созданные добавляются в индекс. Дубли SKU удаляются задачей merge_duplicate в другом
+процессе, и индекс может отдать id удаленного SKU: тогда сохранение версий падает на внешнем ключе, индекс процесса
+сбрасывается (см. Indexer.drop_stale_sku_index), и повтор диапазона идет по заново загруженному. С
+INDEXER_SKU_INDEX_VERIFY найденные в индексе id сверяются с БД на каждом чанке. Новые записи копятся в небольшом
+словаре и вливаются в массивы пачками по merge_size. В индекс попадают только артикулы из цифр без ведущих нулей, которые помещаются
+в int64 (для них преобразование в число и обратно однозначно), остальные всегда ищутся в БД
+"""
+import io
+import logging
+import numpy as np
+import struct
+import sys
+import threading
+import time
+import uuid
+from django.db import connection
+
+from wdf.metrics import SKU_INDEX_BYTES
+from wdf.models import Sku
+
+logger = logging.getLogger('wdf.indexer')
+logger.setLevel(logging.INFO)
+
+# Заголовок бинарного COPY: сигнатура, флаги и длина расширения заголовка; в конце – число полей -1
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+COPY_HEADER = struct.Struct('>11sii')
+COPY_TRAILER = struct.pack('>h', -1)
+
+# Строка бинарного COPY (article::bigint, id): число полей, длина и значение каждого поля
+COPY_ROW = np.dtype([
+    ('fields', '>i2'),
+    ('article_length', '>i4'),
+    ('article', '>i8'),
+    ('id_length', '>i4'),
+    ('id', 'V16'),
+])
+
+ARTICLE_PATTERN = '^[1-9][0-9]{0,17}$'
+ARTICLE_MAX_LENGTH = 18
+
+MERGE_SIZE = 10000
+
+
+def parse_copy_binary(data):
+    """
+    Артикулы и id из выгрузки COPY (SELECT article::bigint, id ...) TO STDOUT WITH (FORMAT binary)
+    """
+    if len(data) < COPY_HEADER.size + len(COPY_TRAILER):
+        raise ValueError('PG COPY binary data is too short')
+
+    signature, _flags, extension_length = COPY_HEADER.unpack_from(data)
+
+    if signature != COPY_SIGNATURE:
+        raise ValueError('Wrong PG COPY binary signature')
+
+    body = data[COPY_HEADER.size + extension_length:-len(COPY_TRAILER)]
+
+    if data[-len(COPY_TRAILER):] != COPY_TRAILER or len(body) % COPY_ROW.itemsize != 0:
+        raise ValueError('PG COPY binary data is truncated or has unexpected columns')
+
+    rows = np.frombuffer(body, dtype=COPY_ROW)
+
+    return rows['article'].astype(np.int64), np.ascontiguousarray(rows['id'])
+
+
+def to_article_number(article):
+    if 0 < len(article) <= ARTICLE_MAX_LENGTH and article.isascii() and article.isdigit() and article[0] != '0':
+        return int(article)
+
+    return None
+
+
+class SkuIndex(object):
+    """
+    Отсортированные артикулы (int64) и id SKU (16 байт) в памяти процесса
+    """
+
+    def __init__(self, merge_size=MERGE_SIZE):
+        self.articles = np.empty(0, dtype=np.int64)
+        self.ids = np.empty(0, dtype='V16')
+
+        # новые SKU, которые еще не влиты в массивы: число-артикул → байты UUID
+        self.pending = {}
+        self.merge_size = merge_size
+
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Загрузка всех SKU из БД через COPY TO. Из дублей (см. Sku.merge_duplicates) остается самый ранний
+        """
+        start_time = time.time()
+
+        data = io.BytesIO()
+
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY (SELECT article::bigint, id FROM {Sku._meta.db_table} WHERE article ~ '{ARTICLE_PATTERN}' "
+                'ORDER BY created_at) TO STDOUT WITH (FORMAT binary)', data)
+
+        self.set_rows(*parse_copy_binary(data.getbuffer()))
+
+        logger.info(f'SKU index loaded in {time.time() - start_time}s: {self.memory_report()}')
+
+        return self
+
+    def set_rows(self, articles, ids):
+        # np.unique с return_index сортирует устойчиво: у повторяющихся артикулов остается первый id
+        articles, first = np.unique(articles, return_index=True)
+
+        with self._lock:
+            self.articles = articles
+            self.ids = ids[first]
+            self.pending = {}
+
+        self.observe_memory()
+
+    def lookup(self, articles):
+        """
+        Id известных индексу SKU: {артикул: UUID}
+        """
+        numbers = {}
+
+        for article in articles:
+            number = to_article_number(article)
+
+            if number is not None:
+                numbers[article] = number
+
+        if len(numbers) == 0:
+            return {}
+
+        found = {}
+        keys = np.fromiter(numbers.values(), dtype=np.int64, count=len(numbers))
+
+        with self._lock:
+            if len(self.articles) > 0:
+                positions = np.minimum(np.searchsorted(self.articles, keys), len(self.articles) - 1)
+                matched = self.articles[positions] == keys
+            else:
+                positions = matched = np.zeros(len(keys), dtype=bool)
+
+            for (article, number), position, is_matched in zip(numbers.items(), positions, matched):
+                if is_matched:
+                    found[article] = uuid.UUID(bytes=self.ids[position].tobytes())
+                elif number in self.pending:
+                    found[article] = uuid.UUID(bytes=self.pending[number])
+
+        return found
+
+    def add(self, pairs):
+        """
+        Новые SKU: пары (артикул, id)
+        """
+        with self._lock:
+            for article, sku_id in pairs:
+                number = to_article_number(article)
+
+                if number is not None:
+                    self.pending.setdefault(number, sku_id.bytes)
+
+            if len(self.pending) < self.merge_size:
+                return
+
+            self.merge()
+
+        logger.info(f'SKU index merged: {self.memory_report()}')
+
+        self.observe_memory()
+
+    def discard(self, articles):
+        """
+        Удаление артикулов, SKU которых больше нет в БД (см. Sku.merge_duplicates): дальше они ищутся в БД
+        """
+        numbers = [number for number in map(to_article_number, articles) if number is not None]
+
+        if len(numbers) == 0:
+            return
+
+        keys = np.array(numbers, dtype=np.int64)
+
+        with self._lock:
+            for number in numbers:
+                self.pending.pop(number, None)
+
+            if len(self.articles) > 0:
+                positions = np.minimum(np.searchsorted(self.articles, keys), len(self.articles) - 1)
+                positions = positions[self.articles[positions] == keys]
+
+                self.articles = np.delete(self.articles, positions)
+                self.ids = np.delete(self.ids, positions)
+
+        self.observe_memory()
+
+    def merge(self):
+        """
+        Вливание накопленных SKU в отсортированные массивы (под self._lock)
+        """
+        articles = np.fromiter(self.pending.keys(), dtype=np.int64, count=len(self.pending))
+        ids = np.frombuffer(b''.join(self.pending.values()), dtype='V16')
+
+        # уже известные индексу артикулы не меняются
+        if len(self.articles) > 0:
+            positions = np.minimum(np.searchsorted(self.articles, articles), len(self.articles) - 1)
+            new = self.articles[positions] != articles
+
+            articles = articles[new]
+            ids = ids[new]
+
+        order = np.argsort(articles)
+        articles = articles[order]
+
+        positions = np.searchsorted(self.articles, articles)
+
+        self.articles = np.insert(self.articles, positions, articles)
+        self.ids = np.insert(self.ids, positions, ids[order])
+        self.pending = {}
+
+    def memory_usage(self):
+        """
+        Сколько памяти занимает индекс, в байтах
+        """
+        pending_bytes = sys.getsizeof(self.pending) + sum(
+            sys.getsizeof(number) + sys.getsizeof(sku_id) for number, sku_id in self.pending.items())
+
+        return {
+            'skus': len(self.articles) + len(self.pending),
+            'articles': self.articles.nbytes,
+            'ids': self.ids.nbytes,
+            'pending': pending_bytes,
+            'total': self.articles.nbytes + self.ids.nbytes + pending_bytes,
+        }
+
+    def memory_report(self):
+        usage = self.memory_usage()
+
+        return (f'{usage["skus"]} SKUs, {round(usage["total"] / 1024 / 1024, 2)}MB (articles {usage["articles"]}B, '
+                f'ids {usage["ids"]}B, {len(self.pending)} pending {usage["pending"]}B)')
+
+    def observe_memory(self):
+        SKU_INDEX_BYTES.set(self.memory_usage()['total'])
+
+
+# Индекс процесса: загружается при первом обращении и дальше общий для всех индексаторов и потоков процесса
+_sku_index = None
+_sku_index_lock = threading.Lock()
+
+
+def get_sku_index():
+    global _sku_index
+
+    with _sku_index_lock:
+        if _sku_index is None:
+            _sku_index = SkuIndex().load()
+
+        return _sku_index
+
+
+def reset_sku_index():
+    global _sku_index
+
+    with _sku_index_lock:
+        _sku_index = None
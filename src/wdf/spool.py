@@ -0,0 +1,266 @@
+"""
+Локальная копия айтемов дампа, которую prepare_dump пишет за один проход по выгрузке Scrapinghub, а воркеры
+импорта диапазонов читают вместо повторного скачивания.
+
+Айтемы лежат в файлах-шардах (shard-<раздел>-<номер первого айтема>.bin) на общем для воркеров диске. Каждый чанк
+выгрузки записывается в шард отдельным блоком: айтемы в msgpack, сжатые zlib. Индекс (index.json) хранит для каждого блока
+шард, номер первого айтема, их количество, смещение и длину блока в файле, поэтому диапазон читается с нужного
+смещения без распаковки предыдущих блоков. Индекс пишется последним: пока его нет, копия считается неполной и
+индексатор скачивает айтемы из Scrapinghub, как раньше.
+
+Копию можно разбить на разделы по хешу артикула (INDEXER_RANGE_PARTITIONS): тогда у каждого воркера импорта свой
+набор SKU, и два воркера не создают один и тот же SKU одновременно.
+
+Настройки: INDEXER_SPOOL_DIR (каталог на общем диске, пусто – копия не ведется) и INDEXER_SPOOL_SHARD_SIZE
+"""
+import bisect
+import environ
+import json
+import logging
+import msgpack
+import os
+import shutil
+import sys
+import zlib
+
+env = environ.Env(DEBUG=(bool, False))
+environ.Env.read_env()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+INDEX_NAME = 'index.json'
+
+# Копия живет от подготовки до wrap_dump, поэтому важнее скорость сжатия, чем его степень
+COMPRESSION_LEVEL = 1
+
+
+class DumpSpool(object):
+    """
+    Копия айтемов одной задачи Scrapinghub в каталоге directory
+    """
+
+    def __init__(self, directory, job_id, shard_size=50000):
+        self.job_id = job_id
+        self.path = os.path.join(directory, job_id.replace('/', '_'))
+        self.shard_size = shard_size
+
+        self._index = None
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, INDEX_NAME)
+
+    def is_complete(self):
+        return os.path.exists(self.index_path)
+
+    def get_index(self):
+        if self._index is None:
+            with open(self.index_path) as f:
+                self._index = json.load(f)
+
+        return self._index
+
+    def write(self, chunks, partitions=1, partition_key=None):
+        """
+        Пропускает через себя чанки выгрузки, записывая их в шарды. Индекс пишется, когда выгрузка прочитана до конца.
+
+        Если partitions > 1, айтемы раскладываются по разделам по хешу partition_key(item), и в копии они идут
+        по разделам: сначала все айтемы раздела 0, затем раздела 1 и т.д. Границы разделов сохраняются в индексе, поэтому
+        диапазоны можно нарезать так, чтобы каждый раздел целиком импортировал один воркер
+        """
+        if os.path.exists(self.path):
+            # остатки прерванной записи
+            shutil.rmtree(self.path)
+
+        os.makedirs(self.path)
+
+        blocks = []
+        shards = [SpoolShardWriter(self.path, partition, self.shard_size) for partition in range(max(1, partitions))]
+
+        try:
+            for chunk in chunks:
+                if len(shards) == 1:
+                    shards[0].buffer.extend(chunk)
+                else:
+                    for item in chunk:
+                        shards[get_partition(partition_key(item), len(shards))].buffer.append(item)
+
+                # блок пишется, когда в разделе набирается чанк
+                for shard in shards:
+                    if len(shard.buffer) >= len(chunk):
+                        blocks.append(shard.flush())
+
+                yield chunk
+
+            for shard in shards:
+                if len(shard.buffer) > 0:
+                    blocks.append(shard.flush())
+        finally:
+            for shard in shards:
+                shard.close()
+
+        # номера айтемов в копии: разделы идут друг за другом
+        partition_bounds = []
+        items_count = 0
+
+        for shard in shards:
+            partition_bounds.append({'start': items_count, 'count': shard.items_count})
+            items_count += shard.items_count
+
+        for block in blocks:
+            block['start'] += partition_bounds[block['partition']]['start']
+
+        index = {'job': self.job_id, 'items': items_count, 'blocks': sorted(blocks, key=lambda block: block['start'])}
+
+        if len(shards) > 1:
+            index['partitions'] = partition_bounds
+
+        self.write_index(index)
+
+        logger.info(f'Job {self.job_id}: {items_count} items spooled to {self.path} ({len(shards)} partitions)')
+
+    def get_partitions(self):
+        """
+        Границы разделов [{'start': ..., 'count': ...}, ...] или None, если копия не разбита на разделы
+        """
+        return self.get_index().get('partitions')
+
+    def write_index(self, index):
+        index_tmp_path = self.index_path + '.tmp'
+
+        with open(index_tmp_path, 'w') as f:
+            json.dump(index, f)
+
+        os.replace(index_tmp_path, self.index_path)
+
+        self._index = index
+
+    def iter_chunks(self, chunk_size=500, start=0, count=sys.maxsize):
+        """
+        Айтемы с start по start + count чанками по chunk_size, как list_iter клиента Scrapinghub
+        """
+        chunk = []
+
+        for item in self.iter_items(start=start, count=count):
+            chunk.append(item)
+
+            if len(chunk) == chunk_size:
+                yield chunk
+
+                chunk = []
+
+        if len(chunk) > 0:
+            yield chunk
+
+    def iter_items(self, start=0, count=sys.maxsize):
+        """
+        Айтемы с start по start + count по одному. В памяти одновременно только один распакованный блок
+        """
+        blocks = self.get_index()['blocks']
+        end = start + min(count, sys.maxsize - start)
+
+        shard_name = None
+        shard_file = None
+
+        # первый блок, в котором может быть айтем start
+        block_no = max(0, bisect.bisect_right([block['start'] for block in blocks], start) - 1)
+
+        try:
+            for block in blocks[block_no:]:
+                if block['start'] >= end:
+                    break
+
+                if block['shard'] != shard_name:
+                    if shard_file is not None:
+                        shard_file.close()
+
+                    shard_name = block['shard']
+                    shard_file = open(os.path.join(self.path, shard_name), 'rb')
+
+                shard_file.seek(block['offset'])
+
+                unpacker = msgpack.Unpacker(raw=False)
+                unpacker.feed(zlib.decompress(shard_file.read(block['length'])))
+
+                for item_no, item in enumerate(unpacker, block['start']):
+                    if item_no >= end:
+                        break
+
+                    if item_no >= start:
+                        yield item
+        finally:
+            if shard_file is not None:
+                shard_file.close()
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+        self._index = None
+
+
+class SpoolShardWriter(object):
+    """
+    Запись блоков одного раздела копии. Шард закрывается на границе блока, поэтому может быть немного больше shard_size
+    """
+
+    def __init__(self, path, partition, shard_size):
+        self.path = path
+        self.partition = partition
+        self.shard_size = shard_size
+
+        self.buffer = []
+        self.items_count = 0
+
+        self.shard_name = None
+        self.shard_start = 0
+        self.shard_file = None
+
+    def flush(self):
+        if self.shard_file is None or self.items_count - self.shard_start >= self.shard_size:
+            self.close()
+
+            self.shard_start = self.items_count
+            self.shard_name = f'shard-{self.partition}-{self.shard_start}.bin'
+            self.shard_file = open(os.path.join(self.path, self.shard_name), 'wb')
+
+        data = zlib.compress(b''.join(msgpack.packb(item, use_bin_type=True) for item in self.buffer), COMPRESSION_LEVEL)
+
+        block = {
+            'shard': self.shard_name,
+            'partition': self.partition,
+            'start': self.items_count,  # номер внутри раздела, сдвигается на начало раздела при записи индекса
+            'count': len(self.buffer),
+            'offset': self.shard_file.tell(),
+            'length': len(data),
+        }
+
+        self.shard_file.write(data)
+
+        self.items_count += len(self.buffer)
+        self.buffer = []
+
+        return block
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+
+        self.shard_file = None
+
+
+def get_partition(key, partitions):
+    # crc32, а не hash(): номер раздела не должен зависеть от PYTHONHASHSEED процесса
+    return zlib.crc32(str(key).encode()) % partitions
+
+
+def get_dump_spool(job_id):
+    """
+    Копия айтемов задачи по настройкам из окружения. None, если каталог для копий не задан
+    """
+    directory = env('INDEXER_SPOOL_DIR', default='')
+
+    if directory == '':
+        return None
+
+    return DumpSpool(directory, job_id, shard_size=env('INDEXER_SPOOL_SHARD_SIZE', cast=int, default=50000))
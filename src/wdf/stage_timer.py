@@ -0,0 +1,140 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from wdf.metrics import STAGE_DURATION
+
+logger = logging.getLogger('wdf.indexer')
+logger.setLevel(logging.INFO)
+
+
+class StageStats(object):
+    """
+    Накопленная статистика по этапам: количество вызовов, суммарное время и количество обработанных строк
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def add(self, name, duration=0.0, rows=0, calls=1):
+        stage = self.stages.setdefault(name, {'calls': 0, 'duration': 0.0, 'rows': 0})
+
+        stage['calls'] += calls
+        stage['duration'] += duration
+        stage['rows'] += rows
+
+    def merge(self, other):
+        for name, stage in other.stages.items():
+            self.add(name, duration=stage['duration'], rows=stage['rows'], calls=stage['calls'])
+
+    def reset(self):
+        self.stages = OrderedDict()
+
+    def total_duration(self):
+        return sum(stage['duration'] for stage in self.stages.values())
+
+    def as_dict(self):
+        return {name: {**stage, 'duration': round(stage['duration'], 6)} for name, stage in self.stages.items()}
+
+    def table(self):
+        """
+        Сводная таблица по этапам для вывода в консоль
+        """
+        total = self.total_duration() or 1
+
+        lines = [f'{"stage":<24}{"calls":>8}{"time, s":>12}{"share":>8}{"rows":>12}']
+
+        for name, stage in sorted(self.stages.items(), key=lambda x: x[1]['duration'], reverse=True):
+            lines.append(
+                f'{name:<24}{stage["calls"]:>8}{stage["duration"]:>12.3f}{stage["duration"] / total:>8.1%}{stage["rows"]:>12}')
+
+        lines.append(f'{"total":<24}{"":>8}{self.total_duration():>12.3f}')
+
+        return '\n'.join(lines)
+
+
+# Статистика по всем чанкам, обработанным в этом процессе. Ее выводят команды импорта в конце работы
+overall_stats = StageStats()
+
+
+class StageTimer(object):
+    """
+    Замер длительности этапов обработки чанка (получение данных, сбор словарей, запросы к БД, подготовка CSV, COPY
+    и т.п.). Этапы могут быть вложенными: время вложенного этапа не входит во время родительского, поэтому сумма
+    всех этапов равна времени обработки чанка.
+
+    После обработки чанка метод flush() пишет в лог одну структурированную запись со всеми этапами и переносит
+    статистику в overall_stats
+    """
+
+    def __init__(self):
+        self.chunk_stats = StageStats()
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        start_time = time.time()
+
+        # сюда вложенные этапы добавляют свое время, чтобы его можно было вычесть из родительского
+        self._stack.append(0.0)
+
+        try:
+            yield
+        finally:
+            nested_time = self._stack.pop()
+            time_spent = time.time() - start_time
+
+            self.add(name, time_spent - nested_time, rows=rows)
+
+            if len(self._stack) > 0:
+                self._stack[-1] += time_spent
+
+    def add(self, name, duration, rows=0):
+        self.chunk_stats.add(name, duration=duration, rows=rows)
+
+        STAGE_DURATION.labels(stage=name).observe(duration)
+
+    def add_rows(self, name, rows):
+        self.chunk_stats.add(name, rows=rows, calls=0)
+
+    def iterate(self, iterable, name='fetch'):
+        """
+        Обертка над генератором, которая засчитывает время ожидания каждого следующего элемента в этап name. Этапы,
+        замеренные внутри самого генератора, из этого времени вычитаются
+        """
+        iterator = iter(iterable)
+
+        while True:
+            start_time = time.time()
+            self._stack.append(0.0)
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                nested_time = self._stack.pop()
+
+            self.add(name, time.time() - start_time - nested_time)
+
+            yield item
+
+    def flush(self, log_prefix='', **context):
+        """
+        Структурированная запись о чанке: контекст (задача, номер чанка и т.п.) и длительности всех этапов
+        """
+        record = {
+            **context,
+            'duration': round(self.chunk_stats.total_duration(), 6),
+            'stages': self.chunk_stats.as_dict(),
+        }
+
+        logger.info(f'{log_prefix}Stages: {json.dumps(record)}', extra={'stage_record': record})
+
+        overall_stats.merge(self.chunk_stats)
+
+        self.chunk_stats = StageStats()
+
+        return record
@@ -0,0 +1,84 @@
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from wdf.indexer import Indexer
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'mocks', 'items_list.json')
+
+
+def load_template_items(path=TEMPLATE_PATH):
+    with open(path) as f:
+        return json.loads(f.read())
+
+
+def generate_items(count, catalogs=10, brands=100, features=10, seed=0, template_items=None):
+    """
+    Генератор айтемов в формате выгрузки Wildberries. За основу берутся реальные айтемы из шаблона, у которых
+    подменяются артикул, каталог, бренд, цена и т.п. Количество разных каталогов и брендов и количество параметров
+    у каждого айтема задаются аргументами, артикулы у всех айтемов разные
+    """
+    rnd = random.Random(seed)
+    template_items = template_items or load_template_items()
+
+    feature_names = []
+
+    for item in template_items:
+        for feature_name in item.get('features', [{}])[0].keys():
+            if feature_name not in feature_names:
+                feature_names.append(feature_name)
+
+    # пул параметров в два раза больше количества параметров у айтема, чтобы наборы у айтемов различались
+    feature_names += [f'Параметр {i}' for i in range(max(0, features * 2 - len(feature_names)))]
+
+    parse_date = datetime(2020, 8, 10, 18, 12, 7, 478756)
+
+    for i in range(count):
+        item = dict(template_items[i % len(template_items)])
+
+        article = str(10000000 + i)
+        catalog_no = rnd.randrange(catalogs)
+        brand_no = rnd.randrange(brands)
+
+        item.update({
+            'wb_id': article,
+            'product_url': f'https://www.wildberries.ru/catalog/{article}/detail.aspx',
+            'product_name': f'{item["product_name"]} #{i}',
+            'parse_date': str(parse_date + timedelta(microseconds=i)),
+            'wb_price': str(rnd.randint(100, 10000)),
+            'wb_rating': str(rnd.randint(0, 5)),
+            'wb_reviews_count': str(rnd.randint(0, 1000)),
+            'wb_purchases_count': rnd.randint(0, 10000),
+            'wb_category_url': f'https://www.wildberries.ru/catalog/synthetic/catalog-{catalog_no}',
+            'wb_category_name': f'Каталог {catalog_no}',
+            'wb_category_position': i + 1,
+            'wb_brand_url': f'https://www.wildberries.ru/brands/synthetic-{brand_no}',
+            'wb_brand_name': f'Бренд {brand_no}',
+            'features': [{name: f'значение {rnd.randrange(100)}' for name in rnd.sample(feature_names, features)}],
+        })
+
+        yield item
+
+
+class SyntheticIndexer(Indexer):
+    """
+    Индексатор, который вместо Scrapinghub берет айтемы из переданного списка – и чанками (get_generator),
+    и по одному (iter_items, потоковый режим). Дамп должен быть создан заранее и заполнен статистикой, иначе
+    индексатор пойдет за ней в Scrapinghub
+    """
+
+    def __init__(self, job_id, items):
+        self.items = items
+
+        super().__init__(job_id=job_id)
+
+    def get_generator(self, chunk_size=500, start=0, count=sys.maxsize):
+        end = min(len(self.items), start + count)
+
+        for chunk_start in range(start, end, chunk_size):
+            yield self.items[chunk_start:min(chunk_start + chunk_size, end)]
+
+    def iter_items(self, start=0, count=sys.maxsize, window=1000):
+        return iter(self.items[start:min(len(self.items), start + count)])
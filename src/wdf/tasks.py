@@ -1,13 +1,21 @@
 import environ
 import logging
+import os
+import socket
 import sys
 import time
-from celery import shared_task
+import uuid
+from celery import chain, group, shared_task
 from requests.exceptions import RequestException
 
-from wdf.exceptions import DumpStateTooEarlyError, DumpStateTooLateError
+from wdf.admission import get_admission_gate
+from wdf.exceptions import (
+    DumpRangeLeaseLostError, DumpSpoolMissingError, DumpStateError, DumpStateTooEarlyError, DumpStateTooLateError)
 from wdf.indexer import Indexer
-from wdf.models import Dump, Sku
+from wdf.metrics import push_metrics
+from wdf.models import Dump, DumpRange, Sku
+from wdf.profiler import ChunkProfiler
+from wdf.spool import get_dump_spool
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,29 +23,135 @@ logger.setLevel(logging.INFO)
 env = environ.Env(DEBUG=(bool, False))
 environ.Env.read_env()
 
+# Аренда диапазона должна покрывать его импорт целиком: продлить ее изнутри транзакции импорта нельзя
+RANGE_LEASE_SECONDS = env('INDEXER_RANGE_LEASE_SECONDS', cast=int, default=30 * 60)
+RANGE_MIN_SPLIT = env('INDEXER_RANGE_MIN_SPLIT', cast=int, default=500)
+# Сколько раз диапазон арендуется, прежде чем дамп считается сломанным (см. DumpRange.claim)
+RANGE_MAX_ATTEMPTS = env('INDEXER_RANGE_MAX_ATTEMPTS', cast=int, default=3)
+
+# Дампы не больше этого размера импортируются за один проход (см. Indexer.import_dump_single_pass), 0 – никогда.
+# Включать только с отдельным воркером очереди prepare с одним процессом: параллельные проходы создают дубли SKU
+SINGLE_PASS_MAX_ITEMS = env('INDEXER_SINGLE_PASS_MAX_ITEMS', cast=int, default=0)
+
 
 @shared_task(
     autoretry_for=[RequestException, DumpStateTooEarlyError],
+    retry_backoff=5,
+    retry_backoff_max=10 * 60,
+    retry_jitter=True,
     retry_kwargs={
         'max_retries': 10,
-        'countdown': 5,
     },
 )
-def prepare_dump(job_id, start=0, count=sys.maxsize):
+def prepare_dump(job_id, start=0, count=sys.maxsize, profile_chunks=0, profile_dir=None, partitions=1):
     logger.info(f'Preparing dump for job {job_id}')
 
     indexer = Indexer(job_id=job_id)
 
+    if profile_chunks > 0:
+        indexer.set_profiler(ChunkProfiler(job_id, chunks=profile_chunks, directory=profile_dir, start=start))
+
     try:
-        indexer.prepare_dump(start=start, count=count)
+        indexer.prepare_dump(start=start, count=count, partitions=partitions)
     except DumpStateTooLateError as e:
         logger.error(f'Job {job_id} prepare failed. {str(e)}')
     else:
         logger.info(f'Dump for job {job_id} prepared')
 
+    push_metrics()
+
+    return job_id
+
+
+@shared_task(
+    autoretry_for=[RequestException],
+    retry_backoff=5,
+    retry_backoff_max=10 * 60,
+    retry_jitter=True,
+    retry_kwargs={
+        'max_retries': 10,
+    },
+)
+def import_single_pass(job_id, profile_chunks=0, profile_dir=None):
+    """
+    Подготовка и импорт небольшого дампа за один проход вместо prepare_dump, schedule_dump и импорта диапазонов
+    """
+    logger.info(f'Importing dump for job {job_id} in a single pass')
+
+    indexer = Indexer(job_id=job_id).set_admission(get_admission_gate())
+
+    if profile_chunks > 0:
+        indexer.set_profiler(ChunkProfiler(job_id, chunks=profile_chunks, directory=profile_dir))
+
+    try:
+        indexer.import_dump_single_pass()
+    except DumpStateError as e:
+        logger.error(f'Job {job_id} single pass import failed. {str(e)}')
+    else:
+        logger.info(f'Dump for job {job_id} imported in a single pass')
+
+    push_metrics()
+
+    return job_id
+
+
+@shared_task(
+    autoretry_for=[DumpStateTooEarlyError],
+    retry_kwargs={
+        'max_retries': 10,
+        'countdown': 5,
+    },
+)
+def schedule_dump(results, job_id, group_size, workers=1, profile_chunks=0, profile_dir=None):
+    """
+    Заполнение очереди диапазонов подготовленного дампа и запуск воркеров, которые разбирают ее через import_ranges
+    """
+    dump = Dump.objects.filter(job=job_id).first()
+
+    pending_ranges = schedule_ranges(dump, group_size)
+
+    if pending_ranges == 0:
+        wrap_dump.delay(job_id=job_id)
+
+        return job_id
+
+    workers = max(1, min(workers, pending_ranges))
+
+    group([
+        import_ranges.s(None, job_id=job_id, workers=workers, profile_chunks=profile_chunks, profile_dir=profile_dir)
+        for _ in range(workers)
+    ]).apply_async(expires=24 * 60 * 60)
+
+    logger.info(f'Job {job_id}: {pending_ranges} ranges scheduled for {workers} workers')
+
     return job_id
 
 
+def schedule_ranges(dump, group_size):
+    """
+    Очередь диапазонов подготовленного дампа (если ее еще нет). Возвращает количество неимпортированных диапазонов
+    """
+    if dump.state_code < Dump.PREPARED:
+        raise DumpStateTooEarlyError(f'Dump for job {dump.job} is not prepared yet')
+
+    if dump.state_code < Dump.SCHEDULED:
+        spool = get_dump_spool(dump.job)
+
+        if dump.partitions > 1 and (spool is None or not spool.is_complete()):
+            raise DumpSpoolMissingError(f'Job {dump.job}: dump was spooled in {dump.partitions} partitions, but the spool is missing')
+
+        dump.set_state(Dump.SCHEDULING)
+        dump.save()
+
+        # копия, разбитая по артикулам, задает диапазоны сама: по одному на раздел
+        dump.create_ranges(group_size, partitions=spool.get_partitions() if spool is not None and spool.is_complete() else None)
+
+        dump.set_state(Dump.SCHEDULED)
+        dump.save()
+
+    return dump.ranges.exclude(state_code=DumpRange.PROCESSED).count()
+
+
 @shared_task(
     autoretry_for=[DumpStateTooEarlyError],
     retry_kwargs={
@@ -45,26 +159,126 @@ def prepare_dump(job_id, start=0, count=sys.maxsize):
         'countdown': 100,
     },
 )
-def import_dump(results, job_id, start=0, count=sys.maxsize):
-    logger.info(f'Importing dump for job {job_id} from item {start}, {count} items max')
+def import_ranges(results, job_id, workers=1, profile_chunks=0, profile_dir=None):
+    """
+    Воркер очереди диапазонов: арендует свободный диапазон, импортирует его и берет следующий, пока очередь не опустеет
+    """
+    indexer = Indexer(job_id=job_id).set_admission(get_admission_gate())
+    worker = get_worker_name()
 
-    indexer = Indexer(job_id=job_id)
+    # раздел копии по артикулам импортирует один воркер, иначе SKU раздела снова могут создать двое
+    min_split = 0 if indexer.is_partitioned() else RANGE_MIN_SPLIT
+
+    while True:
+        dump_range = DumpRange.claim(
+            indexer.dump, worker, RANGE_LEASE_SECONDS, workers=workers, min_split=min_split, max_attempts=RANGE_MAX_ATTEMPTS)
+
+        if dump_range is None:
+            break
+
+        if not import_range(indexer, dump_range, worker, profile_chunks=profile_chunks, profile_dir=profile_dir):
+            break
+
+    push_metrics()
+
+    return job_id
+
+
+@shared_task(
+    autoretry_for=[DumpStateTooEarlyError],
+    retry_kwargs={
+        'max_retries': 10,
+        'countdown': 100,
+    },
+)
+def import_dump(results, job_id, start=0, count=sys.maxsize, profile_chunks=0, profile_dir=None):
+    """
+    Импорт одного заданного диапазона из очереди. Размер диапазона берется из очереди, count оставлен для
+    совместимости с задачами, поставленными до ее появления: у их дампов очереди нет, и диапазон импортируется
+    по start и count, как раньше, а wrap_dump запускает аккорд старой цепочки
+    """
+    indexer = Indexer(job_id=job_id).set_admission(get_admission_gate())
+    worker = get_worker_name()
+
+    if not indexer.dump.ranges.exists():
+        import_legacy_range(indexer, start, count)
+        push_metrics()
+
+        return job_id
+
+    dump_range = DumpRange.claim(indexer.dump, worker, RANGE_LEASE_SECONDS, start=start, max_attempts=RANGE_MAX_ATTEMPTS)
+
+    if dump_range is None:
+        logger.info(f'Range from item {start} of job {job_id} is already imported, leased or failed, skipping')
+    else:
+        import_range(indexer, dump_range, worker, profile_chunks=profile_chunks, profile_dir=profile_dir)
+
+    push_metrics()
+
+    return job_id
+
+
+def import_legacy_range(indexer, start, count):
+    job_id = indexer.dump.job
+
+    logger.info(f'Importing dump for job {job_id} from item {start}, {count} items max (no range queue)')
 
     try:
         indexer.import_dump(start=start, count=count)
     except DumpStateTooLateError as e:
         logger.error(f'Job {job_id} import failed. {str(e)}')
     else:
-        logger.info(f'Dump for job {job_id} imported')
+        logger.info(f'Dump for job {job_id} imported from item {start}')
 
-    return job_id
+
+def import_range(indexer, dump_range, worker, profile_chunks=0, profile_dir=None):
+    """
+    Импорт арендованного диапазона. Если он оказался последним, ставится wrap_dump. Возвращает False, если дамп
+    дальше импортировать нельзя
+    """
+    job_id = indexer.dump.job
+
+    logger.info(f'Importing dump for job {job_id} from item {dump_range.start}, {dump_range.count} items max')
+
+    if profile_chunks > 0:
+        indexer.set_profiler(ChunkProfiler(job_id, chunks=profile_chunks, directory=profile_dir, start=dump_range.start))
+
+    try:
+        indexer.import_dump(start=dump_range.start, count=dump_range.count, worker=worker)
+    except DumpStateTooLateError as e:
+        logger.error(f'Job {job_id} import failed. {str(e)}')
+
+        return False
+    except DumpRangeLeaseLostError as e:
+        logger.error(f'Job {job_id} import rolled back. {str(e)}')
+
+        return True
+    except Exception:
+        if indexer.dump.fail_range(dump_range.start, worker=worker, max_attempts=RANGE_MAX_ATTEMPTS):
+            logger.error(f'Range from item {dump_range.start} of job {job_id} failed {RANGE_MAX_ATTEMPTS} times, dump marked as failed')
+
+        raise
+
+    logger.info(f'Dump for job {job_id} imported from item {dump_range.start}')
+
+    if indexer.dump_completed:
+        logger.info(f'Last range of job {job_id} imported, wrapping dump')
+
+        wrap_dump.delay(job_id=job_id)
+
+    return True
+
+
+def get_worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
 
 
 @shared_task(retry_kwargs={
     'max_retries': 2,
     'countdown': 100,
 })
-def wrap_dump(results, job_id):
+def wrap_dump(results=None, job_id=None):
+    # results – результаты аккорда импорта в задачах, поставленных старой цепочкой как wrap_dump(results, job_id)
     indexer = Indexer(job_id=job_id)
 
     try:
@@ -74,6 +288,8 @@ def wrap_dump(results, job_id):
     else:
         logger.info(f'Dump for job {job_id} wrapped up')
 
+    push_metrics()
+
     return job_id
 
 
@@ -102,3 +318,28 @@ def merge_duplicate(sku_article):
     logger.info(f'Merged duplicates for sku article {sku_article} (primary id {sku.id}) in {time_spent}s')
 
     return True
+
+
+def build_import_chain(dump, group_size, workers=1, single_pass='auto', partitions=1, **options):
+    """
+    Цепочка импорта дампа: подготовка словарей, затем заполнение очереди диапазонов и запуск воркеров импорта.
+    wrap_dump запускает воркер, импортировавший последний диапазон (см. DumpRange). Небольшие дампы (или все,
+    если single_pass='yes') импортируются одной задачей import_single_pass.
+
+    Если partitions > 1, подготовка раскладывает копию дампа по разделам по хешу артикула, и диапазонами импорта
+    становятся разделы (см. DumpSpool)
+    """
+    if use_single_pass(dump, single_pass):
+        return chain(import_single_pass.s(job_id=dump.job, **options))
+
+    return chain(
+        prepare_dump.s(job_id=dump.job, partitions=partitions, **options),
+        schedule_dump.s(job_id=dump.job, group_size=group_size, workers=workers, **options),
+    )
+
+
+def use_single_pass(dump, single_pass='auto'):
+    if single_pass == 'auto':
+        return dump.items_crawled is not None and dump.items_crawled <= SINGLE_PASS_MAX_ITEMS
+
+    return single_pass == 'yes'
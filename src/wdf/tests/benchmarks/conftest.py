@@ -0,0 +1,9 @@
+import pytest
+from django.db import connection
+
+
+@pytest.fixture()
+def _pg_copy():
+    """Пропуск бенчмарков COPY FROM на базах без copy_from (sqlite в тестовом окружении)"""
+    if not hasattr(connection.cursor(), 'copy_from'):
+        pytest.skip('PG COPY is not available for this database')
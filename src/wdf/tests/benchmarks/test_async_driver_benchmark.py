@@ -0,0 +1,56 @@
+import itertools
+import pytest
+from celery import group
+
+from wdf.async_driver import AsyncImportDriver
+from wdf.indexer import Indexer
+from wdf.models import Dump
+from wdf.synthetic import generate_items
+from wdf.tasks import import_ranges, schedule_ranges
+
+ITEMS = 2000
+GROUP_SIZE = 250
+CHUNK_SIZE = 100
+WORKERS = 4
+
+# задержка ответа Scrapinghub: асинхронный драйвер выигрывает за счет ожидания сети
+LATENCY = 0.05
+
+job_numbers = itertools.count(1)
+
+
+def scheduled_indexer(sh_stub):
+    """Новый подготовленный дамп с заполненной очередью диапазонов – у каждого раунда свой"""
+    job_id = f'777/1/{next(job_numbers)}'
+    sh_stub.add_job(job_id, list(generate_items(ITEMS)))
+
+    sh_stub.latency = 0
+    indexer = Indexer(job_id=job_id).set_chunk_size_get(CHUNK_SIZE).set_chunk_size_save(CHUNK_SIZE)
+    indexer.prepare_dump()
+    schedule_ranges(indexer.dump, GROUP_SIZE)
+    sh_stub.latency = LATENCY
+
+    return indexer
+
+
+def import_celery_fan_out(indexer):
+    # в тестах Celery работает в eager-режиме: воркеры import_ranges разбирают очередь друг за другом, как если бы
+    # на всех был один процесс. Размер чанка воркеры берут из INDEXER_GET_CHUNK_SIZE
+    group([import_ranges.s(None, job_id=indexer.dump.job, workers=WORKERS) for _ in range(WORKERS)]).apply()
+
+    return Dump.objects.get(pk=indexer.dump.pk).state_code
+
+
+def import_asyncio(indexer):
+    AsyncImportDriver(indexer, concurrency=WORKERS).run()
+
+    return Dump.objects.get(pk=indexer.dump.pk).state_code
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures('_pg_copy')
+@pytest.mark.parametrize('driver', [import_celery_fan_out, import_asyncio], ids=['celery', 'asyncio'])
+def test_import_ranges(benchmark, sh_stub, driver):
+    state_code = benchmark.pedantic(driver, setup=lambda: ((scheduled_indexer(sh_stub),), {}), rounds=3)
+
+    assert state_code == Dump.PROCESSED
@@ -0,0 +1,84 @@
+import pytest
+import uuid
+from django.utils import timezone
+
+from wdf.bulk_create_manager import BulkCreateManager
+from wdf.models import Parameter, Price
+
+ROWS = [100, 1000, 10000]
+SLICES = [500, 5000]
+
+
+def numeric_rows(count):
+    return [Price(id=uuid.uuid4(), price=float(i), price_dirty=float(i), discount=0.0, created_at=timezone.now()) for i in range(count)]
+
+
+def text_rows(count):
+    return [Parameter(id=uuid.uuid4(), value=f'Длинное текстовое значение параметра номер {i}; ' * 4, created_at=timezone.now()) for i in range(count)]
+
+
+ROW_FACTORIES = {
+    'numeric': (Price, numeric_rows),
+    'text': (Parameter, text_rows),
+}
+
+
+def filled_manager(kind, rows, slice_size, queue='_pg_copy_create_queues'):
+    model_class, factory = ROW_FACTORIES[kind]
+
+    manager = BulkCreateManager(max_chunk_size=slice_size)
+    getattr(manager, queue)[model_class._meta.label] = factory(rows)
+
+    return (manager, model_class), {}
+
+
+@pytest.mark.parametrize('kind', ROW_FACTORIES.keys())
+@pytest.mark.parametrize('rows', ROWS)
+def test_prepare_export_csv(benchmark, kind, rows):
+    model_class, factory = ROW_FACTORIES[kind]
+    manager = BulkCreateManager(max_chunk_size=rows)
+    chunk = factory(rows)
+
+    csv_data, header = benchmark(manager._prepare_export_csv_with_headers, chunk, model_class)
+
+    assert len(csv_data.getvalue().splitlines()) == rows
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures('_pg_copy')
+@pytest.mark.parametrize('kind', ROW_FACTORIES.keys())
+@pytest.mark.parametrize('rows', ROWS)
+@pytest.mark.parametrize('slice_size', SLICES)
+def test_commit_pg_copy(benchmark, kind, rows, slice_size):
+    benchmark.pedantic(
+        lambda manager, model_class: manager._commit_pg_copy(model_class),
+        setup=lambda: filled_manager(kind, rows, slice_size),
+        rounds=5,
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('kind', ROW_FACTORIES.keys())
+@pytest.mark.parametrize('rows', ROWS)
+@pytest.mark.parametrize('slice_size', SLICES)
+def test_commit_bulk_create(benchmark, kind, rows, slice_size):
+    benchmark.pedantic(
+        lambda manager, model_class: manager._commit_bulk_create(model_class),
+        setup=lambda: filled_manager(kind, rows, slice_size, queue='_bulk_create_queues'),
+        rounds=5,
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures('_pg_copy')
+@pytest.mark.parametrize('rows', ROWS)
+def test_commit_pg_copy_with_retry(benchmark, rows):
+    """Одна строка ломает COPY (табуляция внутри значения), ее приходится догружать через bulk_create"""
+
+    def setup():
+        (manager, model_class), kwargs = filled_manager('text', rows, rows)
+        manager._pg_copy_create_queues[model_class._meta.label][rows // 2].value = 'broken\tvalue'
+
+        return (manager, model_class), kwargs
+
+    benchmark.pedantic(lambda manager, model_class: manager._commit(model_class), setup=setup, rounds=5)
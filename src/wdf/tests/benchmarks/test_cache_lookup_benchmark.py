@@ -0,0 +1,31 @@
+import pytest
+import uuid
+from django.utils import timezone
+
+from wdf.lookups import LOOKUP_METHODS, lookup_ids
+from wdf.models import Sku
+
+SKUS = 50000
+KEYS = [1000, 10000]
+
+
+@pytest.fixture()
+def _skus():
+    Sku.objects.bulk_create([
+        Sku(id=uuid.uuid4(), article=str(10000000 + i), url=f'https://www.wildberries.ru/catalog/{i}/detail.aspx', title=f'SKU {i}',
+            created_at=timezone.now(), updated_at=timezone.now())
+        for i in range(SKUS)
+    ], batch_size=5000)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('_pg_copy', '_skus')
+@pytest.mark.parametrize('keys', KEYS)
+@pytest.mark.parametrize('method', LOOKUP_METHODS)
+def test_lookup_ids(benchmark, method, keys):
+    # половина ключей чанка есть в БД, половина – новые SKU
+    articles = [str(10000000 + SKUS - keys // 2 + i) for i in range(keys)]
+
+    pairs = benchmark(lookup_ids, Sku, 'article', articles, method=method)
+
+    assert len(pairs) == keys // 2
@@ -0,0 +1,73 @@
+import pytest
+import uuid
+
+from wdf.columnar import ColumnarBatch
+from wdf.models import Sku
+from wdf.synthetic import generate_items
+
+ROWS = [1000, 10000]
+
+
+class CollectingManager(object):
+    """Вместо записи в БД только собирает объекты: сравниваем разбор чанка, а не COPY"""
+
+    def __init__(self):
+        self.objects = []
+
+    def add(self, obj):
+        self.objects.append(obj)
+
+    def done(self, log_prefix=''):
+        pass
+
+
+@pytest.fixture()
+def chunk_indexer(indexer):
+    def _chunk_indexer(items):
+        chunk_indexer = indexer()
+        chunk_indexer.bulk_manager = CollectingManager()
+
+        for item in items:
+            chunk_indexer.collect_all(item)
+
+        chunk_indexer.skus_cache = {wb_id: uuid.uuid4() for wb_id in chunk_indexer.skus_retrieved}
+        chunk_indexer.catalogs_cache = {url: uuid.uuid4() for url in chunk_indexer.catalogs_retrieved}
+        chunk_indexer.parameters_cache = {name: uuid.uuid4() for name in chunk_indexer.parameters_retrieved}
+
+        return chunk_indexer
+
+    return _chunk_indexer
+
+
+def process_per_item(indexer, items):
+    indexer.bulk_manager.objects = []
+
+    for item in items:
+        indexer.collect_all(item)
+
+    indexer.save_all(items)
+
+    return len(indexer.bulk_manager.objects)
+
+
+def process_columnar(indexer, items):
+    indexer.bulk_manager.objects = []
+
+    batch = ColumnarBatch(items, title_max_length=Sku._meta.get_field('title').max_length)
+
+    indexer.collect_batch(batch)
+    indexer.save_batch(batch)
+
+    return len(indexer.bulk_manager.objects)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('rows', ROWS)
+@pytest.mark.parametrize('process', [process_per_item, process_columnar])
+def test_process_chunk(benchmark, chunk_indexer, rows, process):
+    items = list(generate_items(rows))
+
+    objects_count = benchmark(process, chunk_indexer(items), items)
+
+    # версия, цена, рейтинг, продажи, отзывы, позиция и 10 параметров на айтем
+    assert objects_count == rows * 16
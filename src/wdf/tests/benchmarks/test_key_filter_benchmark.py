@@ -0,0 +1,44 @@
+import pytest
+import uuid
+from django.utils import timezone
+
+from wdf.key_filter import BloomFilter
+from wdf.lookups import lookup_ids
+from wdf.models import Sku
+
+SKUS = 50000
+KEYS = 10000
+
+
+@pytest.fixture()
+def _skus():
+    Sku.objects.bulk_create([
+        Sku(id=uuid.uuid4(), article=str(10000000 + i), url=f'https://www.wildberries.ru/catalog/{i}/detail.aspx', title=f'SKU {i}',
+            created_at=timezone.now(), updated_at=timezone.now())
+        for i in range(SKUS)
+    ], batch_size=5000)
+
+
+@pytest.fixture()
+def sku_filter(tmp_path):
+    return BloomFilter.create(str(tmp_path / 'skus.bloom'), capacity=SKUS * 2, error_rate=0.01, keys=[
+        [str(10000000 + i) for i in range(SKUS)],
+    ])
+
+
+# свежий обход категории: все SKU чанка новые
+NEW_ARTICLES = [str(20000000 + i) for i in range(KEYS)]
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('_pg_copy', '_skus')
+def test_select_new_keys(benchmark):
+    assert benchmark(lookup_ids, Sku, 'article', NEW_ARTICLES) == []
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('_pg_copy', '_skus')
+def test_filter_new_keys(benchmark, sku_filter):
+    absent = benchmark(sku_filter.absent, NEW_ARTICLES)
+
+    assert len(absent) > KEYS * 0.98
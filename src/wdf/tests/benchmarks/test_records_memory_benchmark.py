@@ -0,0 +1,73 @@
+import pytest
+import tracemalloc
+
+from wdf.indexer import guess_wb_article
+from wdf.synthetic import generate_items
+
+ROWS = 5000
+
+
+def collect_dicts(indexer, items):
+    """Прежний сбор словарей: на каждый ключ – свой dict с маркетплейсом"""
+    retrieved = {'catalogs': {}, 'brands': {}, 'parameters': {}, 'skus': {}}
+
+    for item in items:
+        retrieved['catalogs'][item['wb_category_url']] = {
+            'marketplace': indexer.marketplace.id, 'parent': '', 'name': item['wb_category_name'],
+            'url': item['wb_category_url'], 'level': 1,
+        }
+        retrieved['brands'][item['wb_brand_url']] = {
+            'marketplace': indexer.marketplace.id, 'name': item['wb_brand_name'], 'url': item['wb_brand_url'],
+        }
+
+        for feature_name in item['features'][0]:
+            retrieved['parameters'][feature_name] = {'marketplace': indexer.marketplace.id, 'name': feature_name}
+
+        retrieved['skus'][item['wb_id']] = {
+            'parse_date': item['parse_date'], 'marketplace': indexer.marketplace.id, 'brand': item['wb_brand_url'],
+            'article': guess_wb_article(item), 'url': item['product_url'], 'title': item['product_name'],
+        }
+
+    return retrieved
+
+
+def collect_records(indexer, items):
+    indexer.clear_retrieved()
+
+    for item in items:
+        indexer.collect_all(item)
+
+    return (indexer.catalogs_retrieved, indexer.brands_retrieved, indexer.parameters_retrieved, indexer.skus_retrieved)
+
+
+def retained_bytes(collect, indexer, items):
+    """Сколько памяти остается занято собранным после сбора (сами айтемы уже в памяти и не считаются)"""
+    tracemalloc.start()
+
+    try:
+        retrieved = collect(indexer, items)  # noqa: F841
+        retained, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return retained
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('collect', [collect_dicts, collect_records], ids=['dicts', 'records'])
+def test_collect_memory(benchmark, indexer, collect):
+    items = list(generate_items(ROWS))
+    collector = indexer()
+
+    benchmark(collect, collector, items)
+
+    bytes_per_item = retained_bytes(collect, collector, items) / ROWS
+    benchmark.extra_info['retained_bytes_per_item'] = round(bytes_per_item)
+
+
+@pytest.mark.django_db
+def test_records_take_less_memory_than_dicts(indexer):
+    items = list(generate_items(ROWS))
+    collector = indexer()
+
+    assert retained_bytes(collect_records, collector, items) < retained_bytes(collect_dicts, collector, items) * 0.8
@@ -0,0 +1,45 @@
+import pytest
+import uuid
+from django.utils import timezone
+
+from wdf.lookups import lookup_ids
+from wdf.models import Sku
+from wdf.sku_index import SkuIndex
+
+SKUS = 50000
+KEYS = [1000, 10000]
+
+
+@pytest.fixture()
+def _skus():
+    Sku.objects.bulk_create([
+        Sku(id=uuid.uuid4(), article=str(10000000 + i), url=f'https://www.wildberries.ru/catalog/{i}/detail.aspx', title=f'SKU {i}',
+            created_at=timezone.now(), updated_at=timezone.now())
+        for i in range(SKUS)
+    ], batch_size=5000)
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('_pg_copy', '_skus')
+def test_load(benchmark):
+    index = benchmark(lambda: SkuIndex().load())
+
+    usage = index.memory_usage()
+    benchmark.extra_info['memory_bytes'] = usage['total']
+
+    assert usage['skus'] == SKUS
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('_pg_copy', '_skus')
+@pytest.mark.parametrize('keys', KEYS)
+@pytest.mark.parametrize('source', ['index', 'db'])
+def test_lookup(benchmark, source, keys):
+    articles = [str(10000000 + i * (SKUS // keys)) for i in range(keys)]
+
+    if source == 'index':
+        found = benchmark(SkuIndex().load().lookup, articles)
+    else:
+        found = benchmark(lookup_ids, Sku, 'article', articles)
+
+    assert len(found) == keys
@@ -0,0 +1,33 @@
+import pytest
+import pytz
+from dateutil.parser import parse as date_parse
+
+from wdf.synthetic import generate_items
+from wdf.timestamps import parse_timestamp
+
+ITEMS = 10000
+
+
+@pytest.fixture(scope='module')
+def parse_dates():
+    return [item['parse_date'] for item in generate_items(ITEMS)]
+
+
+def parse_with_dateutil(values):
+    return [pytz.utc.localize(date_parse(value)) for value in values]
+
+
+def parse_fast(values):
+    # без кеша: в синтетической выгрузке все даты разные, как и в реальной
+    return [parse_timestamp.__wrapped__(value) for value in values]
+
+
+def parse_memoized(values):
+    return [parse_timestamp(value) for value in values]
+
+
+@pytest.mark.parametrize('parser', [parse_with_dateutil, parse_fast, parse_memoized])
+def test_parse_dates(benchmark, parse_dates, parser):
+    parsed = benchmark(parser, parse_dates)
+
+    assert parsed == parse_with_dateutil(parse_dates)
@@ -1,11 +1,13 @@
 import json
 import os
 import pytest
+import re
 import requests_mock
 from mixer.backend.django import mixer
 
 from wdf.indexer import Indexer
 from wdf.models import DictCatalog, DictParameter, Dump, Sku, Version
+from wdf.sh_stub import ScrapinghubStub
 
 
 @pytest.fixture()
@@ -119,3 +121,14 @@ def requests_mocker(current_path, sample_category_data_raw):
         m.get('https://storage.scrapinghub.com/jobs/12345/123/12345/scrapystats', text=open(current_path + '/mocks/scrapystats.json', 'r').read())
         m.get('https://storage.scrapinghub.com/items/12345/123/12345?start=12345%2F123%2F12345%2F0&count=100&meta=_key', content=sample_category_data_raw(spider='wb'), headers={'Content-Type': 'application/x-msgpack; charset=UTF-8'})
         yield m
+
+
+@pytest.fixture()
+def sh_stub(settings, requests_mocker):
+    """Local Scrapinghub stand-in, the indexer and commands are pointed at it via SH_ENDPOINT."""
+    requests_mocker.register_uri(requests_mock.ANY, re.compile(r'^http://127\.0\.0\.1:\d+/'), real_http=True)
+
+    with ScrapinghubStub() as stub:
+        settings.SH_ENDPOINT = stub.endpoint
+
+        yield stub
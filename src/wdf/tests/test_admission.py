@@ -0,0 +1,96 @@
+import pytest
+from django.db import connection
+from prometheus_client import REGISTRY
+
+from wdf.admission import AdmissionGate, FakeHealthSource, PostgresHealthSource, get_admission_gate
+from wdf.indexer import Indexer
+
+
+def sample_value(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture()
+def sleeps():
+    return []
+
+
+@pytest.fixture()
+def gate(sleeps):
+    def _gate(readings, **thresholds):
+        return AdmissionGate(FakeHealthSource(readings), interval=0.5, max_wait=10, sleep=sleeps.append, **thresholds)
+
+    return _gate
+
+
+def test_healthy_database_is_not_waited_for(gate, sleeps):
+    assert gate([{'active_backends': 5}], max_active_backends=10).wait() == 0
+    assert sleeps == []
+
+
+def test_chunk_is_held_until_signals_recover(gate, sleeps):
+    before = sample_value('wdf_indexer_admission_delays_total', {'reason': 'lock_waits'})
+
+    readings = [{'lock_waits': 12}, {'lock_waits': 8, 'replication_lag': 30.0}, {'lock_waits': 1}]
+
+    assert gate(readings, max_lock_waits=5, max_replication_lag=10).wait() == 1.0
+    assert sleeps == [0.5, 0.5]
+    assert sample_value('wdf_indexer_admission_delays_total', {'reason': 'lock_waits'}) == before + 2
+
+
+def test_disabled_thresholds_are_ignored(gate):
+    assert gate([{'active_backends': 1000, 'lock_waits': 1000}], max_replication_lag=5).wait() == 0
+
+
+def test_gate_gives_up_after_max_wait(gate, sleeps):
+    assert gate([{'active_backends': 100}], max_active_backends=10).wait() == 10
+    assert len(sleeps) == 20
+
+
+@pytest.mark.django_db
+def test_indexer_asks_gate_before_each_chunk(indexer, items_sample, sleeps):
+    source = FakeHealthSource([{'active_backends': 50}, {'active_backends': 1}])
+
+    indexer = indexer().set_admission(AdmissionGate(source, max_active_backends=10, sleep=sleeps.append))
+    indexer.process_batch([items_sample[:10], items_sample[10:]], save_versions=False)
+
+    assert source.reads == 3
+    assert len(sleeps) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_waits_before_range_transaction(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    indexer = Indexer(job_id=job_id).set_chunk_size_get(10)
+    indexer.prepare_dump()
+    indexer.dump.create_ranges(1000)
+
+    # ожидание внутри транзакции держало бы ее блокировки
+    waits_in_transaction = []
+    source = FakeHealthSource([{'active_backends': 50}, {'active_backends': 1}])
+
+    indexer.set_admission(AdmissionGate(source, max_active_backends=10, sleep=lambda _: waits_in_transaction.append(connection.in_atomic_block)))
+    indexer.import_dump()
+
+    # одна проверка перед транзакцией диапазона, а не перед каждым из трех чанков
+    assert source.reads == 2
+    assert waits_in_transaction == [False]
+    assert indexer.dump.get_versions_num() == 25
+
+
+@pytest.mark.django_db
+def test_gate_disabled_by_default():
+    assert get_admission_gate() is None
+
+
+@pytest.mark.django_db
+def test_postgres_health_source():
+    if connection.vendor != 'postgresql':
+        pytest.skip('pg_stat_activity is available on Postgres only')
+
+    health = PostgresHealthSource().read()
+
+    assert health['active_backends'] >= 0
+    assert health['lock_waits'] >= 0
+    assert health['replication_lag'] >= 0
@@ -0,0 +1,138 @@
+import aiohttp
+import asyncio
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection
+from io import StringIO
+
+from wdf.async_driver import AsyncImportDriver, CopyRowsCollector, ItemsFetcher
+from wdf.indexer import Indexer
+from wdf.models import DictCatalog, DictParameter, Dump, DumpRange, Parameter, Price, Sku, Version
+from wdf.tasks import schedule_ranges
+
+
+def test_collector_drains_rows_in_model_order():
+    collector = CopyRowsCollector()
+    version = Version(crawled_at='2020-08-10 18:12:07+00:00')
+
+    collector.add(version)
+    collector.add(Price(version=version, price=10.0))
+    collector.add(Price(version=version, price=20.0))
+    collector.done()
+
+    tables = collector.drain()
+
+    assert [(model_class, len(rows)) for model_class, columns, rows in tables] == [(Version, 1), (Price, 2)]
+
+    model_class, columns, rows = tables[1]
+    row = dict(zip(columns, rows[0]))
+
+    assert row['version_id'] == version.id
+    assert row['price'] == 10.0
+    # auto_now_add заполняется, как при bulk_create
+    assert row['created_at'] is not None
+    assert collector.drain() == []
+
+
+def test_collector_passes_dictionaries_to_bulk_manager(mocker):
+    bulk_manager = mocker.Mock()
+    collector = CopyRowsCollector(bulk_manager)
+    catalog = DictCatalog(name='Каталог', url='https://www.wildberries.ru/catalog/synthetic/catalog-1')
+
+    collector.add(catalog)
+    collector.add(Version(crawled_at='2020-08-10 18:12:07+00:00'))
+    collector.done(log_prefix='Job 1: ')
+
+    # словари пишутся сразу, иначе их не найдет повторная выборка после вставки
+    bulk_manager.add.assert_called_once_with(catalog)
+    bulk_manager.done.assert_called_once_with(log_prefix='Job 1: ')
+    assert [model_class for model_class, columns, rows in collector.drain()] == [Version]
+
+
+@pytest.mark.django_db
+def test_import_dump_command_rejects_asyncio_driver_without_postgres(sh_stub):
+    if connection.vendor == 'postgresql':
+        pytest.skip('Checks the driver guard on other databases')
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=10)[0]
+
+    with pytest.raises(CommandError, match='Postgres only'):
+        call_command('import_dump', job_id, driver='asyncio', stdout=StringIO())
+
+    assert not Version.objects.exists()
+
+
+def fetch_windows(sh_stub, job_id, windows, **kwargs):
+    async def _fetch():
+        async with aiohttp.ClientSession() as session:
+            fetcher = ItemsFetcher(session, job_id, endpoint=sh_stub.endpoint, apikey='x', **kwargs)
+
+            return [await fetcher.fetch(start, count) for start, count in windows]
+
+    return asyncio.run(_fetch())
+
+
+def test_fetcher_reads_item_windows(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=30)[0]
+
+    windows = fetch_windows(sh_stub, job_id, [(0, 10), (25, 10)])
+
+    assert windows == [sh_stub.jobs[job_id]['items'][0:10], sh_stub.jobs[job_id]['items'][25:30]]
+
+
+def test_fetcher_retries_throttled_requests(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=30)[0]
+    sh_stub.max_rps = 1
+
+    windows = fetch_windows(sh_stub, job_id, [(0, 10), (10, 10)], backoff=0.1)
+
+    assert [len(window) for window in windows] == [10, 10]
+    assert sh_stub.requests_throttled >= 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_driver_imports_all_ranges(sh_stub):
+    if connection.vendor != 'postgresql':
+        pytest.skip('Async driver COPYs via asyncpg and works on Postgres only')
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=45)[0]
+    indexer = Indexer(job_id=job_id).set_chunk_size_get(10)
+
+    indexer.prepare_dump()
+    schedule_ranges(indexer.dump, 20)
+
+    driver = AsyncImportDriver(indexer, concurrency=2).run()
+
+    dump = Dump.objects.get(job=job_id)
+
+    assert driver.items_imported == 45
+    assert driver.ranges_imported == 3
+    assert dump.state_code == Dump.PROCESSED
+    assert Version.objects.filter(dump=dump).count() == 45
+    assert Price.objects.filter(version__dump=dump).count() == 45
+    assert Parameter.objects.filter(version__dump=dump).count() == sum(len(item['features'][0]) for item in sh_stub.jobs[job_id]['items'])
+    assert not dump.ranges.exclude(state_code=DumpRange.PROCESSED).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_driver_recreates_missing_skus(sh_stub):
+    if connection.vendor != 'postgresql':
+        pytest.skip('Async driver COPYs via asyncpg and works on Postgres only')
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=30)[0]
+    indexer = Indexer(job_id=job_id).set_chunk_size_get(10)
+
+    indexer.prepare_dump()
+    schedule_ranges(indexer.dump, 20)
+
+    # SKU и параметр пропали после подготовки (например, их слил merge_duplicate): импорт создает их заново
+    Sku.objects.filter(article=sh_stub.jobs[job_id]['items'][0]['wb_id']).delete()
+    DictParameter.objects.filter(name=next(iter(sh_stub.jobs[job_id]['items'][0]['features'][0]))).delete()
+
+    AsyncImportDriver(indexer, concurrency=2).run()
+
+    dump = Dump.objects.get(job=job_id)
+
+    assert dump.state_code == Dump.PROCESSED
+    assert Version.objects.filter(dump=dump).count() == 30
+    assert Sku.objects.filter(article=sh_stub.jobs[job_id]['items'][0]['wb_id']).exists()
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from wdf.columnar import ColumnarBatch, guess_wb_articles
+from wdf.indexer import guess_wb_article
+from wdf.models import Parameter, Position, Price, Rating, Reviews, Sales, Sku, Version
+
+
+def test_batch_columns(items_sample):
+    batch = ColumnarBatch(items_sample)
+
+    assert batch.size == 26
+    assert batch.wb_ids == [item['wb_id'] for item in items_sample]
+    assert batch.prices.tolist() == [float(item['wb_price']) for item in items_sample]
+    assert batch.has_category_position.sum() == 24
+    assert batch.reviews.tolist() == [int(item['wb_reviews_count'] or 0) for item in items_sample]
+    assert batch.feature_offsets[-1] == len(batch.feature_names) == 215
+    assert dict(batch.features(0)) == items_sample[0]['features'][0]
+
+
+def test_batch_keeps_null_numbers(items_sample):
+    items_sample[0]['wb_rating'] = None
+    del items_sample[1]['wb_rating']
+
+    batch = ColumnarBatch(items_sample)
+
+    assert np.isnan(batch.ratings[0])
+    assert batch.has_rating[:2].tolist() == [True, False]
+    assert batch.rating_filled[:3].tolist() == [False, False, True]
+
+
+def test_batch_truncates_titles(items_sample):
+    batch = ColumnarBatch(items_sample, title_max_length=10)
+
+    assert all(len(title) <= 10 for title in batch.titles)
+
+
+def test_guess_wb_articles():
+    items = [
+        {'wb_id': '12345', 'product_url': 'https://www.wildberries.ru/catalog/7402496/detail.aspx'},
+        {'wb_id': '2020-08-13 03:00:45.275365', 'product_url': 'https://www.wildberries.ru/catalog/7402496/detail.aspx'},
+    ]
+
+    assert guess_wb_articles([item['wb_id'] for item in items], [item['product_url'] for item in items]) == [guess_wb_article(item) for item in items]
+
+
+def saved_rows():
+    """
+    Все сохраненные факты без id и времени создания, с версией, приведенной к артикулу SKU
+    """
+    return {
+        'versions': sorted(Version.objects.values_list('sku__article', 'crawled_at')),
+        'prices': sorted(Price.objects.values_list('version__sku__article', 'price')),
+        'ratings': sorted(Rating.objects.values_list('version__sku__article', 'rating')),
+        'sales': sorted(Sales.objects.values_list('version__sku__article', 'sales')),
+        'reviews': sorted(Reviews.objects.values_list('version__sku__article', 'reviews')),
+        'positions': sorted(Position.objects.values_list('version__sku__article', 'catalog__url', 'absolute'), key=str),
+        'parameters': sorted(Parameter.objects.values_list('version__sku__article', 'parameter__name', 'value')),
+    }
+
+
+@pytest.mark.django_db
+def test_columnar_chunk_saves_same_rows(indexer, items_sample):
+    indexer = indexer()
+
+    # рейтинг null и отсутствующие поля
+    items_sample[1]['wb_rating'] = None
+    items_sample[2]['wb_reviews_count'] = None
+
+    for key in ('wb_price', 'wb_rating', 'wb_purchases_count', 'wb_reviews_count'):
+        del items_sample[3][key]
+
+    indexer.set_columnar(False).process_chunk(items_sample, save_versions=True)
+
+    expected_rows = saved_rows()
+
+    Version.objects.all().delete()
+
+    indexer.set_columnar(True).process_chunk(items_sample, save_versions=True)
+
+    assert saved_rows() == expected_rows
+    assert len(expected_rows['parameters']) == 215
+    assert (items_sample[1]['wb_id'], None) in [(wb_id, rating) for wb_id, rating in expected_rows['ratings']]
+    assert len(expected_rows['prices']) == len(expected_rows['ratings']) == 25
+
+
+@pytest.mark.django_db
+def test_collect_batch_matches_collect_all(indexer, items_sample):
+    indexer = indexer()
+
+    for item in items_sample:
+        indexer.collect_all(item)
+
+    expected = (indexer.catalogs_retrieved, indexer.brands_retrieved, indexer.parameters_retrieved, indexer.skus_retrieved)
+
+    indexer.clear_retrieved()
+    indexer.collect_batch(ColumnarBatch(items_sample, title_max_length=Sku._meta.get_field('title').max_length))
+
+    assert (indexer.catalogs_retrieved, indexer.brands_retrieved, indexer.parameters_retrieved, indexer.skus_retrieved) == expected
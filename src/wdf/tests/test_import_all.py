@@ -0,0 +1,79 @@
+import pytest
+import time
+from django.core.management import call_command
+from io import StringIO
+
+from app.celery import celery
+from wdf.models import Dump
+
+pytestmark = [pytest.mark.django_db]
+
+
+@pytest.fixture()
+def chain(mocker):
+    return mocker.patch('wdf.tasks.chain')
+
+
+@pytest.fixture()
+def stub_jobs(sh_stub, settings):
+    settings.SH_PROJECT_ID = '12345'
+
+    return sh_stub.add_synthetic_jobs('12345', jobs=4, items=10, tags=['stub'])
+
+
+def test_import_all_schedules_every_job(stub_jobs, chain):
+    call_command('import_all', tags='stub', group_size=4, stdout=StringIO())
+
+    assert chain.call_count == 4
+    assert chain.return_value.apply_async.call_count == 4
+    assert Dump.objects.filter(job__in=stub_jobs, items_crawled=10).count() == 4
+
+
+def test_import_all_skips_imported_dumps(stub_jobs, chain, dump_sample):
+    dump_sample(state=Dump.PROCESSED, job_id=stub_jobs[0])
+
+    out = StringIO()
+    call_command('import_all', tags='stub', group_size=4, stdout=out)
+
+    assert chain.call_count == 3
+    assert f'Job #{stub_jobs[0]} already imported' in out.getvalue()
+
+
+def test_import_all_fills_missing_stats(stub_jobs, chain):
+    Dump.objects.create(job=stub_jobs[0], crawler='wb')
+
+    call_command('import_all', tags='stub', group_size=4, stdout=StringIO())
+
+    assert Dump.objects.get(job=stub_jobs[0]).items_crawled == 10
+    assert Dump.objects.filter(job__in=stub_jobs).count() == 4
+
+
+def test_import_all_fetches_metadata_concurrently(sh_stub, stub_jobs, chain):
+    sh_stub.latency = 0.2
+
+    start_time = time.time()
+    call_command('import_all', tags='stub', group_size=4, concurrency=4, stdout=StringIO())
+
+    # 1 запрос списка задач и 4 параллельные пачки по 3 запроса метаданных против 13 последовательных
+    assert time.time() - start_time < 13 * 0.2
+    assert chain.call_count == 4
+
+
+def test_import_all_timings_include_import_stages(stub_jobs):
+    out = StringIO()
+    call_command('import_all', tags='stub', group_size=4, timings='yes', stdout=out)
+
+    # в тестах задачи выполняются на месте, поэтому в сводке и этапы планирования, и этапы импорта чанков
+    stages = {line.split()[0] for line in out.getvalue().splitlines()}
+
+    assert {'job_list', 'dispatch', 'skus_select', 'bulk_create'} <= stages
+    assert Dump.objects.filter(job__in=stub_jobs, state_code=Dump.PROCESSED).count() == 4
+
+
+def test_import_all_timings_point_to_workers(stub_jobs, chain, monkeypatch):
+    monkeypatch.setattr(celery.conf, 'task_always_eager', False)
+
+    out = StringIO()
+    call_command('import_all', tags='stub', group_size=4, timings='yes', stdout=out)
+
+    assert 'Import stages are timed by the workers' in out.getvalue()
@@ -5,6 +5,7 @@ from mixer.backend.django import mixer
 
 from wdf.indexer import Indexer, guess_wb_article
 from wdf.models import DictCatalog, Dump, Parameter, Position, Price, Rating, Reviews, Sales, Sku, Version
+from wdf.records import BrandRecord, CatalogRecord, SkuRecord
 
 
 @pytest.mark.django_db
@@ -24,11 +25,11 @@ def test_collect_wb_catalogs_correct(indexer, item_sample):
     collected = indexer.catalogs_retrieved['https://www.wildberries.ru/promotions/dlya-pitomtsev/kovriki-dlya-lotkov']
 
     assert len(indexer.catalogs_retrieved) == 1
-    assert list(collected) == ['marketplace', 'parent', 'name', 'url', 'level']
-    assert collected['parent'] == ''
-    assert collected['name'] == 'Коврики для лотков'
-    assert collected['url'] == 'https://www.wildberries.ru/promotions/dlya-pitomtsev/kovriki-dlya-lotkov'
-    assert collected['level'] == 1
+    assert isinstance(collected, CatalogRecord)
+    assert collected.parent == ''
+    assert collected.name == 'Коврики для лотков'
+    assert collected.url == 'https://www.wildberries.ru/promotions/dlya-pitomtsev/kovriki-dlya-lotkov'
+    assert collected.level == 1
 
 
 @pytest.mark.django_db
@@ -51,9 +52,9 @@ def test_collect_wb_brands_correct(indexer, item_sample):
     collected = indexer.brands_retrieved['https://www.wildberries.ru/brands/vita-famoso']
 
     assert len(indexer.brands_retrieved) == 1
-    assert list(collected) == ['marketplace', 'name', 'url']
-    assert collected['name'] == 'Vita Famoso'
-    assert collected['url'] == 'https://www.wildberries.ru/brands/vita-famoso'
+    assert isinstance(collected, BrandRecord)
+    assert collected.name == 'Vita Famoso'
+    assert collected.url == 'https://www.wildberries.ru/brands/vita-famoso'
 
 
 @pytest.mark.django_db
@@ -76,12 +77,12 @@ def test_collect_wb_skus_correct(indexer, item_sample):
     collected = indexer.skus_retrieved['11743005']
 
     assert len(indexer.skus_retrieved) == 1
-    assert list(collected) == ['parse_date', 'marketplace', 'brand', 'article', 'url', 'title']
-    assert collected['parse_date'] == '2020-08-10 18:12:07.478756'
-    assert collected['brand'] == 'https://www.wildberries.ru/brands/vita-famoso'
-    assert collected['article'] == '11743005'
-    assert collected['url'] == 'https://www.wildberries.ru/catalog/11743005/detail.aspx'
-    assert collected['title'] == 'Коврик для туалета кошки, кошачий коврик под лоток для кошки'
+    assert isinstance(collected, SkuRecord)
+    assert collected.parse_date == '2020-08-10 18:12:07.478756'
+    assert collected.brand == 'https://www.wildberries.ru/brands/vita-famoso'
+    assert collected.article == '11743005'
+    assert collected.url == 'https://www.wildberries.ru/catalog/11743005/detail.aspx'
+    assert collected.title == 'Коврик для туалета кошки, кошачий коврик под лоток для кошки'
 
 
 @pytest.mark.django_db
@@ -93,7 +94,7 @@ def test_collect_wb_skus_too_long_title(indexer, item_sample):
 
     collected = indexer.skus_retrieved['11743005']
 
-    assert collected['title'] == 'Гипотеза: минимум 20% офисов продаж узнают о новых акциях с задержкой больше трех дней, либо вообще не узнают — из-за этого продажи не растут, либо падают. Чтобы найти решение, мы проведем интервью с менеджерами из десяти точек продаж в одном регионе. Если семеро и больше подтвердят гипотезу, то сделаем пилотный запуск системы быстрого оповещения точек продаж об акциях через мессенджер, после чего проверим, как изменился уровень продаж. Гипотеза: читатели испытывают трудности при заказе книг на Amazon из-з'
+    assert collected.title == 'Гипотеза: минимум 20% офисов продаж узнают о новых акциях с задержкой больше трех дней, либо вообще не узнают — из-за этого продажи не растут, либо падают. Чтобы найти решение, мы проведем интервью с менеджерами из десяти точек продаж в одном регионе. Если семеро и больше подтвердят гипотезу, то сделаем пилотный запуск системы быстрого оповещения точек продаж об акциях через мессенджер, после чего проверим, как изменился уровень продаж. Гипотеза: читатели испытывают трудности при заказе книг на Amazon из-з'
 
 
 @pytest.mark.django_db
@@ -0,0 +1,69 @@
+import pytest
+
+from wdf.indexer import Indexer
+from wdf.item_stream import MISSING, RecordChunk, SaveRecord, iter_job_items, make_save_record
+from wdf.models import Dump, Parameter, Position, Price, Rating, Reviews, Sales, Version
+from wdf.sh_client import get_sh_client
+
+
+def test_save_record(items_sample):
+    item = next(item for item in items_sample if 'wb_category_position' not in item)
+
+    record = make_save_record({**item, 'wb_reviews_count': ''})
+
+    assert record.wb_id == item['wb_id']
+    assert record.price == float(item['wb_price'])
+    assert record.reviews == 0
+    assert record.position is MISSING
+    assert dict(record.features) == item['features'][0]
+
+
+def test_iter_job_items_reads_windows(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=50)[0]
+
+    items = list(iter_job_items(get_sh_client(), job_id, start=5, count=20, window=7))
+
+    assert [item['wb_id'] for item in items] == [item['wb_id'] for item in sh_stub.jobs[job_id]['items'][5:25]]
+    assert sh_stub.requests_served == 3
+
+
+def saved_rows(dump):
+    return {
+        'versions': sorted(Version.objects.filter(dump=dump).values_list('sku__article', 'crawled_at')),
+        'prices': sorted(Price.objects.filter(version__dump=dump).values_list('version__sku__article', 'price')),
+        'ratings': sorted(Rating.objects.filter(version__dump=dump).values_list('version__sku__article', 'rating')),
+        'sales': sorted(Sales.objects.filter(version__dump=dump).values_list('version__sku__article', 'sales')),
+        'reviews': sorted(Reviews.objects.filter(version__dump=dump).values_list('version__sku__article', 'reviews')),
+        'positions': sorted(Position.objects.filter(version__dump=dump).values_list('version__sku__article', 'catalog__url', 'absolute'), key=str),
+        'parameters': sorted(Parameter.objects.filter(version__dump=dump).values_list('version__sku__article', 'parameter__name', 'value')),
+    }
+
+
+@pytest.mark.django_db
+def test_record_generator_keeps_compact_records(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=45)[0]
+    indexer = Indexer(job_id=job_id)
+
+    chunks = list(indexer.get_record_generator(chunk_size=20))
+
+    assert [len(chunk) for chunk in chunks] == [20, 20, 5]
+    assert all(isinstance(chunk, RecordChunk) and isinstance(chunk[0], SaveRecord) for chunk in chunks)
+    # словари последнего чанка собраны по его айтемам
+    assert set(indexer.skus_retrieved) == {record.wb_id for record in chunks[-1]}
+
+
+@pytest.mark.django_db
+def test_streaming_import_saves_same_rows(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=45)[0]
+    sh_stub.add_job('12345/1/2', sh_stub.jobs[job_id]['items'])
+
+    for streaming_job_id, streaming in ((job_id, False), ('12345/1/2', True)):
+        indexer = Indexer(job_id=streaming_job_id).set_chunk_size_get(20).set_streaming(streaming)
+
+        indexer.prepare_dump()
+        indexer.import_dump()
+        indexer.wrap_dump()
+
+        assert indexer.dump.state_code == Dump.PROCESSED
+
+    assert saved_rows(Dump.objects.get(job=job_id)) == saved_rows(Dump.objects.get(job='12345/1/2'))
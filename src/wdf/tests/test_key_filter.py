@@ -0,0 +1,135 @@
+import pytest
+from django.core.management import call_command
+from mixer.backend.django import mixer
+
+from wdf.key_filter import BloomFilter, build_key_filter, get_filter_size, get_key_filter, reset_key_filters
+from wdf.models import DictBrand, Sku
+
+
+@pytest.fixture()
+def bloom_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('INDEXER_BLOOM_DIR', str(tmp_path))
+
+    reset_key_filters()
+
+    yield tmp_path
+
+    reset_key_filters()
+
+
+def test_filter_size():
+    assert get_filter_size(1000, 0.01) == (9586, 7)
+
+
+def test_absent_keys(tmp_path):
+    keys = [str(article) for article in range(10000000, 10001000)]
+
+    key_filter = BloomFilter.create(str(tmp_path / 'skus.bloom'), capacity=1000, error_rate=0.01, keys=[keys])
+
+    assert key_filter.absent(keys + [None]) == set()
+
+    unknown = [str(article) for article in range(20000000, 20010000)]
+
+    # ложных срабатываний не больше, чем рассчитано, с запасом на случайность
+    assert len(key_filter.absent(unknown)) > len(unknown) * 0.98
+
+
+def test_added_keys_are_visible_to_other_processes(tmp_path):
+    path = str(tmp_path / 'brands.bloom')
+
+    key_filter = BloomFilter.create(path, capacity=100, error_rate=0.01)
+    other_process_filter = BloomFilter(path)
+
+    key_filter.add(['https://www.wildberries.ru/brands/1'])
+
+    assert other_process_filter.absent(['https://www.wildberries.ru/brands/1', 'https://www.wildberries.ru/brands/2']) == {
+        'https://www.wildberries.ru/brands/2'}
+
+
+def test_add_after_rebuild_goes_to_new_file(tmp_path):
+    path = str(tmp_path / 'brands.bloom')
+
+    stale_filter = BloomFilter.create(path, capacity=100, error_rate=0.01)
+    BloomFilter.create(path, capacity=200, error_rate=0.01)
+
+    assert stale_filter.is_replaced()
+
+    stale_filter.add(['new'])
+
+    assert BloomFilter(path).absent(['new']) == set()
+
+
+def test_not_a_filter_file(tmp_path):
+    (tmp_path / 'skus.bloom').write_bytes(b'x' * 64)
+
+    with pytest.raises(ValueError, match='not a key filter'):
+        BloomFilter(str(tmp_path / 'skus.bloom'))
+
+
+def test_key_filters_disabled():
+    assert get_key_filter('skus', Sku, 'article') is None
+
+
+@pytest.mark.django_db
+def test_key_filter_built_from_db(bloom_dir):
+    mixer.blend(Sku, article='11743005')
+
+    key_filter = get_key_filter('skus', Sku, 'article')
+
+    assert key_filter.absent(['11743005', '12381016']) == {'12381016'}
+    assert get_key_filter('skus', Sku, 'article') is key_filter
+
+
+@pytest.mark.django_db
+def test_build_key_filters_command(bloom_dir):
+    mixer.blend(Sku, article='11743005')
+
+    call_command('build_key_filters', '--only', 'skus', '--capacity', '1000')
+
+    assert (bloom_dir / 'skus.bloom').exists()
+    assert not (bloom_dir / 'brands.bloom').exists()
+    assert BloomFilter(str(bloom_dir / 'skus.bloom')).absent(['11743005', '12381016']) == {'12381016'}
+
+
+@pytest.mark.django_db
+def test_rebuild_keeps_keys_of_uncommitted_transactions(tmp_path):
+    mixer.blend(Sku, article='11743005')
+
+    path = str(tmp_path / 'skus.bloom')
+
+    # артикул SKU, созданного в еще не закоммиченной транзакции импорта: в БД его не видно
+    BloomFilter.create(path, capacity=100, error_rate=0.01).add(['12381016'])
+
+    assert build_key_filter(path, Sku, 'article', capacity=100, error_rate=0.01).absent(['11743005', '12381016']) == set()
+
+    # фильтр другого размера строится только по БД
+    assert build_key_filter(path, Sku, 'article', capacity=200, error_rate=0.01).absent(['11743005', '12381016']) == {'12381016'}
+
+
+@pytest.mark.django_db
+def test_created_keys_are_added_before_commit(bloom_dir, indexer, items_sample):
+    chunk_indexer = indexer()
+    chunk_indexer.resolve_chunk(items_sample)
+
+    # тест идет в транзакции, которая не коммитится
+    assert get_key_filter('skus', Sku, 'article').absent(chunk_indexer.skus_retrieved.keys()) == set()
+    assert get_key_filter('brands', DictBrand, 'url').absent(chunk_indexer.brands_retrieved.keys()) == set()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_indexer_skips_lookups_of_absent_keys(bloom_dir, indexer, items_sample):
+    chunk_indexer = indexer()
+    chunk_indexer.resolve_chunk(items_sample)
+
+    skus_cache = chunk_indexer.skus_cache
+
+    # в пустой БД все ключи точно новые: поиск пропущен, а ключи созданных записей попали в фильтр
+    assert chunk_indexer.key_filter_stats['skus'] == {'skipped': len(chunk_indexer.skus_retrieved), 'false_positives': 0}
+    assert chunk_indexer.timer.chunk_stats.stages['skus_select']['rows'] == 0
+    assert get_key_filter('skus', Sku, 'article').absent(chunk_indexer.skus_retrieved.keys()) == set()
+
+    chunk_indexer.resolve_chunk(items_sample)
+
+    assert chunk_indexer.key_filter_stats['skus'] == {'skipped': 0, 'false_positives': 0}
+    assert chunk_indexer.skus_cache == skus_cache
+    assert 'skus skipped 0, false positives 0 (0.00%)' in chunk_indexer.format_key_filter_stats()
@@ -0,0 +1,42 @@
+import pytest
+from mixer.backend.django import mixer
+
+from wdf.lookups import LOOKUP_METHODS, lookup_ids
+from wdf.models import DictBrand, Sku
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('method', LOOKUP_METHODS)
+def test_lookup_ids_returns_keys_and_ids(method):
+    skus = mixer.cycle(3).blend(Sku, article=(_ for _ in ('100', '200', '300')))
+
+    pairs = lookup_ids(Sku, 'article', {'100', '300', '400'}, method=method)
+
+    assert sorted(pairs) == sorted([(skus[0].article, skus[0].id), (skus[2].article, skus[2].id)])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('method', LOOKUP_METHODS)
+def test_lookup_ids_keeps_special_characters(method):
+    url = 'https://www.wildberries.ru/brands/a,"b"\tc\\d'
+    brand = mixer.blend(DictBrand, url=url)
+
+    assert lookup_ids(DictBrand, 'url', [url, None], method=method) == [(url, brand.id)]
+
+
+@pytest.mark.django_db
+def test_lookup_ids_reuses_temp_table():
+    skus = mixer.cycle(2).blend(Sku, article=(_ for _ in ('100', '200')))
+
+    # ключи прошлого поиска во временной таблице не остаются
+    assert lookup_ids(Sku, 'article', ['100'], method='temp_table') == [('100', skus[0].id)]
+    assert lookup_ids(Sku, 'article', ['200'], method='temp_table') == [('200', skus[1].id)]
+
+
+def test_lookup_ids_without_keys():
+    assert lookup_ids(Sku, 'article', [None]) == []
+
+
+def test_lookup_ids_unknown_method():
+    with pytest.raises(ValueError, match='Unknown lookup method'):
+        lookup_ids(Sku, 'article', ['100'], method='exists')
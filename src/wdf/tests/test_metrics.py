@@ -0,0 +1,85 @@
+import pytest
+from django.db import transaction
+from prometheus_client import REGISTRY
+
+from wdf.bulk_create_manager import BulkCreateManager
+from wdf.metrics import get_metrics_instance
+from wdf.models import DictParameter, Dump
+
+
+def sample_value(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dump_state_transition_counted(dump_sample):
+    before = sample_value('wdf_dump_state_transitions_total', {'state': 'preparing'})
+
+    dump = dump_sample()
+    dump.set_state(Dump.PREPARING)
+
+    # пока состояние не сохранено, переход не считается
+    assert sample_value('wdf_dump_state_transitions_total', {'state': 'preparing'}) == before
+
+    dump.save()
+    dump.save()
+
+    assert sample_value('wdf_dump_state_transitions_total', {'state': 'preparing'}) == before + 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rolled_back_dump_state_transition_not_counted(dump_sample):
+    dump = dump_sample()
+    before = sample_value('wdf_dump_state_transitions_total', {'state': 'processing'})
+
+    def save_and_fail():
+        with transaction.atomic():
+            dump.set_state(Dump.PROCESSING)
+            dump.save()
+
+            raise RuntimeError('rollback')
+
+    with pytest.raises(RuntimeError, match='rollback'):
+        save_and_fail()
+
+    assert sample_value('wdf_dump_state_transitions_total', {'state': 'processing'}) == before
+
+
+def test_metrics_instance_is_stable(mocker):
+    mocker.patch('wdf.metrics.current_process', return_value=mocker.Mock(index=3))
+    mocker.patch('wdf.metrics.get_current_task', return_value=mocker.Mock(request=mocker.Mock(hostname='import@worker1')))
+
+    assert get_metrics_instance() == 'import@worker1:3'
+
+
+@pytest.mark.django_db
+def test_bulk_create_rows_counted(mixer):
+    marketplace = mixer.blend('wdf.DictMarketplace')
+    labels = {'model': 'wdf.DictParameter', 'method': 'bulk_create'}
+    before = sample_value('wdf_indexer_rows_written_total', labels)
+
+    manager = BulkCreateManager(max_chunk_size=2)
+
+    for name in ('foo', 'bar', 'baz'):
+        manager.add(DictParameter(marketplace=marketplace, name=name))
+
+    manager.done()
+
+    assert sample_value('wdf_indexer_rows_written_total', labels) == before + 3
+
+
+@pytest.mark.django_db
+def test_cache_lookups_counted(indexer_filled):
+    before_miss = sample_value('wdf_indexer_cache_lookups_total', {'object': 'brands', 'result': 'miss'})
+
+    indexer_filled.update_brands_cache(indexer_filled.brands_retrieved)
+
+    assert sample_value('wdf_indexer_cache_lookups_total', {'object': 'brands', 'result': 'miss'}) == before_miss + 9
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint(anon):
+    got = anon.get('/api/v1/metrics/')
+
+    assert 'wdf_indexer_items_processed_total' in got
+    assert 'wdf_dump_state_transitions_total' in got
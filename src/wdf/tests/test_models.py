@@ -1,9 +1,11 @@
 import pytest
+from datetime import timedelta
 from django.db.utils import IntegrityError
+from django.utils import timezone
 
 from wdf.models import (
-    DictBrand, DictCatalog, DictMarketplace, DictParameter, Dump, Parameter, Position, Price, Rating, Reviews, Sales,
-    Sku, Version)
+    DictBrand, DictCatalog, DictMarketplace, DictParameter, Dump, DumpRange, Parameter, Position, Price, Rating,
+    Reviews, Sales, Sku, Version)
 
 
 @pytest.mark.usefixtures('_fill_db')
@@ -145,3 +147,88 @@ def test_unique_constraint_parameter(sku_sample, version_sample, dict_parameter_
         pytest.fail('Parameter constraint failed')
     except IntegrityError:
         assert True
+
+
+@pytest.mark.django_db
+def test_dump_ranges_are_created_once(dump_sample):
+    dump = dump_sample()
+    dump.items_crawled = 25
+    dump.save()
+
+    ranges = dump.create_ranges(10)
+
+    assert [(dump_range.start, dump_range.count) for dump_range in ranges] == [(0, 10), (10, 10), (20, 10)]
+    assert [dump_range.pk for dump_range in dump.create_ranges(5)] == [dump_range.pk for dump_range in ranges]
+
+
+@pytest.mark.django_db
+def test_dump_range_completion_is_reported_once(dump_sample):
+    dump = dump_sample()
+    dump.items_crawled = 20
+    dump.save()
+
+    dump.create_ranges(10)
+
+    assert dump.complete_range(10, items_imported=10) is False
+    assert dump.complete_range(0, items_imported=10) is True
+    assert dump.complete_range(0, items_imported=10) is False
+
+
+@pytest.mark.django_db
+def test_dump_progress(dump_sample):
+    dump = dump_sample()
+    dump.items_crawled = 30
+    dump.save()
+
+    dump.create_ranges(10)
+    dump.complete_range(0, items_imported=10)
+    DumpRange.claim(dump, 'worker-1', lease_seconds=60, start=10)
+    dump.fail_range(20)
+
+    progress = dump.get_progress()
+
+    assert progress['ranges_total'] == 3
+    assert progress['ranges_processed'] == 1
+    assert progress['ranges_processing'] == 1
+    assert progress['ranges_error'] == 1
+    assert progress['items_imported'] == 10
+    assert progress['progress'] == round(1 / 3, 4)
+    assert DumpRange.objects.filter(dump=dump, state_code=DumpRange.ERROR).count() == 1
+
+
+@pytest.mark.django_db
+def test_dump_range_claim_skips_leased_and_reclaims_expired(dump_sample):
+    dump = dump_sample()
+    dump.items_crawled = 20
+    dump.save()
+
+    dump.create_ranges(10)
+
+    first = DumpRange.claim(dump, 'worker-1', lease_seconds=60)
+    second = DumpRange.claim(dump, 'worker-2', lease_seconds=60)
+
+    assert (first.start, second.start) == (0, 10)
+    assert DumpRange.claim(dump, 'worker-3', lease_seconds=60) is None
+
+    # аренда первого воркера истекла, диапазон забирает третий
+    DumpRange.objects.filter(pk=first.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    assert DumpRange.claim(dump, 'worker-3', lease_seconds=60).start == 0
+    assert DumpRange.claim(dump, 'worker-4', lease_seconds=60) is None
+
+
+@pytest.mark.django_db
+def test_dump_range_claim_splits_tail_for_idle_workers(dump_sample):
+    dump = dump_sample()
+    dump.items_crawled = 1000
+    dump.save()
+
+    dump.create_ranges(1000)
+
+    dump_range = DumpRange.claim(dump, 'worker-1', lease_seconds=60, workers=4, min_split=100)
+
+    assert (dump_range.start, dump_range.count) == (0, 500)
+    assert [(r.start, r.count, r.state_code) for r in dump.ranges.all()] == [
+        (0, 500, DumpRange.PROCESSING), (500, 500, DumpRange.CREATED)]
+
+    assert DumpRange.claim(dump, 'worker-2', lease_seconds=60, workers=4, min_split=100).count == 250
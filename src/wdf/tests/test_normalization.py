@@ -0,0 +1,90 @@
+import pytest
+
+from wdf.indexer import Indexer
+from wdf.models import Dump, RejectedItem, Version
+from wdf.normalization import ItemRejectedError, normalize_item
+
+
+def test_normalize_item_coerces_values(item_sample):
+    item = normalize_item({
+        **item_sample,
+        'wb_price': '1 299,50',
+        'wb_rating': '',
+        'wb_purchases_count': '12',
+        'wb_reviews_count': '',
+        'wb_category_position': 3.0,
+        'features': [{'Цвет': None, 'Размер': 42}],
+    })
+
+    assert item['wb_price'] == 1299.5
+    assert item['wb_rating'] is None
+    assert item['wb_purchases_count'] == 12
+    assert item['wb_reviews_count'] == 0
+    assert item['wb_category_position'] == 3
+    assert item['features'] == [{'Цвет': '', 'Размер': '42'}]
+
+
+def test_normalize_item_keeps_valid_item(item_sample):
+    item = normalize_item(item_sample)
+
+    # паук пишет числа строками
+    assert item == {
+        **item_sample,
+        'wb_price': float(item_sample['wb_price']),
+        'wb_rating': float(item_sample['wb_rating']),
+        'wb_reviews_count': int(item_sample['wb_reviews_count']),
+    }
+    assert item is not item_sample
+
+
+@pytest.mark.parametrize(('changes', 'field'), [
+    ({'product_name': None}, 'product_name'),
+    ({'product_name': '  '}, 'product_name'),
+    ({'wb_price': 'n/a'}, 'wb_price'),
+    ({'wb_reviews_count': -1}, 'wb_reviews_count'),
+    ({'parse_date': 'yesterday'}, 'parse_date'),
+    ({'features': {'Цвет': 'белый'}}, 'features'),
+    ({'wb_id': 'x' * 30, 'product_url': 'https://www.wildberries.ru/brands/acme'}, 'product_url'),
+    ({'product_url': 'https://www.wildberries.ru/catalog/7402496/detail.aspx?' + 'x' * 200}, 'product_url'),
+    ({'wb_category_url': None}, 'wb_category_url'),
+])
+def test_normalize_item_rejects_invalid_values(item_sample, changes, field):
+    with pytest.raises(ItemRejectedError) as e:
+        normalize_item({**item_sample, **changes})
+
+    assert e.value.field == field
+
+
+def test_normalize_item_rejects_missing_required_field(item_sample):
+    item = dict(item_sample)
+    del item['wb_id']
+
+    with pytest.raises(ItemRejectedError, match='wb_id: missing'):
+        normalize_item(item)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('streaming', [False, True])
+def test_import_sends_bad_items_to_dead_letter_table(sh_stub, streaming):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=30)[0]
+    items = sh_stub.jobs[job_id]['items']
+    items[3] = {**items[3], 'wb_price': 'n/a'}
+    items[17] = {key: value for key, value in items[17].items() if key != 'product_name'}
+
+    indexer = Indexer(job_id=job_id).set_chunk_size_get(10).set_streaming(streaming)
+
+    indexer.prepare_dump()
+
+    # при подготовке отклоненные айтемы только пропускаются
+    assert RejectedItem.objects.count() == 0
+
+    indexer.import_dump()
+    indexer.wrap_dump()
+
+    assert indexer.dump.state_code == Dump.PROCESSED
+    assert indexer.items_processed == 30
+    assert Version.objects.filter(dump=indexer.dump).count() == 28
+    assert sorted(RejectedItem.objects.filter(dump=indexer.dump).values_list('wb_id', 'field')) == sorted([
+        (items[3]['wb_id'], 'wb_price'),
+        (items[17]['wb_id'], 'product_name'),
+    ])
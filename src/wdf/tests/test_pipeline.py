@@ -0,0 +1,179 @@
+import pytest
+import threading
+import time
+import uuid
+from django.db import IntegrityError, connection
+
+from wdf.exceptions import DumpRangeLeaseLostError
+from wdf.indexer import Indexer, guess_wb_article
+from wdf.models import DictBrand, DictParameter, Dump, Parameter, Price, Sku, Version
+from wdf.pipeline import Pipeline, PipelineStage
+
+
+def test_pipeline_passes_all_items_through_stages():
+    results = []
+    lock = threading.Lock()
+
+    def collect(value):
+        with lock:
+            results.append(value)
+
+    pipeline = Pipeline(range(20), [
+        PipelineStage('double', lambda value: value * 2, threads=3),
+        PipelineStage('increment', lambda value: value + 1, threads=2),
+        PipelineStage('collect', collect, threads=0),
+    ], queue_size=1)
+
+    stats = pipeline.run().stats()
+
+    assert sorted(results) == [value * 2 + 1 for value in range(20)]
+    assert [stats[name]['processed'] for name in ('fetch', 'double', 'increment', 'collect')] == [20, 20, 20, 20]
+
+
+def test_pipeline_reports_stalls_of_slow_stage():
+    def slow(value):
+        time.sleep(0.02)
+
+        return value
+
+    stats = Pipeline(range(10), [
+        PipelineStage('fast', lambda value: value, threads=1),
+        PipelineStage('slow', slow, threads=0),
+    ], queue_size=1).run().stats()
+
+    # быстрый этап ждет места в очереди медленного, а медленный входных чанков почти не ждет
+    assert stats['fast']['stall_out'] > stats['slow']['stall_in']
+    assert stats['slow']['busy'] >= 0.2
+
+
+def test_pipeline_stops_on_stage_error():
+    def fail(value):
+        if value == 5:
+            raise ValueError('bad chunk')
+
+        return value
+
+    pipeline = Pipeline(range(1000), [
+        PipelineStage('fail', fail, threads=2),
+        PipelineStage('sink', lambda value: value, threads=0),
+    ], queue_size=1)
+
+    with pytest.raises(ValueError, match='bad chunk'):
+        pipeline.run()
+
+    assert pipeline.stats()['fetch']['processed'] < 1000
+
+
+def test_pipeline_allows_inline_last_stage_only():
+    with pytest.raises(ValueError, match='last pipeline stage'):
+        Pipeline([], [PipelineStage('first', None, threads=0), PipelineStage('last', None, threads=1)])
+
+
+def saved_counts(dump):
+    return (
+        Version.objects.filter(dump=dump).count(),
+        Price.objects.filter(version__dump=dump).count(),
+        Parameter.objects.filter(version__dump=dump).count(),
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('copy_threads', [0, 2])
+def test_pipelined_import_saves_same_rows(sh_stub, copy_threads):
+    if connection.vendor != 'postgresql':
+        pytest.skip('Pipeline threads use their own connections, sqlite test database does not allow that')
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=95)[0]
+    sh_stub.add_job('12345/1/2', sh_stub.jobs[job_id]['items'])
+
+    # конвейер идет первым, по пустой БД: словари создает он
+    for pipelined_job_id, pipelined in (('12345/1/2', True), (job_id, False)):
+        indexer = Indexer(job_id=pipelined_job_id).set_chunk_size_get(10)
+        indexer.set_pipeline(pipelined, queue_size=1, normalize=2, build=2, copy=copy_threads)
+
+        indexer.prepare_dump()
+        indexer.dump.create_ranges(1000)
+        indexer.import_dump()
+        indexer.wrap_dump()
+
+        assert indexer.items_processed == 95
+        assert indexer.dump.state_code == Dump.PROCESSED
+
+    assert saved_counts(Dump.objects.get(job=job_id)) == saved_counts(Dump.objects.get(job='12345/1/2'))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_failed_pipelined_range_leaves_no_versions(sh_stub, mocker):
+    if connection.vendor != 'postgresql':
+        pytest.skip('Pipeline threads use their own connections, sqlite test database does not allow that')
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=95)[0]
+
+    indexer = Indexer(job_id=job_id).set_chunk_size_get(10)
+    indexer.set_pipeline(True, queue_size=1, normalize=2, build=2, copy=2)
+    indexer.prepare_dump()
+    indexer.dump.create_ranges(1000)
+
+    # все чанки уже записаны потоками записи, и диапазон падает при отметке импортированным
+    complete_range = mocker.patch.object(Dump, 'complete_range', side_effect=DumpRangeLeaseLostError('Lease lost'))
+
+    with pytest.raises(DumpRangeLeaseLostError):
+        indexer.import_dump()
+
+    assert complete_range.call_count == 1
+    assert saved_counts(indexer.dump) == (0, 0, 0)
+
+    mocker.stopall()
+
+    # повтор диапазона пишет версии один раз
+    Indexer(job_id=job_id).set_chunk_size_get(10).set_pipeline(True, queue_size=1, normalize=2, build=2, copy=2).import_dump().wrap_dump()
+
+    assert Version.objects.filter(dump=indexer.dump).count() == 95
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pipelined_range_with_foreign_key_violation_leaves_no_versions(sh_stub, mocker):
+    if connection.vendor != 'postgresql':
+        pytest.skip('Pipeline threads use their own connections, sqlite test database does not allow that')
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=95)[0]
+
+    indexer = Indexer(job_id=job_id).set_chunk_size_get(10)
+    indexer.set_pipeline(True, queue_size=1, normalize=2, build=2, copy=2)
+    indexer.prepare_dump()
+    indexer.dump.create_ranges(1000)
+
+    resolve_chunk = Indexer.resolve_chunk
+
+    def resolve_to_deleted_sku(self, items):
+        rows = resolve_chunk(self, items)
+
+        # SKU одного чанка удален, пока диапазон импортируется: внешний ключ нарушен только в одном потоке записи
+        if self.log_prefix.endswith('chunk #5: '):
+            self.skus_cache[next(iter(self.skus_cache))] = uuid.uuid4()
+
+        return rows
+
+    mocker.patch.object(Indexer, 'resolve_chunk', resolve_to_deleted_sku)
+
+    with pytest.raises(IntegrityError):
+        indexer.import_dump()
+
+    assert saved_counts(indexer.dump) == (0, 0, 0)
+
+
+@pytest.mark.django_db
+def test_pipelined_prepare_creates_dictionaries(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=95)[0]
+    items = sh_stub.jobs[job_id]['items']
+
+    # в потоке normalize нет запросов к БД, а resolve при подготовке идет в вызывающем потоке
+    indexer = Indexer(job_id=job_id).set_chunk_size_get(10)
+    indexer.set_pipeline(True, queue_size=1, normalize=2)
+
+    indexer.prepare_dump()
+
+    assert indexer.dump.state_code == Dump.PREPARED
+    assert Sku.objects.count() == len({str(guess_wb_article(item)) for item in items})
+    assert DictBrand.objects.count() == len({item['wb_brand_url'] for item in items if 'wb_brand_url' in item})
+    assert DictParameter.objects.count() > 0
@@ -0,0 +1,57 @@
+import os
+import pstats
+import pytest
+
+from wdf.indexer import Indexer
+from wdf.models import Dump
+from wdf.profiler import ChunkProfiler
+
+
+def test_profiler_writes_stats_and_allocations(tmpdir):
+    profiler = ChunkProfiler('12345/123/12345', chunks=1, directory=str(tmpdir), start=100)
+
+    with profiler.profile(1):
+        sorted([str(i) for i in range(1000)])
+
+    pstats_path = os.path.join(str(tmpdir), '12345-123-12345_import_from100_chunk1.pstats')
+    alloc_path = os.path.join(str(tmpdir), '12345-123-12345_import_from100_chunk1.alloc.txt')
+
+    assert pstats.Stats(pstats_path).total_calls > 0
+    assert os.path.getsize(alloc_path) > 0
+
+
+@pytest.mark.parametrize(('chunk_no', 'expected'), [
+    (1, True),
+    (2, True),
+    (3, False),
+])
+def test_profiler_wants_first_chunks(chunk_no, expected):
+    assert ChunkProfiler('12345/123/12345', chunks=2).wants(chunk_no) is expected
+
+
+@pytest.mark.django_db
+def test_prepare_dump_profiles_first_chunk(tmpdir, dump_sample):
+    dump_sample(state=Dump.CREATED, job_id='12345/123/12345', crawler='wb')
+
+    indexer = Indexer(job_id='12345/123/12345')
+    indexer.set_chunk_size_get(100)
+    indexer.set_profiler(ChunkProfiler('12345/123/12345', chunks=1, directory=str(tmpdir)))
+
+    indexer.prepare_dump()
+
+    assert sorted(os.listdir(str(tmpdir))) == ['12345-123-12345_prepare_from0_chunk1.alloc.txt', '12345-123-12345_prepare_from0_chunk1.pstats']
+
+
+@pytest.mark.django_db
+def test_prepare_and_import_profiles_do_not_overwrite_each_other(tmpdir, dump_sample):
+    dump_sample(state=Dump.CREATED, job_id='12345/123/12345', crawler='wb')
+
+    indexer = Indexer(job_id='12345/123/12345')
+    indexer.set_chunk_size_get(100)
+    indexer.set_profiler(ChunkProfiler('12345/123/12345', chunks=1, directory=str(tmpdir)))
+
+    indexer.prepare_dump()
+    indexer.import_dump()
+
+    assert sorted(name for name in os.listdir(str(tmpdir)) if name.endswith('.pstats')) == [
+        '12345-123-12345_import_from0_chunk1.pstats', '12345-123-12345_prepare_from0_chunk1.pstats']
@@ -0,0 +1,138 @@
+import pytest
+import redis
+import requests
+from prometheus_client import REGISTRY
+
+from wdf.rate_limiter import RateLimitedAdapter, RedisTokenBucket, TokenBucket, get_rate_limiter
+from wdf.sh_client import get_sh_client
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def bucket(clock):
+    return TokenBucket(rate=2, burst=3, clock=clock, sleep=clock.sleep)
+
+
+def test_burst_is_served_without_waiting(bucket, clock):
+    for _ in range(3):
+        assert bucket.acquire() == (0.0, 1.0)
+
+    assert clock.sleeps == []
+
+
+def test_empty_bucket_waits_for_refill(bucket, clock):
+    count_before = REGISTRY.get_sample_value('wdf_sh_rate_limit_wait_seconds_count') or 0
+
+    for _ in range(3):
+        bucket.acquire()
+
+    assert bucket.acquire() == (0.5, 1.0)
+    assert clock.sleeps == [0.5]
+    assert REGISTRY.get_sample_value('wdf_sh_rate_limit_wait_seconds_count') == count_before + 1
+
+
+def test_throttling_slows_bucket_down_and_recovers(bucket, clock):
+    for _ in range(3):
+        bucket.acquire()
+
+    assert bucket.throttled(pause=2) == 0.5
+
+    # за паузу из Retry-After корзина пополнилась по сниженной скорости 1 rps
+    assert bucket.acquire() == (2.0, 0.5)
+    assert bucket.acquire() == (0.0, 0.5)
+    assert bucket.acquire() == (1.0, 0.5)
+    assert clock.sleeps == [2.0, 1.0]
+
+    assert bucket.recovered() == pytest.approx(0.55)
+    assert bucket.throttled() == pytest.approx(0.275)
+
+
+def test_throttling_never_stops_bucket(bucket):
+    for _ in range(100):
+        bucket.throttled()
+
+    assert bucket.factor == bucket.min_factor
+
+
+def test_adapter_reacts_to_throttling(sh_stub, bucket, clock):
+    sh_stub.max_rps = 1
+    before = REGISTRY.get_sample_value('wdf_sh_throttled_responses_total', {'status': '429'}) or 0
+
+    session = requests.Session()
+    session.mount('http://', RateLimitedAdapter(bucket))
+
+    statuses = [session.get(f'{sh_stub.endpoint}jobq/12345/list').status_code for _ in range(2)]
+
+    assert statuses == [200, 429]
+    assert bucket.factor == 0.5
+    assert bucket.blocked_until == clock.now + 1
+    assert REGISTRY.get_sample_value('wdf_sh_throttled_responses_total', {'status': '429'}) == before + 1
+
+
+def test_rate_limiter_is_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('SH_RATE_LIMIT', raising=False)
+
+    assert get_rate_limiter() is None
+
+
+def test_sh_client_uses_rate_limiter(monkeypatch):
+    monkeypatch.setenv('SH_RATE_LIMIT', '5')
+    monkeypatch.setenv('REDIS_URL', '')
+
+    adapter = get_sh_client()._hsclient.session.get_adapter('https://storage.scrapinghub.com/')
+
+    assert isinstance(adapter, RateLimitedAdapter)
+    assert adapter.bucket.rate == 5
+
+
+def test_redis_bucket_is_shared():
+    client = redis.Redis.from_url('redis://localhost:6379/15', socket_connect_timeout=0.2)
+
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip('Redis is not available')
+
+    client.delete('wdf:test_rate_limit')
+
+    first = RedisTokenBucket(client, rate=1, burst=2, key='wdf:test_rate_limit')
+    second = RedisTokenBucket(client, rate=1, burst=2, key='wdf:test_rate_limit')
+
+    assert first.try_acquire()[0] == 0
+    assert second.try_acquire()[0] == 0
+    assert first.try_acquire()[0] > 0
+
+    assert second.throttled() == 0.5
+    assert first.try_acquire()[1] == 0.5
+
+    client.delete('wdf:test_rate_limit')
+
+
+def test_redis_bucket_falls_back_to_memory(clock):
+    client = redis.Redis(port=1, socket_connect_timeout=0.2)
+
+    bucket = RedisTokenBucket(client, rate=2, burst=1, clock=clock, sleep=clock.sleep)
+
+    # Redis не отвечает: корзина процесса с тем же лимитом вместо исключения при каждом запросе
+    assert bucket.try_acquire() == (0.0, 1.0)
+    assert bucket.try_acquire() == (0.5, 1.0)
+    assert bucket.throttled() == 0.5
+    assert bucket.recovered() == 0.55
+    assert not bucket.redis_available
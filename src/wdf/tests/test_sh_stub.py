@@ -0,0 +1,91 @@
+import pytest
+import requests
+import time
+
+from wdf.indexer import Indexer
+from wdf.models import Dump
+from wdf.sh_client import get_sh_client
+from wdf.sh_stub import load_recorded_items
+
+
+@pytest.fixture()
+def stub_job(sh_stub):
+    return sh_stub.add_synthetic_jobs('12345', jobs=1, items=50, tags=['stub'])[0]
+
+
+@pytest.mark.django_db
+def test_indexer_loads_stats_from_stub(sh_stub, stub_job):
+    indexer = Indexer(job_id=stub_job)
+
+    assert indexer.dump.items_crawled == 50
+    assert indexer.dump.crawl_started_at is not None
+    assert indexer.dump.crawl_ended_at > indexer.dump.crawl_started_at
+
+
+@pytest.mark.django_db
+def test_indexer_pages_through_stub_range(sh_stub, stub_job):
+    indexer = Indexer(job_id=stub_job)
+
+    chunks = list(indexer.get_generator(chunk_size=7, start=5, count=20))
+
+    assert [len(chunk) for chunk in chunks] == [7, 7, 6]
+    assert chunks[0][0]['wb_id'] == sh_stub.jobs[stub_job]['items'][5]['wb_id']
+    assert chunks[-1][-1]['wb_id'] == sh_stub.jobs[stub_job]['items'][24]['wb_id']
+
+
+@pytest.mark.django_db
+def test_indexer_imports_whole_dump_from_stub(sh_stub, stub_job):
+    indexer = Indexer(job_id=stub_job)
+    indexer.set_chunk_size_get(20)
+
+    indexer.prepare_dump()
+    indexer.import_dump()
+    indexer.wrap_dump()
+
+    assert indexer.dump.state_code == Dump.PROCESSED
+    assert indexer.dump.get_versions_num() == 50
+
+
+def test_job_list_filters(sh_stub):
+    sh_stub.add_synthetic_jobs('12345', jobs=3, items=1, tags=['stub'])
+    sh_stub.add_job('12345/2/1', [], tags=['other'])
+    sh_stub.add_job('12345/2/2', [], tags=['stub'], state='running')
+
+    jobs = get_sh_client().get_project('12345').jobs.iter(has_tag=['stub'], state='finished')
+
+    assert [job['key'] for job in jobs] == ['12345/1/3', '12345/1/2', '12345/1/1']
+
+
+def test_recorded_dump(sh_stub, current_path):
+    items = load_recorded_items(current_path + '/mocks/scrapinghub_items_wb_raw.msgpack')
+    sh_stub.add_job('12345/123/54321', items)
+
+    assert list(get_sh_client().get_job('12345/123/54321').items.iter()) == items
+
+
+def test_throttling(sh_stub):
+    sh_stub.max_rps = 2
+
+    statuses = [requests.get(f'{sh_stub.endpoint}jobq/12345/list').status_code for _ in range(3)]
+
+    assert statuses == [200, 200, 429]
+    assert sh_stub.requests_throttled == 1
+
+
+def test_latency(sh_stub):
+    sh_stub.latency = 0.1
+
+    start_time = time.time()
+    requests.get(f'{sh_stub.endpoint}jobq/12345/list')
+
+    assert time.time() - start_time >= 0.1
+
+
+def test_bandwidth(sh_stub):
+    sh_stub.add_synthetic_jobs('12345', jobs=1, items=100)
+    sh_stub.bandwidth = 100 * 1024
+
+    start_time = time.time()
+    response = requests.get(f'{sh_stub.endpoint}items/12345/1/1')
+
+    assert time.time() - start_time >= len(response.content) / sh_stub.bandwidth * 0.9
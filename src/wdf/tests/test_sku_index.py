@@ -0,0 +1,185 @@
+import numpy as np
+import pytest
+import struct
+import uuid
+from datetime import timedelta
+from django.db import IntegrityError, connection
+from mixer.backend.django import mixer
+
+from wdf.indexer import Indexer
+from wdf.models import Sku, Version
+from wdf.sku_index import SkuIndex, get_sku_index, parse_copy_binary, reset_sku_index
+
+
+def copy_binary(rows):
+    data = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+
+    for article, sku_id in rows:
+        data += struct.pack('>hiqi', 2, 8, article, 16) + sku_id.bytes
+
+    return data + struct.pack('>h', -1)
+
+
+def filled_index(pairs, merge_size=100):
+    index = SkuIndex(merge_size=merge_size)
+    index.set_rows(
+        np.array([int(article) for article, _ in pairs], dtype=np.int64),
+        np.frombuffer(b''.join(sku_id.bytes for _, sku_id in pairs), dtype='V16'),
+    )
+
+    return index
+
+
+def test_parse_copy_binary():
+    rows = [(300, uuid.uuid4()), (100, uuid.uuid4())]
+
+    articles, ids = parse_copy_binary(copy_binary(rows))
+
+    assert list(articles) == [300, 100]
+    assert [uuid.UUID(bytes=sku_id.tobytes()) for sku_id in ids] == [sku_id for _, sku_id in rows]
+
+
+def test_parse_copy_binary_wrong_signature():
+    with pytest.raises(ValueError, match='signature'):
+        parse_copy_binary(b'COPY' + copy_binary([])[4:])
+
+
+def test_lookup_finds_indexed_articles():
+    first, second, duplicate = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    index = filled_index([('300', first), ('100', second), ('300', duplicate)])
+
+    # из дублей остается первый, нечисловые и с ведущим нулем артикулы в индексе не ищутся
+    assert index.lookup(['100', '200', '300', '0100', 'abc', '']) == {'100': second, '300': first}
+
+
+def test_lookup_in_empty_index():
+    assert SkuIndex().lookup(['100']) == {}
+
+
+def test_add_merges_pending_articles():
+    known = uuid.uuid4()
+    index = filled_index([('500', known)], merge_size=4)
+    new_ids = {article: uuid.uuid4() for article in ('900', '100')}
+
+    index.add(new_ids.items())
+    index.add([('500', uuid.uuid4())])
+
+    assert len(index.pending) == 3
+    assert index.lookup(['100', '500', '900']) == {**new_ids, '500': known}
+
+    index.add([('300', uuid.uuid4()), ('abc', uuid.uuid4())])
+
+    assert index.pending == {}
+    assert list(index.articles) == [100, 300, 500, 900]
+    assert index.lookup(['100', '500', '900']) == {**new_ids, '500': known}
+
+
+def test_discard_removes_articles():
+    first, second = uuid.uuid4(), uuid.uuid4()
+    index = filled_index([('100', first), ('300', second)])
+    index.add([('500', uuid.uuid4())])
+
+    index.discard(['300', '500', '700', 'abc'])
+
+    assert list(index.articles) == [100]
+    assert index.pending == {}
+    assert index.lookup(['100', '300', '500']) == {'100': first}
+
+
+def test_memory_usage():
+    index = filled_index([(str(article), uuid.uuid4()) for article in range(1, 1001)])
+    index.add([('5000', uuid.uuid4())])
+
+    usage = index.memory_usage()
+
+    assert usage['skus'] == 1001
+    assert (usage['articles'], usage['ids']) == (8000, 16000)
+    assert usage['total'] == 24000 + usage['pending']
+
+
+@pytest.fixture()
+def _pg_sku_index():
+    if connection.vendor != 'postgresql':
+        pytest.skip('SKU index is loaded with PG COPY')
+
+    reset_sku_index()
+
+    yield
+
+    reset_sku_index()
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('_pg_sku_index')
+def test_load_sku_index():
+    skus = mixer.cycle(3).blend(Sku, article=(_ for _ in ('11743005', '12381016', 'not-a-number')))
+
+    index = get_sku_index()
+
+    assert index.lookup(['11743005', '12381016', 'not-a-number']) == {sku.article: sku.id for sku in skus[:2]}
+    assert get_sku_index() is index
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures('_pg_sku_index')
+def test_indexer_resolves_skus_through_index(indexer_filled):
+    mixer.blend(Sku, article='11743005')
+
+    indexer_filled.set_sku_index(True)
+    indexer_filled.update_sku_cache(indexer_filled.skus_retrieved)
+
+    index = get_sku_index()
+
+    # известный при загрузке SKU найден в индексе, а не в БД, созданные индексатором добавлены в индекс после коммита
+    assert indexer_filled.timer.chunk_stats.stages['skus_select']['rows'] == 0
+    assert indexer_filled.timer.chunk_stats.stages['skus_reselect']['rows'] == len(indexer_filled.skus_retrieved) - 1
+    assert index.lookup(indexer_filled.skus_retrieved.keys()) == indexer_filled.skus_cache
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures('_pg_sku_index')
+def test_indexer_skips_merged_duplicates(indexer_filled):
+    duplicate = mixer.blend(Sku, article='11743005')
+
+    # индекс загружен, пока дубль еще не слит
+    index = get_sku_index()
+
+    primary = mixer.blend(Sku, article='11743005')
+    Sku.objects.filter(pk=primary.pk).update(created_at=duplicate.created_at - timedelta(days=1))
+
+    Sku.objects.get(pk=primary.pk).merge_duplicates()
+
+    indexer_filled.set_sku_index(True, verify=True)
+    indexer_filled.update_sku_cache(indexer_filled.skus_retrieved)
+
+    assert indexer_filled.skus_cache['11743005'] == primary.id
+    assert index.lookup(['11743005']) == {'11743005': primary.id}
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures('_pg_sku_index')
+def test_stale_sku_index_is_dropped_on_foreign_key_violation(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=30)[0]
+    article = sh_stub.jobs[job_id]['items'][0]['wb_id']
+
+    Indexer(job_id=job_id).prepare_dump()
+
+    # индекс загружен, пока дубль еще не слит; проверка по первичному ключу выключена по умолчанию
+    index = get_sku_index()
+    duplicate = Sku.objects.get(article=article)
+
+    primary = mixer.blend(Sku, article=article)
+    Sku.objects.filter(pk=primary.pk).update(created_at=duplicate.created_at - timedelta(days=1))
+    Sku.objects.get(pk=primary.pk).merge_duplicates()
+
+    with pytest.raises(IntegrityError):
+        Indexer(job_id=job_id).set_sku_index(True).import_dump()
+
+    assert not Version.objects.exists()
+    assert get_sku_index() is not index
+
+    # повтор идет уже по заново загруженному индексу
+    Indexer(job_id=job_id).set_sku_index(True).import_dump()
+
+    assert Version.objects.filter(sku=primary).count() == 1
+    assert Version.objects.count() == 30
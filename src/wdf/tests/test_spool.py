@@ -0,0 +1,122 @@
+import pytest
+
+from wdf.indexer import Indexer, guess_wb_article
+from wdf.models import Dump
+from wdf.spool import DumpSpool, get_dump_spool, get_partition
+from wdf.synthetic import generate_items
+
+
+@pytest.fixture()
+def items():
+    return list(generate_items(45, seed=1))
+
+
+@pytest.fixture()
+def spool(tmp_path, items):
+    spool = DumpSpool(str(tmp_path), '12345/1/1', shard_size=20)
+
+    for _chunk in spool.write(items[i:i + 10] for i in range(0, len(items), 10)):
+        pass
+
+    return spool
+
+
+def test_spool_is_written_in_shards(spool, tmp_path):
+    index = spool.get_index()
+
+    assert spool.is_complete()
+    assert index['items'] == 45
+    assert [block['count'] for block in index['blocks']] == [10, 10, 10, 10, 5]
+    assert sorted(path.name for path in (tmp_path / '12345_1_1').iterdir()) == ['index.json', 'shard-0-0.bin', 'shard-0-20.bin', 'shard-0-40.bin']
+
+
+def test_spool_reads_whole_dump(spool, items):
+    assert [item for chunk in spool.iter_chunks(chunk_size=100) for item in chunk] == items
+
+
+@pytest.mark.parametrize(('start', 'count', 'chunk_sizes'), [
+    (0, 10, [7, 3]),
+    (5, 20, [7, 7, 6]),
+    (38, 100, [7]),
+    (45, 10, []),
+])
+def test_spool_reads_range(spool, items, start, count, chunk_sizes):
+    chunks = list(spool.iter_chunks(chunk_size=7, start=start, count=count))
+
+    assert [len(chunk) for chunk in chunks] == chunk_sizes
+    assert [item for chunk in chunks for item in chunk] == items[start:start + count]
+
+
+def test_interrupted_spool_is_incomplete_and_rewritten(tmp_path, items):
+    spool = DumpSpool(str(tmp_path), '12345/1/1')
+
+    writer = spool.write(iter([items[:10], items[10:]]))
+    next(writer)
+    writer.close()
+
+    assert not spool.is_complete()
+
+    list(spool.write(iter([items])))
+
+    assert spool.is_complete()
+    assert list(spool.iter_chunks(chunk_size=100)) == [items]
+
+
+def test_spool_is_partitioned_by_article(tmp_path, items):
+    spool = DumpSpool(str(tmp_path), '12345/1/1')
+
+    chunks = [items[i:i + 10] for i in range(0, len(items), 10)]
+
+    # воркеру подготовки чанки отдаются в исходном порядке
+    assert list(spool.write(iter(chunks), partitions=3, partition_key=guess_wb_article)) == chunks
+
+    partitions = spool.get_partitions()
+
+    assert [partition['start'] for partition in partitions] == [0, partitions[0]['count'], partitions[0]['count'] + partitions[1]['count']]
+    assert sum(partition['count'] for partition in partitions) == 45
+
+    spooled_items = []
+
+    for partition_no, partition in enumerate(partitions):
+        partition_items = [item for chunk in spool.iter_chunks(start=partition['start'], count=partition['count']) for item in chunk]
+
+        assert {get_partition(guess_wb_article(item), 3) for item in partition_items} == {partition_no}
+
+        spooled_items += partition_items
+
+    assert sorted(item['wb_id'] for item in spooled_items) == sorted(item['wb_id'] for item in items)
+
+
+def test_spool_is_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('INDEXER_SPOOL_DIR', raising=False)
+
+    assert get_dump_spool('12345/1/1') is None
+
+
+@pytest.mark.django_db
+def test_import_reads_ranges_from_spool(sh_stub, monkeypatch, tmp_path):
+    monkeypatch.setenv('INDEXER_SPOOL_DIR', str(tmp_path))
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=50)[0]
+
+    indexer = Indexer(job_id=job_id)
+    indexer.set_chunk_size_get(20)
+    indexer.prepare_dump()
+
+    assert indexer.spool.is_complete()
+
+    requests_served = sh_stub.requests_served
+
+    indexer.dump.create_ranges(30)
+
+    for start in (0, 30):
+        Indexer(job_id=job_id).set_chunk_size_get(20).import_dump(start=start, count=30)
+
+    # диапазоны прочитаны из копии, в Scrapinghub повторно не ходили
+    assert sh_stub.requests_served == requests_served
+
+    indexer.wrap_dump()
+
+    assert indexer.dump.state_code == Dump.PROCESSED
+    assert indexer.dump.get_versions_num() == 50
+    assert not (tmp_path / '12345_1_1').exists()
@@ -0,0 +1,89 @@
+import pytest
+import time
+from django.core.management import call_command
+from io import StringIO
+
+from wdf.stage_timer import StageStats, StageTimer
+
+
+def test_nested_stage_time_is_exclusive():
+    timer = StageTimer()
+
+    with timer.stage('outer'):
+        time.sleep(0.01)
+
+        with timer.stage('inner'):
+            time.sleep(0.02)
+
+    stages = timer.chunk_stats.stages
+
+    assert stages['inner']['duration'] >= 0.02
+    assert stages['outer']['duration'] < stages['inner']['duration']
+    assert timer.chunk_stats.total_duration() >= 0.03
+
+
+def test_iterate_counts_fetch_stage():
+    timer = StageTimer()
+
+    chunks = list(timer.iterate([[1, 2], [3]], 'fetch'))
+
+    assert chunks == [[1, 2], [3]]
+    assert timer.chunk_stats.stages['fetch']['calls'] == 2
+
+
+def test_iterate_excludes_stages_inside_generator():
+    timer = StageTimer()
+
+    def chunks():
+        with timer.stage('collect'):
+            time.sleep(0.02)
+
+        yield [1]
+
+    list(timer.iterate(chunks(), 'fetch'))
+
+    assert timer.chunk_stats.stages['collect']['duration'] >= 0.02
+    assert timer.chunk_stats.stages['fetch']['duration'] < 0.02
+
+
+def test_flush_emits_record_and_resets():
+    timer = StageTimer()
+
+    with timer.stage('collect', rows=10):
+        pass
+
+    timer.add_rows('collect', 5)
+
+    record = timer.flush(job='1/2/3', chunk=1)
+
+    assert record['job'] == '1/2/3'
+    assert record['chunk'] == 1
+    assert record['stages']['collect']['rows'] == 15
+    assert record['stages']['collect']['calls'] == 1
+    assert len(timer.chunk_stats.stages) == 0
+
+
+def test_stats_table():
+    stats = StageStats()
+
+    stats.add('copy', duration=3.0, rows=100)
+    stats.add('collect', duration=1.0, rows=100)
+
+    table = stats.table().splitlines()
+
+    assert table[1].startswith('copy')
+    assert '75.0%' in table[1]
+    assert table[-1].startswith('total')
+
+
+@pytest.mark.django_db
+def test_import_dump_command_prints_timings():
+    out = StringIO()
+
+    call_command('import_dump', '12345/123/12345', chunk_size=100, background='no', timings='yes', stdout=out)
+
+    output = out.getvalue()
+
+    assert 'collect' in output
+    assert 'skus_select' in output
+    assert 'build' in output
@@ -0,0 +1,69 @@
+import json
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+from io import StringIO
+
+from wdf.indexer import guess_wb_article
+from wdf.models import Dump
+from wdf.synthetic import SyntheticIndexer, generate_items
+
+
+def test_generate_items_cardinality():
+    items = list(generate_items(200, catalogs=3, brands=7, features=4))
+
+    assert len(items) == 200
+    assert len({guess_wb_article(item) for item in items}) == 200
+    assert len({item['wb_category_url'] for item in items}) == 3
+    assert len({item['wb_brand_url'] for item in items}) == 7
+    assert all(len(item['features'][0]) == 4 for item in items)
+
+
+def test_generate_items_is_repeatable():
+    assert list(generate_items(10, seed=42)) == list(generate_items(10, seed=42))
+
+
+@pytest.mark.django_db
+def test_benchmark_command_report():
+    out = StringIO()
+
+    call_command('benchmark_indexer', items=30, chunk_size=20, catalogs=2, brands=3, features=5, stdout=out, stderr=StringIO())
+
+    report = json.loads(out.getvalue())
+
+    assert report['items'] == 30
+    assert report['prepare']['rows_per_sec']['wdf_sku'] > 0
+    assert report['import']['rows_per_sec']['wdf_version'] > 0
+    assert report['import']['queries'] > 0
+    assert report['peak_rss_mb'] > 0
+    assert Dump.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_benchmark_command_runs_twice_with_kept_dumps():
+    for _ in range(2):
+        call_command('benchmark_indexer', items=10, chunk_size=10, seed=7, keep='yes', stdout=StringIO(), stderr=StringIO())
+
+    jobs = list(Dump.objects.values_list('job', flat=True))
+
+    assert len(set(jobs)) == 2
+    assert all(job.startswith('bench/7/') and len(job) <= 20 for job in jobs)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('streaming', [False, True])
+def test_synthetic_indexer_reads_only_given_items(mocker, streaming):
+    items = list(generate_items(30, seed=1))
+
+    Dump.objects.create(
+        job='bench/1/1.1', crawler='wb', items_crawled=len(items), crawl_started_at=timezone.now(), crawl_ended_at=timezone.now())
+
+    indexer = SyntheticIndexer(job_id='bench/1/1.1', items=items).set_streaming(streaming)
+    indexer.set_chunk_size_get(20)
+    indexer.sh_client = mocker.Mock(side_effect=AssertionError('Scrapinghub must not be called'))
+
+    indexer.prepare_dump()
+    indexer.import_dump()
+
+    assert not indexer.sh_client.mock_calls
+    assert indexer.dump.get_versions_num() == 30
@@ -0,0 +1,363 @@
+import json
+import pytest
+from celery.exceptions import Retry
+from django.core.management import call_command
+from io import StringIO
+from requests.exceptions import RequestException
+
+from app.celery import celery
+from wdf.exceptions import DumpRangeLeaseLostError, DumpSpoolMissingError, DumpStateTooEarlyError
+from wdf.indexer import Indexer, guess_wb_article
+from wdf.models import Dump, DumpRange
+from wdf.spool import get_dump_spool
+from wdf.synthetic import generate_items
+from wdf.tasks import (
+    RANGE_MAX_ATTEMPTS, build_import_chain, import_dump, import_ranges, import_single_pass, merge_duplicate,
+    prepare_dump, prune_dump, schedule_dump, wrap_dump)
+
+
+@pytest.mark.parametrize(('task', 'queue'), [
+    (prepare_dump, 'prepare'),
+    (import_single_pass, 'prepare'),
+    (schedule_dump, 'schedule'),
+    (import_ranges, 'import'),
+    (import_dump, 'import'),
+    (wrap_dump, 'wrap'),
+    (prune_dump, 'prune'),
+    (merge_duplicate, 'merge'),
+])
+def test_task_routes(task, queue):
+    assert celery.amqp.router.route({}, task.name)['queue'].name == queue
+
+
+@pytest.fixture()
+def group_mock(mocker):
+    return mocker.patch('wdf.tasks.group')
+
+
+@pytest.fixture()
+def stub_dump(sh_stub, group_mock):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    prepare_dump(job_id=job_id)
+    schedule_dump(None, job_id=job_id, group_size=10, workers=8)
+
+    return Dump.objects.get(job=job_id)
+
+
+@pytest.mark.django_db
+def test_schedule_dump_fills_range_queue(stub_dump, group_mock):
+    assert stub_dump.state_code == Dump.SCHEDULED
+    assert [dump_range.start for dump_range in stub_dump.ranges.all()] == [0, 10, 20]
+
+    # воркеров не больше, чем диапазонов
+    assert len(group_mock.call_args[0][0]) == 3
+
+
+@pytest.mark.django_db
+def test_schedule_dump_waits_for_prepare(sh_stub, group_mock):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    Indexer(job_id=job_id)
+
+    # при прямом вызове Celery может отдать как Retry, так и исходное исключение
+    with pytest.raises((Retry, DumpStateTooEarlyError), match='not prepared yet'):
+        schedule_dump(None, job_id=job_id, group_size=10)
+
+    assert group_mock.call_count == 0
+
+
+@pytest.mark.django_db
+def test_last_range_triggers_wrap_once(stub_dump, mocker):
+    delay = mocker.patch('wdf.tasks.wrap_dump.delay')
+
+    import_dump(None, job_id=stub_dump.job, start=20, count=10)
+    import_dump(None, job_id=stub_dump.job, start=0, count=10)
+
+    assert delay.call_count == 0
+
+    import_dump(None, job_id=stub_dump.job, start=10, count=10)
+    import_dump(None, job_id=stub_dump.job, start=10, count=10)
+
+    delay.assert_called_once_with(job_id=stub_dump.job)
+
+    wrap_dump(job_id=stub_dump.job)
+
+    assert Dump.objects.get(pk=stub_dump.pk).state_code == Dump.PROCESSED
+    assert stub_dump.get_progress()['items_imported'] == 25
+
+
+@pytest.mark.django_db
+def test_tasks_queued_before_range_queue(sh_stub, mocker):
+    delay = mocker.patch('wdf.tasks.wrap_dump.delay')
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    prepare_dump(job_id=job_id)
+
+    # у дампа, запланированного старой цепочкой, очереди диапазонов нет
+    Dump.objects.filter(job=job_id).update(state_code=Dump.SCHEDULED)
+
+    for start in [0, 10, 20]:
+        import_dump(None, job_id, start=start, count=10)
+
+    assert delay.call_count == 0
+
+    wrap_dump.apply(args=([job_id] * 3, job_id))
+
+    dump = Dump.objects.get(job=job_id)
+
+    assert dump.get_versions_num() == 25
+    assert dump.state_code == Dump.PROCESSED
+
+
+@pytest.mark.django_db
+def test_import_ranges_drains_queue(stub_dump, mocker):
+    delay = mocker.patch('wdf.tasks.wrap_dump.delay')
+
+    import_ranges(None, job_id=stub_dump.job, workers=1)
+
+    delay.assert_called_once_with(job_id=stub_dump.job)
+    assert stub_dump.get_progress()['ranges_processed'] == 3
+    assert stub_dump.get_versions_num() == 25
+
+
+@pytest.mark.django_db
+def test_failed_range_is_recorded(stub_dump, mocker):
+    mocker.patch('wdf.indexer.Indexer.process_batch', side_effect=ValueError('broken chunk'))
+
+    with pytest.raises(ValueError, match='broken chunk'):
+        import_dump(None, job_id=stub_dump.job, start=10, count=10)
+
+    assert stub_dump.ranges.get(start=10).state_code == DumpRange.ERROR
+
+
+@pytest.mark.django_db
+def test_poison_range_fails_dump(stub_dump, mocker):
+    mocker.patch('wdf.indexer.Indexer.process_batch', side_effect=ValueError('broken chunk'))
+
+    for _attempt in range(RANGE_MAX_ATTEMPTS):
+        with pytest.raises(ValueError, match='broken chunk'):
+            import_dump(None, job_id=stub_dump.job, start=10, count=10)
+
+    assert stub_dump.ranges.get(start=10).attempts == RANGE_MAX_ATTEMPTS
+    assert Dump.objects.get(pk=stub_dump.pk).state_code == Dump.ERROR
+
+    # диапазоны сломанного дампа больше не выдаются
+    import_ranges(None, job_id=stub_dump.job, workers=1)
+
+    assert stub_dump.get_versions_num() == 0
+
+
+@pytest.mark.django_db
+def test_range_crashing_workers_fails_dump(stub_dump):
+    # воркер упал вместе с процессом: ошибка не отмечена, аренда просто истекла
+    for attempt in range(3):
+        assert DumpRange.claim(stub_dump, f'worker-{attempt}', lease_seconds=-1, start=0, max_attempts=3).attempts == attempt + 1
+
+    assert DumpRange.claim(stub_dump, 'worker-3', lease_seconds=60, max_attempts=3) is None
+    assert Dump.objects.get(pk=stub_dump.pk).state_code == Dump.ERROR
+
+
+@pytest.mark.django_db
+def test_lost_lease_rolls_back_range(stub_dump):
+    indexer = Indexer(job_id=stub_dump.job)
+
+    dump_range = DumpRange.claim(stub_dump, 'slow-worker', lease_seconds=-1)
+    DumpRange.claim(stub_dump, 'fast-worker', lease_seconds=60, start=dump_range.start)
+
+    with pytest.raises(DumpRangeLeaseLostError):
+        indexer.import_dump(start=dump_range.start, count=dump_range.count, worker='slow-worker')
+
+    assert stub_dump.get_versions_num() == 0
+    assert stub_dump.ranges.get(start=dump_range.start).leased_by == 'fast-worker'
+
+
+def test_import_chain():
+    signature = build_import_chain(Dump(job='12345/1/1'), 10, workers=2)
+
+    assert [task.name for task in signature.tasks] == [prepare_dump.name, schedule_dump.name]
+    assert signature.tasks[1].kwargs['workers'] == 2
+
+
+def test_single_pass_is_off_by_default():
+    signature = build_import_chain(Dump(job='12345/1/1', items_crawled=10), 10)
+
+    assert [task.name for task in signature.tasks] == [prepare_dump.name, schedule_dump.name]
+
+
+@pytest.mark.parametrize(('items_crawled', 'single_pass', 'tasks'), [
+    (10, 'auto', [import_single_pass.name]),
+    (10, 'no', [prepare_dump.name, schedule_dump.name]),
+    (10 ** 6, 'auto', [prepare_dump.name, schedule_dump.name]),
+    (10 ** 6, 'yes', [import_single_pass.name]),
+])
+def test_import_chain_single_pass(items_crawled, single_pass, tasks, monkeypatch):
+    monkeypatch.setattr('wdf.tasks.SINGLE_PASS_MAX_ITEMS', 20000)
+
+    signature = build_import_chain(Dump(job='12345/1/1', items_crawled=items_crawled), 10, single_pass=single_pass)
+
+    assert [task.name for task in signature.tasks] == tasks
+
+
+@pytest.mark.django_db
+def test_single_pass_import(sh_stub):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    import_single_pass(job_id=job_id)
+
+    dump = Dump.objects.get(job=job_id)
+
+    assert dump.state_code == Dump.PROCESSED
+    assert dump.get_versions_num() == 25
+    assert dump.get_progress()['ranges_processed'] == 1
+    # метаданные задачи и один проход по айтемам
+    assert sh_stub.requests_served == 4
+
+
+@pytest.mark.django_db
+def test_single_pass_import_retried_after_broken_download(sh_stub, mocker, monkeypatch):
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    get_generator = Indexer.get_generator
+
+    def broken_generator(indexer, *args, **kwargs):
+        yield next(iter(get_generator(indexer, *args, **kwargs)))
+
+        raise RequestException('Connection reset by peer')
+
+    monkeypatch.setenv('INDEXER_GET_CHUNK_SIZE', '10')
+    patched = mocker.patch('wdf.indexer.Indexer.get_generator', autospec=True, side_effect=broken_generator)
+
+    with pytest.raises((Retry, RequestException)):
+        import_single_pass(job_id=job_id)
+
+    dump = Dump.objects.get(job=job_id)
+
+    assert dump.state_code == Dump.CREATED
+    assert dump.get_versions_num() == 0
+
+    patched.side_effect = get_generator
+
+    import_single_pass(job_id=job_id)
+
+    assert Dump.objects.get(pk=dump.pk).state_code == Dump.PROCESSED
+    assert dump.get_versions_num() == 25
+
+
+@pytest.mark.django_db
+def test_single_pass_skips_prepared_dump(stub_dump):
+    import_single_pass(job_id=stub_dump.job)
+
+    assert Dump.objects.get(pk=stub_dump.pk).state_code == Dump.SCHEDULED
+    assert stub_dump.get_versions_num() == 0
+
+
+@pytest.mark.django_db
+def test_dump_progress_command(stub_dump, mocker):
+    apply_async = mocker.patch('celery.group.apply_async')
+    stub_dump.complete_range(0, items_imported=10)
+
+    out = StringIO()
+    call_command('dump_progress', job_id=stub_dump.job, requeue='yes', workers=5, stdout=out)
+
+    assert json.loads(out.getvalue().splitlines()[0])['ranges_processed'] == 1
+    assert apply_async.call_count == 1
+    assert 'Job #12345/1/1: 2 workers started for 2 pending ranges' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_partitioned_ranges_own_disjoint_articles(sh_stub, group_mock, monkeypatch, tmp_path):
+    monkeypatch.setenv('INDEXER_SPOOL_DIR', str(tmp_path))
+    monkeypatch.setattr('wdf.tasks.RANGE_MIN_SPLIT', 1)
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    prepare_dump(job_id=job_id, partitions=3)
+    schedule_dump(None, job_id=job_id, group_size=10, workers=8)
+
+    dump = Dump.objects.get(job=job_id)
+    spool = get_dump_spool(job_id)
+    bounds = [(partition['start'], partition['count']) for partition in spool.get_partitions() if partition['count'] > 0]
+
+    assert [(dump_range.start, dump_range.count) for dump_range in dump.ranges.all()] == bounds
+
+    articles = [
+        {guess_wb_article(item) for chunk in spool.iter_chunks(start=start, count=count) for item in chunk} for start, count in bounds]
+
+    assert sum(len(range_articles) for range_articles in articles) == len(set.union(*articles))
+
+    import_ranges(None, job_id=job_id, workers=8)
+
+    # разделы не делятся между воркерами, даже если воркеров больше
+    assert dump.ranges.count() == len(bounds)
+    assert dump.get_progress()['ranges_processed'] == len(bounds)
+    assert dump.get_versions_num() == 25
+
+
+@pytest.mark.django_db
+def test_partitioned_dump_with_malformed_item(sh_stub, group_mock, monkeypatch, tmp_path):
+    monkeypatch.setenv('INDEXER_SPOOL_DIR', str(tmp_path))
+
+    items = list(generate_items(24, seed=1))
+    # длинный wb_id без артикула в ссылке: раздел по артикулу для него не определить
+    items.insert(10, dict(items[0], wb_id='1' * 25, product_url='https://www.wildberries.ru/brands/apple'))
+
+    sh_stub.add_job('12345/1/1', items)
+
+    prepare_dump(job_id='12345/1/1', partitions=3)
+
+    assert sum(partition['count'] for partition in get_dump_spool('12345/1/1').get_partitions()) == 25
+
+    schedule_dump(None, job_id='12345/1/1', group_size=10)
+    import_ranges(None, job_id='12345/1/1')
+
+    dump = Dump.objects.get(job='12345/1/1')
+
+    assert dump.get_versions_num() == 24
+    assert dump.get_rejected_num() == 1
+    assert dump.state_code == Dump.PROCESSED
+
+
+@pytest.mark.django_db
+def test_partitioned_range_fails_without_spool(sh_stub, group_mock, monkeypatch, tmp_path):
+    monkeypatch.setenv('INDEXER_SPOOL_DIR', str(tmp_path))
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    prepare_dump(job_id=job_id, partitions=3)
+    schedule_dump(None, job_id=job_id, group_size=10)
+
+    dump = Dump.objects.get(job=job_id)
+
+    assert dump.partitions == 3
+
+    # например, INDEXER_SPOOL_DIR воркера импорта не общий с воркером подготовки
+    get_dump_spool(job_id).remove()
+    requests_served = sh_stub.requests_served
+
+    with pytest.raises(DumpSpoolMissingError):
+        import_ranges(None, job_id=job_id)
+
+    # смещения разделов не совпадают со смещениями в выгрузке, поэтому в Scrapinghub за айтемами не ходили
+    assert sh_stub.requests_served == requests_served
+    assert dump.ranges.filter(state_code=DumpRange.ERROR).count() == 1
+    assert dump.get_versions_num() == 0
+
+
+@pytest.mark.django_db
+def test_partitioned_dump_is_not_scheduled_without_spool(sh_stub, monkeypatch, tmp_path):
+    monkeypatch.setenv('INDEXER_SPOOL_DIR', str(tmp_path))
+
+    job_id = sh_stub.add_synthetic_jobs('12345', jobs=1, items=25)[0]
+
+    prepare_dump(job_id=job_id, partitions=3)
+    get_dump_spool(job_id).remove()
+
+    with pytest.raises(DumpSpoolMissingError):
+        schedule_dump(None, job_id=job_id, group_size=10)
+
+    dump = Dump.objects.get(job=job_id)
+
+    assert dump.state_code == Dump.PREPARED
+    assert not dump.ranges.exists()
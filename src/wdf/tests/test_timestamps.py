@@ -0,0 +1,40 @@
+import pytest
+import pytz
+from datetime import datetime
+from dateutil.parser import parse as date_parse
+
+from wdf.timestamps import parse_job_time, parse_timestamp
+
+
+@pytest.mark.parametrize('value', [
+    '2020-06-14 18:22:27.854819',
+    '2020-06-14 18:22:27',
+    '2020-06-14T18:22:27.854',
+    '2020-06-14 18:22:27.85',
+    '14.06.2020 18:22:27',
+])
+def test_parse_timestamp_matches_dateutil(value):
+    assert parse_timestamp(value) == pytz.utc.localize(date_parse(value))
+
+
+@pytest.mark.parametrize(('value', 'expected'), [
+    ('2020-06-14T18:22:27+03:00', datetime(2020, 6, 14, 15, 22, 27, tzinfo=pytz.utc)),
+    ('2020-06-14T18:22:27Z', datetime(2020, 6, 14, 18, 22, 27, tzinfo=pytz.utc)),
+])
+def test_parse_timestamp_converts_to_utc(value, expected):
+    assert parse_timestamp(value) == expected
+    assert parse_timestamp(value).tzinfo == pytz.utc
+
+
+def test_parse_timestamp_is_memoized():
+    parse_timestamp.cache_clear()
+
+    parse_timestamp('2020-06-14 18:22:27.854819')
+    parse_timestamp('2020-06-14 18:22:27.854819')
+
+    assert parse_timestamp.cache_info().hits == 1
+
+
+def test_parse_job_time():
+    assert parse_job_time(1597854066275) == pytz.utc.localize(datetime.fromtimestamp(1597854066.275))
+    assert parse_job_time('2020-08-19 16:21:06') == datetime(2020, 8, 19, 16, 21, 6, tzinfo=pytz.utc)
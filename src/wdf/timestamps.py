@@ -0,0 +1,39 @@
+"""
+Разбор дат из айтемов и метаданных задач Scrapinghub.
+
+Паук пишет parse_date в виде str(datetime) – 2020-06-14 18:22:27.854819. Такой формат без потерь разбирает
+datetime.fromisoformat (он написан на C и в десятки раз быстрее dateutil), а все остальное уходит в dateutil.
+Результаты запоминаются в ограниченном кеше: в одной выгрузке даты часто повторяются
+"""
+import pytz
+from datetime import datetime
+from dateutil.parser import parse as date_parse
+from functools import lru_cache
+
+PARSE_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_timestamp(value):
+    """
+    Дата в UTC. Даты без часового пояса считаются датами в UTC
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        parsed = date_parse(value)
+
+    if parsed.tzinfo is None:
+        return pytz.utc.localize(parsed)
+
+    return parsed.astimezone(pytz.utc)
+
+
+def parse_job_time(value):
+    """
+    Время из метаданных задачи (running_time, finished_time): миллисекунды от начала эпохи или строка с датой
+    """
+    if isinstance(value, str):
+        return parse_timestamp(value)
+
+    return pytz.utc.localize(datetime.fromtimestamp(value / 1000))
@@ -0,0 +1,8 @@
+from django.urls import path
+
+from wdf.api import views
+
+app_name = 'wdf'
+urlpatterns = [
+    path('', views.MetricsView.as_view()),
+]
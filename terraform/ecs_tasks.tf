@@ -14,7 +14,9 @@ data "template_file" "container_image_celery" {
     image_name        = aws_ecr_repository.wdf.repository_url
     aws_region        = var.aws_region
     log_stream_prefix = "celery_"
-    command           = "celery -A app worker --concurrency=2 -Ofair"
+    # Очередь prepare здесь разбирают все инстансы сервиса, поэтому импорт за один проход должен оставаться
+    # выключенным (INDEXER_SINGLE_PASS_MAX_ITEMS=0): он пишет словари в длинной транзакции
+    command           = "celery -A app worker -Q celery,prepare,schedule,import,wrap,prune,merge --concurrency=2 -Ofair"
     cpu               = 680
     memory            = 315
 